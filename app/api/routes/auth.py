@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from app.core.auth import Auth
+from app.db.main import run_db
 from app.api.routes.models import LoginCredentials
 from app.core.utils.auth_utils import require_admin
 router = APIRouter()
@@ -11,7 +12,7 @@ async def get_all_users(_: dict = Depends(require_admin)):
         returns all the user details. 
     """
 
-    return Auth.get_all_users()
+    return await run_db(Auth.get_all_users)
 
 @router.post("/")
 async def login(loginCredentials: LoginCredentials):
@@ -19,7 +20,7 @@ async def login(loginCredentials: LoginCredentials):
         logins the user if valid username & password if not returns 401.
     """
 
-    return Auth.login(username=loginCredentials.username, password=loginCredentials.password)
+    return await run_db(Auth.login, username=loginCredentials.username, password=loginCredentials.password)
 
 @router.post("/reset-password", status_code=201)
 async def reset_password(loginCredentials: LoginCredentials):
@@ -27,4 +28,4 @@ async def reset_password(loginCredentials: LoginCredentials):
         reset the password for the given username
     """
 
-    return Auth.reset_password(username=loginCredentials.username, password=loginCredentials.password)
+    return await run_db(Auth.reset_password, username=loginCredentials.username, password=loginCredentials.password)
@@ -1,20 +1,44 @@
 from typing import List
-from fastapi import APIRouter, HTTPException, Query, UploadFile, Form, Body, Depends, BackgroundTasks, Request, File
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, UploadFile, Form, Body, Depends, Request, File, Response
 from app.core.file_manager import FileManager
 from app.api.routes.models import CreateFolderPayload, RenameItemRequest, MoveItemRequest, CopyItemRequest
 from app.core.utils import auth_utils
+from app.db.main import run_db
 
 # router = APIRouter(dependencies=[Depends(auth_utils.verify_token)])
 
 router = APIRouter()
 
 @router.get("/")
-async def list_files(path = Query("", description="Path of the folder to be listed")):
+def list_files(
+    path = Query("", description="Path of the folder to be listed"),
+    sort: str | None = Query(default=None, description="name/size/modified_at, sorts the listing server side"),
+    order: str | None = Query(default=None, description="asc/desc sort the result"),
+    dirs_first: bool = Query(default=True, description="list folders before files when sorting"),
+    limit: int | None = Query(default=None, ge=1, le=1000, description="Page size (1-1000)"),
+    offset: int | None = Query(default=None, ge=0, description="Number of items to skip"),
+    cursor: str | None = Query(default=None, description="next_cursor returned by the previous page"),
+    source: str | None = Query(default=None, description="disk (default) or index, index answers from the db without touching the disk")
+):
     """
-        List all files and directories in the specified path. only one level of files and folders will be returned. 
+        List all files and directories in the specified path. only one level of files and folders will be returned.
         If no path is provided, returns the empty array
+        If any of sort/limit/offset/cursor is given, a sorted page is returned along with total and next_cursor.
+        With source=index the page always comes from the file index.
+    """
+    return FileManager.list_directory(path, sort=sort, order=order, dirs_first=dirs_first, limit=limit, offset=offset, cursor=cursor, source=source)
+
+@router.get("/usage")
+async def get_usage(
+    path = Query("", description="Folder to get the usage of"),
+    limit: int | None = Query(default=None, ge=1, le=500, description="Max children returned, largest first (1-500)")
+):
+    """
+        Recursive size, file and folder count of a folder and of its children (treemap), served from the
+        folder aggregates so it answers instantly without walking the disk.
     """
-    return FileManager.list_directory(path)
+    return await run_db(FileManager.get_usage, path, limit=limit)
 
 @router.get("/metrics")
 async def get_metrics():
@@ -24,27 +48,33 @@ async def get_metrics():
 
     return FileManager.get_metrics()
 
-#@router.post("/")
-async def upload_file(request: Request, path = Query(..., description=""), filename = Query(..., description="")):
+@router.post("/")
+async def upload_file(
+    request: Request,
+    path = Query(..., description="Destination folder"),
+    filename = Query(..., description="Name of the file in the destination folder"),
+    upload_id: str | None = Query(default=None, description="UUID picked by the client to poll /upload-progress with"),
+    token_data: dict = Depends(auth_utils.verify_token)
+):
     """
-        Upload a file to the specified directory.
-        If no path is provided, uploads to the root directory.
+        Upload a file (multipart/form-data, field "file") to the specified directory.
+        The body is streamed to a temp file next to the destination and renamed into place when it's complete.
     """
 
-    return await FileManager.new_start_upload(request, path=path, filename=filename)
+    return await FileManager.new_start_upload(request, path=path, filename=filename, upload_id=upload_id, user=token_data.get("user_id"))
 
-#@router.get("/upload-progress")
-async def get_upload_progress(task_id = Query("", description="task id to be monitored")):
+@router.get("/upload-progress", dependencies=[Depends(auth_utils.verify_token)])
+async def get_upload_progress(task_id = Query("", description="upload id to be monitored")):
     """
-       To get progress of the upload folder
+       Progress of a multipart upload, written/total bytes and status (uploading, done, failed)
     """
 
-    return FileManager.get_upload_progress(task_id)
+    return await run_db(FileManager.get_upload_progress, task_id)
 
 @router.delete("/")
 async def delete_item(path = Query("", description="Full path the file or the directory to delete")):
     """
-        Delete a item/folder at the specified path
+        Delete a item/folder at the specified path, folders are deleted by a background job (202 with its job_id)
     """
     return await FileManager.delete_item(path)
 
@@ -54,40 +84,52 @@ async def create_folder(payload: CreateFolderPayload):
         This will create a folder in the given path
     """
 
-    return FileManager.create_directory(path=payload.path, directory_name=payload.folder_name)
+    return await run_db(FileManager.create_directory, path=payload.path, directory_name=payload.folder_name)
 
 @router.get("/download")
 async def download(path = Query("", description="Path of the file or the folder to be downloaded"), inline = Query(False, description="if true it will be shown in the webview if not it will be downloaded")):
     """
-       To download files/folders
-       TODO - to download the folders
+       To download files/folders, folders are streamed as a zip
     """
 
     return FileManager.download(path, inline)
 
 @router.post("/compress")
-async def compress(background_tasks: BackgroundTasks, path = Query("", description="Path of the file or the folder to be downloaded"), ):
+async def compress(
+    path = Query("", description="Path of the file or the folder to be downloaded"),
+    parallel: bool = Query(True, description="compress on all cores, already compressed files are stored"),
+    level: int | None = Query(default=None, ge=0, le=9, description="compression level 0-9")
+):
     """
-       To compress folders
+       To compress folders, runs as a background job whose id is the task_id
     """
 
-    return FileManager.compress_folder(path, background_tasks)
+    return await run_db(FileManager.compress_folder, path, parallel=parallel, level=level)
 
 @router.get("/compress-progress")
 async def get_compress_progress(task_id = Query("", description="task id to be monitored")):
     """
-       To get progress of the folder compression
+       To get progress of the folder compression, with bytes done/total and throughput
     """
 
-    return FileManager.get_progress(task_id)
+    return await run_db(FileManager.get_progress, task_id)
 
 @router.get("/recent-activity")
-def get_recent_activity():
+def get_recent_activity(
+    response: Response,
+    limit: int | None = Query(default=None, ge=1, le=500, description="Limit to the number of results (1-500)"),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor returned by the previous page"),
+    since: datetime | None = Query(default=None, description="Only return activity at/after this ISO timestamp")
+):
     """
-        To get the recent activity in the Folder1 path
+        To get the recent activity in the Folder1 path, latest event per path, newest first.
+        If there are more results X-Next-Cursor is set, pass it back as cursor for the next page.
     """
 
-    return FileManager.get_recent_activity()
+    events, next_cursor = FileManager.get_recent_activity(limit=limit, cursor=cursor, since=since)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return events
 
 @router.patch("/rename")
 def rename_item(rename_payload: RenameItemRequest):
@@ -100,7 +142,8 @@ def rename_item(rename_payload: RenameItemRequest):
 @router.post("/move")
 def move_item(move_payload: MoveItemRequest):
     """
-        This will move the given file/folder to the given dst folder
+        This will move the given file/folder to the given dst folder. Large moves to another disk run as a
+        background job (202 with its job_id)
     """
 
     return FileManager.move_item(move_payload.path, move_payload.dst_path)
@@ -108,21 +151,25 @@ def move_item(move_payload: MoveItemRequest):
 @router.post("/copy")
 def move_item(copy_payload: CopyItemRequest):
     """
-        This will move the given file/folder to the given dst folder
+        This will copy the given file/folder to the given dst folder. Folders and large files are copied by a
+        background job (202 with its job_id)
     """
 
     return FileManager.copy_item(copy_payload.path, copy_payload.dst_path)
 
 @router.get("/search")
-def search(
+async def search(
+    response: Response,
     query: str = Query(..., description="The keyword that the user wants to search"),
     type: str | None  = Query(default=None, description="To search file/folder"),
-    sort: str | None = Query(default=None, description="The field that user wants to sort"),
+    sort: str | None = Query(default=None, description="The field that user wants to sort, relevance ranks exact/prefix matches first"),
     order: str | None = Query(default=None, description="asc/dsc sort the result"),
     limit: int | None = Query(default=None, ge=1, le=200, description="Limit to the number of results (1-200)")
 ):
     """
         This is a global search function, which will search the entire Folder1 contents. 
+        While the initial index is still being built the results are partial and X-Index-Status is "indexing".
     """
-    
-    return FileManager.search(q=query, type=type, sort=sort, order=order, limit=limit)
+
+    response.headers["X-Index-Status"] = await run_db(FileManager.get_index_state)
+    return await run_db(FileManager.search, q=query, type=type, sort=sort, order=order, limit=limit)
@@ -0,0 +1,97 @@
+import re
+from fastapi import APIRouter, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
+from app.core.utils import progress_store
+from app.core.utils.job_engine import job_engine
+from app.core.utils.progress_stream import progress_hub
+from app.db.main import run_db
+
+router = APIRouter()
+
+JOB_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def _lookup(job_id: str) -> dict | None:
+    """
+        Progress of the job merged with its row in the job queue if it's an engine job (copy, move, delete,
+        compress, reindex, finalize). The row outlives the progress entry, the queue status wins. Blocking.
+    """
+    progress = progress_store.find(job_id)
+    job = job_engine.get(job_id)
+    if job is None:
+        return progress
+    if progress is None:
+        progress = {"id": job_id, "kind": job["kind"], "done": 0, "total": None, "updated_at": job["finished_at"]}
+    return {**progress, "status": job["status"], "error": job["error"], "job": job}
+
+async def _find(job_id: str) -> dict:
+    if not JOB_ID_RE.match(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    job = await run_db(_lookup, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/")
+async def list_jobs(
+    status: str | None = Query(default=None, description="queued/running/done/failed/cancelled"),
+    kind: str | None = Query(default=None, description="copy/move/delete/compress/reindex/finalize"),
+    limit: int = Query(default=100, ge=1, le=500, description="Max jobs returned, newest first (1-500)")
+):
+    """
+        Jobs of the job queue, finished ones are kept JOB_RETENTION_DAYS.
+    """
+    return await run_db(job_engine.list_jobs, status=status, kind=kind, limit=limit)
+
+@router.get("/{job_id}")
+async def get_job(job_id: str = Path(..., description="task/upload id returned when the job was started")):
+    """
+        Last known progress of a background job (copy, move, delete, compress, reindex, multipart upload,
+        TUS upload being moved into place...), engine jobs also have their queue row under "job".
+    """
+    return await _find(job_id)
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str = Path(..., description="job id returned when the job was queued")):
+    """
+        Cancels a queued job right away, a running one stops at its next file/chunk and cleans up after itself.
+    """
+    await _find(job_id)
+    job = await run_db(job_engine.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/{job_id}/retry")
+async def retry_job(job_id: str = Path(..., description="job id returned when the job was queued")):
+    """
+        Queues a failed or cancelled job again.
+    """
+    await _find(job_id)
+    job = await run_db(job_engine.retry, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "queued":
+        raise HTTPException(status_code=409, detail=f"Only failed or cancelled jobs can be retried, this one is {job['status']}")
+    return job
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str = Path(..., description="task/upload id returned when the job was started")):
+    """
+        Server-sent events with the progress of a background job, use it instead of polling.
+
+        event: progress - {status, done, total, percent, bytes_per_second, eta_seconds, ...} whenever it changes
+        event: done / failed / cancelled - the final state, then the stream ends
+        event: gone - the job expired from the progress store
+
+        Updates go out at most every PROGRESS_STREAM_INTERVAL seconds, however many clients are listening.
+    """
+    await _find(job_id)
+    return StreamingResponse(
+        progress_hub.stream(job_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx must not buffer the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
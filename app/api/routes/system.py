@@ -1,6 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from app.core.system_manager import SystemManager
 from app.api.routes.models import SystemMetrics
+from app.db.main import run_db
 
 router = APIRouter()
 
@@ -19,3 +20,22 @@ async def get_filesystem_data():
 @router.get("/smart-info")
 async def get_filesystem_data():
     return SystemManager.get_smart_info()
+
+@router.get("/index-status")
+async def get_index_status():
+    return await run_db(SystemManager.get_index_status)
+
+@router.post("/reconcile", status_code=202)
+async def start_reconcile(full: bool = Query(False, description="compare every entry instead of skipping unchanged folders")):
+    return await run_db(SystemManager.start_reconcile, full=full)
+
+@router.get("/reconcile")
+async def get_reconcile_status():
+    return await run_db(SystemManager.get_reconcile_status)
+
+@router.post("/reindex", status_code=202)
+async def start_reindex():
+    """
+        Queues a full re-index of the storage as a background job, follow it on /api/v1/jobs/{job_id}
+    """
+    return await run_db(SystemManager.start_reindex)
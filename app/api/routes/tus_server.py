@@ -1,39 +1,167 @@
-import os, shutil
-from fastapi import HTTPException
-from tuspyserver.router import create_tus_router
-from app.config import TEMP_UPLOADS_DIR
+import os
+import re
+import json
+import base64
+from uuid import uuid4
+from fastapi import HTTPException, Header, Path, Request, Response, Depends
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from tuspyserver.router import create_tus_router, TusAPIRoute
+from tuspyserver.request import get_request_headers
+from app.config import TEMP_UPLOADS_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_PARALLEL_STREAMS, UPLOAD_PARALLEL_MIN_SIZE
 from app.core.file_manager import FileManager
+from app.core.utils.file_copy import move_file, concat_files, preallocate
+from app.core.utils.upload_checksum import CHECKSUM_ALGORITHMS, CHECKSUM_MISMATCH, RunningHash, parse_upload_checksum, repr_digest, running_hashes
+from app.core.utils.upload_scheduler import upload_scheduler
+from app.core.utils.job_engine import job_engine, JobContext
+from app.core.utils import progress_store
+from app.core.utils.auth_utils import verify_token
+from app.db.main import run_db
 from app.logger import logger
 
-def on_upload_complete(file_path: str, metadata: dict):
+UPLOADS_PREFIX = "/api/v1/uploads"
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,creation-defer-length,creation-with-upload,expiration,termination,concatenation,checksum"
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024 * 1024 # 1 TB max upload size
+
+# tuspyserver upload ids are uuid4().hex
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def decode_metadata(header: str | None) -> dict:
+    """
+        Upload-Metadata is "key base64value,key base64value", values are optional.
+    """
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value.strip()).decode("utf-8") if value.strip() else ""
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Upload-Metadata")
+    return metadata
+
+def upload_destination(metadata: dict) -> str:
+    """
+        returns - the abs path the upload described by metadata (path + filename) ends up at
+    """
+    target_dir = metadata.get("path")
+    filename = metadata.get("filename")
+
+    if not target_dir or not filename:
+        raise HTTPException(status_code=400, detail="Invalid metadata: path or filename missing")
+
+    abs_path = FileManager.validate_path(target_dir)
+
+    if not os.path.isdir(abs_path):
+        raise HTTPException(status_code=400, detail="Destination is not a directory")
+
+    if not FileManager.validate_itemname(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename provided")
+
+    return os.path.join(abs_path, filename)
+
+def read_upload_info(upload_path: str) -> dict:
+    """
+        The tuspyserver sidecar (<uid>.info) of an upload in TEMP_UPLOADS_DIR, {} if there is none.
+    """
     try:
-        target_dir = metadata.get("path")
-        filename = metadata.get("filename")
+        with open(f"{upload_path}.info") as f:
+            return json.load(f) or {}
+    except (OSError, ValueError):
+        return {}
+
+def _progress(uid: str, destination: str):
+    # uploads that are being copied into place from another device
+    def on_progress(copied: int, total: int):
+        progress_store.publish("finalize", uid, done=copied, total=total, destination=destination)
+    return on_progress
+
+def _finished(uid: str, destination: str, error: BaseException | None):
+    if error is None:
+        progress_store.publish("finalize", uid, status="done", destination=destination)
+    else:
+        progress_store.publish("finalize", uid, status="failed", error=str(error), destination=destination)
+
+def finalize_upload(file_path: str, destination: str, checksum: str | None = None):
+    """
+        Moves a finished upload into place and registers it in FileEntry (with its digest if it was computed).
+
+        Same device - one atomic rename. Otherwise the data is copied (copy_file_range/sendfile) into a temp file
+        next to the destination and renamed over it, progress goes to the progress store (kind "finalize").
+    """
+    uid = os.path.basename(file_path)
+
+    logger.info(f"Moving file from {file_path} to {destination}")
+    try:
+        renamed = move_file(file_path, destination, on_progress=_progress(uid, destination))
+    except BaseException as e:
+        _finished(uid, destination, e)
+        raise
+    if not renamed:
+        _finished(uid, destination, None)
+    logger.info(f"Moving completed ({'rename' if renamed else 'copy'})!")
+
+    FileManager.index_file(destination, checksum)
+
+def run_finalize_job(ctx: JobContext) -> dict:
+    """
+        Job handler of "finalize", the final upload of a parallel upload. The partials are stitched into the
+        destination and it's registered in FileEntry.
 
-        if not target_dir or not filename:
-            raise HTTPException(status_code=400, detail="Invalid metadata: path or filename missing")
+        The first partial is renamed into place, the rest are appended with copy_file_range, then the partials
+        and their sidecars are removed. The partials were uploaded side by side, so there is no running digest
+        of the whole file (each PATCH can still be verified with Upload-Checksum). A concatenation that fails or
+        is cancelled puts the first partial back, so it can run again.
+    """
+    partials, destination = ctx.params["partials"], ctx.params["destination"]
 
-        abs_path = FileManager.validate_path(target_dir)
+    # an earlier attempt got as far as the rename, only the cleanup and the index are missing
+    if ctx.attempt > 1 and not os.path.exists(partials[0]) and os.path.isfile(destination):
+        size = os.path.getsize(destination)
+    else:
+        ctx.check()
 
-        if not os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail="Destination is not a directory")
-        
-        if not FileManager.validate_itemname(filename):
-            raise HTTPException(status_code=400, detail="Invalid filename provided")
-        
-        destination = os.path.join(abs_path, filename)
+        def on_progress(copied: int, total: int):
+            ctx.progress(copied, total, destination=destination)
+            ctx.check()
+
+        logger.info(f"Concatenating {len(partials)} partial uploads into {destination}")
+        size = concat_files(partials, destination, on_progress=on_progress)
+
+    for path in partials:
+        for leftover in (path, f"{path}.info"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    FileManager.index_file(destination)
+    logger.info(f"Concatenation completed ({size} bytes)!")
+    return {"path": destination, "bytes": size}
+
+async def on_upload_complete(file_path: str, metadata: dict):
+    # a partial upload of a parallel upload, it stays in the temp dir until the final upload stitches it
+    if read_upload_info(file_path).get("is_partial"):
+        return
+
+    # the digest of the whole upload, fed by upload_checksum with every PATCH body
+    running = running_hashes.pop(os.path.basename(file_path), None)
+    checksum = running.checksum if running is not None and running.offset == os.path.getsize(file_path) else None
+
+    try:
+        destination = upload_destination(metadata)
 
         try:
-            # Move the file from temp to destination
-            logger.info(f"Moving file from {file_path} to {destination}")
-            shutil.move(file_path, destination)
-            logger.info("Moving completed!")
+            await run_in_threadpool(finalize_upload, file_path, destination, checksum)
         except Exception as e:
             logger.error(f"Failed to move file: {str(e)}")
             raise
-        
-        if os.path.exists(file_path):
-            os.remove(file_path)
+
+        # tuspyserver only garbage collects sidecars of uploads whose data file is still there
+        for leftover in (file_path, f"{file_path}.info"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
 
     except Exception as e:
         logger.error(f"Error while uploading the file - {str(e)}")
@@ -42,17 +170,307 @@ def on_upload_complete(file_path: str, metadata: dict):
 def pre_create_hook(metadata: dict, upload_info: dict):
     if "filename" not in metadata:
         raise HTTPException(status_code=400, detail="Filename is required")
-    
+
     if "path" not in metadata:
         raise HTTPException(status_code=400, detail="Upload Path is required")
 
+async def pre_create_dep(upload_concat: str | None = Header(None)):
+    """
+        Partial uploads carry no filename/path, the final upload that concatenates them does.
+    """
+    if upload_concat is not None and upload_concat.strip() == "partial":
+        return lambda metadata, upload_info: None
+    return pre_create_hook
+
+async def upload_file_dep(upload_length: int | None = Header(None), upload_concat: str | None = Header(None)):
+    """
+        Picks the upload id on creation so the temp file can be preallocated from Upload-Length before the
+        first PATCH appends to it (the blocks are reserved with KEEP_SIZE, the offset tuspyserver reads stays 0).
+    """
+    is_partial = upload_concat is not None and upload_concat.strip() == "partial"
+
+    def create_file(metadata: dict):
+        # PATCH/HEAD/DELETE call this with no metadata, and deferred-length uploads have nothing to reserve
+        if not (metadata or is_partial) or not upload_length or upload_length > MAX_UPLOAD_SIZE:
+            return None
+
+        uid = uuid4().hex
+        try:
+            preallocate(os.path.join(TEMP_UPLOADS_DIR, uid), upload_length)
+        except OSError as e:
+            # e.g. ENOSPC, let tuspyserver create the file and fail on write like it did before
+            logger.warning(f"Could not preallocate {upload_length} bytes for upload {uid} - {e}")
+        return {"uid": uid}
+
+    return create_file
+
+def _tus_request(request: Request) -> tuple[str | None, str]:
+    """
+        returns - (upload id from the url or None, method with X-HTTP-Method-Override applied)
+    """
+    uid = request.path_params.get("uuid")
+    method = request.method.upper()
+    override = request.headers.get("x-http-method-override")
+    if override:
+        method = override.strip().upper()
+    if uid is not None and not UPLOAD_ID_RE.match(uid):
+        uid = None
+    return uid, method
+
+async def upload_admission(request: Request, token_data: dict = Depends(verify_token)):
+    """
+        Router level dependency of the tus routes (runs before tuspyserver reads the body): every PATCH needs a
+        slot from the upload scheduler for as long as it writes. Without one the client gets a 503 with its queue
+        position and a Retry-After and resends the same PATCH later, nothing has been written at that point.
+    """
+    uid, method = _tus_request(request)
+
+    if uid and method == "DELETE":
+        upload_scheduler.cancel(uid)
+    if not uid or method != "PATCH":
+        yield
+        return
+
+    path = os.path.join(TEMP_UPLOADS_DIR, uid)
+    try:
+        start = os.path.getsize(path)
+    except OSError:
+        # unknown upload, tuspyserver answers with the 404
+        yield
+        return
+
+    def measure():
+        try:
+            return os.path.getsize(path) - start
+        except OSError:
+            # the PATCH completed the upload and it was moved into place, it wrote the whole body
+            return int(request.headers.get("content-length") or 0)
+
+    admission = upload_scheduler.try_acquire(uid, token_data.get("user_id"), kind="tus", measure=measure)
+    if not admission.granted:
+        raise HTTPException(status_code=503, detail="Upload queued, retry later", headers=admission.headers())
+    try:
+        yield
+    finally:
+        upload_scheduler.release(uid)
+
+async def upload_checksum(request: Request, response: Response):
+    """
+        Router level dependency of the tus routes, the checksum extension and the running digest of every upload.
+
+        The PATCH body is hashed on its way from the ASGI receive channel to tuspyserver, so nothing is read back
+        from disk. A chunk sent with "Upload-Checksum: <algorithm> <base64>" that doesn't match is refused with
+        460 before its last bytes are written, what was already appended is cut off again and the offset stays
+        where it was, the client resends the chunk. The PATCH that completes the upload answers with the digest of
+        the whole file in Repr-Digest.
+    """
+    uid, method = _tus_request(request)
+
+    if uid and method == "DELETE":
+        running_hashes.pop(uid, None)
+    if not uid or method != "PATCH":
+        yield
+        return
+
+    path = os.path.join(TEMP_UPLOADS_DIR, uid)
+    try:
+        start = os.path.getsize(path)
+    except OSError:
+        yield
+        return
+
+    header = request.headers.get("upload-checksum")
+    chunk_hash, expected = parse_upload_checksum(header) if header else (None, None)
+    size = read_upload_info(path).get("size")
+
+    running = running_hashes.get(uid)
+    if running is not None and running.offset != start:
+        # the file moved on without us (PATCHes handled by another worker), there is no digest for it anymore
+        running_hashes.pop(uid)
+        running = None
+    elif running is None and start == 0:
+        running = running_hashes[uid] = RunningHash()
+    snapshot = running.copy() if running is not None else None
+
+    receive = request._receive
+
+    async def hashing_receive():
+        message = await receive()
+        if message["type"] == "http.request":
+            body = message.get("body", b"")
+            if chunk_hash is not None:
+                chunk_hash.update(body)
+            if running is not None:
+                running.update(body)
+            if not message.get("more_body", False):
+                if chunk_hash is not None and chunk_hash.digest() != expected:
+                    raise HTTPException(status_code=CHECKSUM_MISMATCH, detail="Checksum Mismatch")
+                if running is not None and running.offset == size:
+                    response.headers["Repr-Digest"] = repr_digest(running.checksum)
+        return message
+
+    request._receive = hashing_receive
+    try:
+        yield
+    except Exception:
+        # tuspyserver doesn't save the offset of a refused chunk, drop what it appended so the retry lines up
+        if os.path.exists(path) and read_upload_info(path).get("offset") == start and os.path.getsize(path) > start:
+            os.truncate(path, start)
+        if snapshot is not None:
+            running_hashes[uid] = snapshot
+        raise
+    else:
+        if running is not None and uid in running_hashes and os.path.exists(path) and os.path.getsize(path) != running.offset:
+            running_hashes.pop(uid, None)
+
+class FinalUploadRoute(TusAPIRoute):
+    """
+        Only matches POSTs with "Upload-Concat: final;...", so the final upload of a parallel upload is handled
+        by create_final_upload and every other creation falls through to tuspyserver.
+    """
+
+    def matches(self, scope):
+        for name, value in scope.get("headers", []):
+            if name.lower() == b"upload-concat" and value.strip().startswith(b"final;"):
+                return super().matches(scope)
+        return Match.NONE, {}
+
+def _finished_partial(uid: str) -> str:
+    if not UPLOAD_ID_RE.match(uid):
+        raise HTTPException(status_code=400, detail=f"Invalid partial upload: {uid}")
+
+    path = os.path.join(TEMP_UPLOADS_DIR, uid)
+    info = read_upload_info(path)
+    if not os.path.isfile(path) or not info:
+        raise HTTPException(status_code=404, detail=f"Partial upload not found: {uid}")
+    if not info.get("is_partial"):
+        raise HTTPException(status_code=400, detail=f"Upload {uid} is not a partial upload")
+    if info.get("size") is None or info.get("offset") != info.get("size") or os.path.getsize(path) != info.get("size"):
+        raise HTTPException(status_code=400, detail=f"Partial upload {uid} is not complete")
+    return path
+
+async def create_final_upload(
+    request: Request,
+    response: Response,
+    upload_concat: str = Header(...),
+    upload_metadata: str | None = Header(None),
+    upload_length: int | None = Header(None),
+    tus_resumable: str | None = Header(None),
+):
+    """
+        Concatenation extension, final upload - the partials are stitched straight into the destination.
+
+        tuspyserver would copy every partial through python on the event loop into a new temp file and then move
+        that, this queues a "finalize" job that renames the first partial into place and appends the others with
+        copy_file_range. The 201 is sent as soon as the job is queued, stitching a large file would outlast the
+        proxy timeout. The Location is the job (its progress is on /api/v1/jobs too), HEAD on it has the
+        Upload-Offset once the file is in place.
+    """
+    if tus_resumable != TUS_VERSION:
+        raise HTTPException(status_code=412, detail=f"Unsupported version. Expected {TUS_VERSION}", headers={"Tus-Version": TUS_VERSION})
+
+    if upload_length is not None:
+        raise HTTPException(status_code=400, detail="Upload-Length header must not be included for final concatenated uploads")
+
+    metadata = decode_metadata(upload_metadata)
+    pre_create_hook(metadata, {})
+    destination = upload_destination(metadata)
+
+    uids = [url.rstrip("/").rsplit("/", 1)[-1] for url in upload_concat.strip()[len("final;"):].split()]
+    if not uids:
+        raise HTTPException(status_code=400, detail="Upload-Concat final header must specify partial uploads")
+    if len(set(uids)) != len(uids):
+        raise HTTPException(status_code=400, detail="Upload-Concat final header lists a partial upload twice")
+
+    partial_paths = [_finished_partial(uid) for uid in uids]
+    length = sum(read_upload_info(path)["size"] for path in partial_paths)
+
+    job_id = await run_db(job_engine.submit, "finalize", {
+        "partials": partial_paths, "destination": destination, "length": length, "concat": upload_concat.strip(),
+    })
+
+    response.headers["Location"] = get_request_headers(request=request, uuid=f"final/{job_id}", prefix=UPLOADS_PREFIX)["location"]
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    response.headers["Upload-Length"] = str(length)
+    response.headers["Content-Length"] = "0"
+    response.status_code = 201
+    return response
+
+async def final_upload_head(response: Response, job_id: str = Path(...), tus_resumable: str | None = Header(None)):
+    """
+        HEAD on a final upload. Upload-Offset is only sent once the partials are stitched and the file is in place,
+        while the job is queued or running the client polls again. 410 if the concatenation failed or was cancelled.
+    """
+    if tus_resumable != TUS_VERSION:
+        raise HTTPException(status_code=412, detail=f"Unsupported version. Expected {TUS_VERSION}", headers={"Tus-Version": TUS_VERSION})
+
+    job = await run_db(job_engine.get, job_id)
+    if job is None or job["kind"] != "finalize":
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if job["status"] in ("failed", "cancelled"):
+        raise HTTPException(status_code=410, detail=job["error"] or f"Concatenation {job['status']}")
+
+    response.headers["Upload-Concat"] = job["params"]["concat"]
+    response.headers["Upload-Length"] = str(job["params"]["length"])
+    if job["status"] == "done":
+        response.headers["Upload-Offset"] = str(job["params"]["length"])
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    response.status_code = 200
+    return response
+
+async def upload_options(response: Response, tus_resumable: str | None = Header(None)):
+    """
+        Same as tuspyserver's OPTIONS plus the checksum extension, which upload_checksum implements.
+    """
+    if tus_resumable is not None and tus_resumable != TUS_VERSION:
+        raise HTTPException(status_code=412, detail=f"Unsupported version. Expected {TUS_VERSION}", headers={"Tus-Version": TUS_VERSION})
+
+    response.headers["Tus-Version"] = TUS_VERSION
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    response.headers["Tus-Extension"] = TUS_EXTENSIONS
+    response.headers["Tus-Max-Size"] = str(MAX_UPLOAD_SIZE)
+    response.headers["Tus-Checksum-Algorithm"] = ",".join(CHECKSUM_ALGORITHMS)
+    response.status_code = 204
+    return response
+
+async def upload_config():
+    """
+        What clients should use for uploads: chunk size of each PATCH, how many partial uploads to run in parallel
+        (concatenation extension) and from which size on.
+    """
+    return {
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "parallel_uploads": UPLOAD_PARALLEL_STREAMS,
+        "parallel_min_size": UPLOAD_PARALLEL_MIN_SIZE,
+        "max_size": MAX_UPLOAD_SIZE,
+    }
+
 router = create_tus_router(
     files_dir=TEMP_UPLOADS_DIR,
-    max_size=1024 * 1024 * 1024 * 1024, # 1 TB max upload size
+    max_size=MAX_UPLOAD_SIZE,
     days_to_keep=1,
     on_upload_complete=on_upload_complete,
-    pre_create_hook=pre_create_hook,
-    prefix="/api/v1/uploads"
+    pre_create_dep=pre_create_dep,
+    file_dep=upload_file_dep,
+    prefix=UPLOADS_PREFIX
 )
 
+# in front of tuspyserver's creation and OPTIONS routes, FinalUploadRoute only matches final concatenation requests
+for path in ("", "/"):
+    router.add_api_route(path, create_final_upload, methods=["POST"], status_code=201, route_class_override=FinalUploadRoute)
+    router.routes.insert(0, router.routes.pop())
+router.add_api_route("/", upload_options, methods=["OPTIONS"], status_code=204)
+router.routes.insert(0, router.routes.pop())
+router.add_api_route("/final/{job_id}", final_upload_head, methods=["HEAD"])
+
+async def upload_metrics():
+    """
+        Upload scheduler state: concurrency limit, measured write throughput, queue depth and per-upload rates.
+    """
+    return upload_scheduler.metrics()
+
+router.add_api_route("/config", upload_config, methods=["GET"])
+router.add_api_route("/metrics", upload_metrics, methods=["GET"])
 
+job_engine.register("finalize", run_finalize_job, "io")
@@ -29,7 +29,77 @@ HARDDISKS_INFO_FILE = os.path.join(JSON_DIR, "hard_disks_info.json")
 SMART_INFO_FILE = os.path.join(JSON_DIR, "smart_info.json")
 FILESYSTEM_INFO_FILE = os.path.join(JSON_DIR, "file_systems_info.json")
 SYSTEMS_METRICS_FILE = os.path.join(JSON_DIR, "systems_metrics.json")
-RECENT_ACTIVITY_FILE = os.path.join(JSON_DIR, "storagepod_recent_activity.json")
+
+# How often the FileEntry table is reconciled with the disk, 0 disables the schedule
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get("RECONCILE_INTERVAL_SECONDS", 15 * 60))
+
+# In-process filesystem watcher that keeps FileEntry and the recent activity live
+WATCHER_ENABLED = os.environ.get("WATCHER_ENABLED", "1") not in {"0", "false", "False"}
+WATCHER_DEBOUNCE_SECONDS = float(os.environ.get("WATCHER_DEBOUNCE_SECONDS", 1.0))
+ACTIVITY_RETENTION_DAYS = int(os.environ.get("ACTIVITY_RETENTION_DAYS", 7))
+
+# Folder compression, parallel mode deflates COMPRESS_WORKERS members at a time
+COMPRESS_MAX_JOBS = int(os.environ.get("COMPRESS_MAX_JOBS", 2))
+COMPRESS_WORKERS = int(os.environ.get("COMPRESS_WORKERS", os.cpu_count() or 1))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+
+# TUS uploads, the chunk size and number of parallel partial uploads are advertised to clients
+# in GET /api/v1/uploads/config, big chunks keep the per-PATCH overhead low on a fast LAN
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 64 * 1024 * 1024))
+UPLOAD_PARALLEL_STREAMS = int(os.environ.get("UPLOAD_PARALLEL_STREAMS", 4))
+# uploads smaller than this are not worth splitting into partial uploads
+UPLOAD_PARALLEL_MIN_SIZE = int(os.environ.get("UPLOAD_PARALLEL_MIN_SIZE", 256 * 1024 * 1024))
+
+# multipart uploads, the body is written in blocks of this size off the event loop and the UploadTask
+# progress row is updated every UPLOAD_PROGRESS_INTERVAL bytes
+UPLOAD_WRITE_BUFFER = int(os.environ.get("UPLOAD_WRITE_BUFFER", 8 * 1024 * 1024))
+UPLOAD_PROGRESS_INTERVAL = int(os.environ.get("UPLOAD_PROGRESS_INTERVAL", 16 * 1024 * 1024))
+
+# job/progress rows (app.core.utils.progress_store) are kept this long after their last update, progress of a
+# running job is written at most every PROGRESS_UPDATE_INTERVAL seconds
+PROGRESS_TTL_SECONDS = int(os.environ.get("PROGRESS_TTL_SECONDS", 60 * 60))
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", 0.5))
+# progress streams (GET /api/v1/jobs/{id}/events) read a job at most every PROGRESS_STREAM_INTERVAL seconds per
+# worker however many clients watch it, and send a keep-alive every PROGRESS_STREAM_HEARTBEAT seconds
+PROGRESS_STREAM_INTERVAL = float(os.environ.get("PROGRESS_STREAM_INTERVAL", 1))
+PROGRESS_STREAM_HEARTBEAT = float(os.environ.get("PROGRESS_STREAM_HEARTBEAT", 15))
+
+# Background jobs (app.core.utils.job_engine), threads per job class: io - copy/move/delete, cpu - compress,
+# index - reindex. A job that failed on a transient error is retried JOB_MAX_ATTEMPTS times in all, waiting
+# JOB_RETRY_DELAY seconds (doubled every attempt). Finished jobs are kept JOB_RETENTION_DAYS
+JOB_IO_WORKERS = int(os.environ.get("JOB_IO_WORKERS", 2))
+JOB_CPU_WORKERS = int(os.environ.get("JOB_CPU_WORKERS", COMPRESS_MAX_JOBS))
+JOB_INDEX_WORKERS = int(os.environ.get("JOB_INDEX_WORKERS", 1))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 30))
+# how often the engine looks for jobs queued by other workers
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+JOB_RETENTION_DAYS = int(os.environ.get("JOB_RETENTION_DAYS", 7))
+# copies smaller than this run inside the request, bigger ones (and folder deletes, cross-device moves) are jobs
+JOB_INLINE_MAX_BYTES = int(os.environ.get("JOB_INLINE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Copies (copy jobs, cross-device moves), files up to COPY_PARALLEL_MAX_BYTES are copied COPY_WORKERS at a time,
+# bigger ones one at a time so the disk streams them instead of seeking between them
+COPY_WORKERS = int(os.environ.get("COPY_WORKERS", 4))
+COPY_PARALLEL_MAX_BYTES = int(os.environ.get("COPY_PARALLEL_MAX_BYTES", 8 * 1024 * 1024))
+# moves across devices check every copied file against the checksum stored for it (uploads have one), with this set
+# the files without one are hashed on both sides too, which reads everything twice
+MOVE_VERIFY_CHECKSUMS = os.environ.get("MOVE_VERIFY_CHECKSUMS", "0") not in {"0", "false", "False"}
+
+# Upload admission control, see app.core.utils.upload_scheduler
+UPLOAD_MIN_CONCURRENCY = int(os.environ.get("UPLOAD_MIN_CONCURRENCY", 1))
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get("UPLOAD_MAX_CONCURRENCY", 8))
+UPLOAD_START_CONCURRENCY = int(os.environ.get("UPLOAD_START_CONCURRENCY", 3))
+UPLOAD_MIN_FREE_MEMORY = int(os.environ.get("UPLOAD_MIN_FREE_MEMORY", 128 * 1024 * 1024))
+UPLOAD_ADJUST_INTERVAL = float(os.environ.get("UPLOAD_ADJUST_INTERVAL", 5))
+# how long a queued upload keeps its place without the client coming back
+UPLOAD_TICKET_TTL = float(os.environ.get("UPLOAD_TICKET_TTL", 60))
+
+# SQLite tuning, see app.db.main
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 10000))
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 16 * 1024))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 128 * 1024 * 1024))
 
 class Settings(BaseSettings):
     SECRET_KEY: str
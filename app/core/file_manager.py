@@ -1,27 +1,38 @@
-import os, asyncio
+import os
+import errno
 import shutil
+import time
 from datetime import datetime, timezone
-from fastapi import HTTPException, BackgroundTasks, status, Request
-from fastapi.responses import FileResponse, JSONResponse
-from app.config import STORAGE_DIR, METRICS_FILE, RECENT_ACTIVITY_FILE
+from fastapi import HTTPException, status, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from urllib.parse import quote
+from app.config import STORAGE_DIR, METRICS_FILE, COMPRESS_WORKERS, COMPRESS_LEVEL, JOB_INLINE_MAX_BYTES, MOVE_VERIFY_CHECKSUMS
 from pathlib import Path
 import mimetypes
 import json
 import uuid
 import zipfile
-from typing import Dict
-from app.core.utils.upload_tasks import UPLOAD_SEMAPHORE, fail_task, init_task, complete_task, get_task_status
-from app.core.utils.file_utils import TrackingFileTarget, SingleFileStreamingParser, ProgressFileTarget
-from streaming_form_data import StreamingFormDataParser
-from streaming_form_data.targets import FileTarget
+from app.core.utils.upload_tasks import fail_task, init_task, complete_task, get_task_status
+from app.core.utils.file_utils import SingleFileStreamingParser
+from app.core.utils import listing_utils, activity_store, zip_stream, progress_store
+from app.db import folder_stats
+from app.core.utils.zip_parallel import ParallelZipWriter
+from app.core.utils.http_files import RangeFileResponse
+from app.core.utils.upload_scheduler import upload_scheduler
+from app.core.utils.file_copy import copy_file, copy_file_checkpointed, copy_tree, move_file, part_path
+from app.core.utils.upload_checksum import file_checksum
+from app.core.utils.job_engine import job_engine, JobContext
+from app.core.utils.indexer import index_job, path_row, upsert_rows, iter_tree, INDEX_BATCH_SIZE
+from app.core.utils.db_utils import move_subtree_statement, delete_subtree_statement
 from app.logger import logger
-from app.db.main import get_session
+from app.db.main import get_session, db_writer
 from app.db.models import FileEntry
-from sqlmodel import select, or_
+from sqlmodel import select
+from sqlalchemy import case, func, literal_column
+from app.db import search_index
 from starlette.requests import ClientDisconnect
 
-progress_store: Dict[str, int] = {}
-upload_tasks: Dict[str, Dict] = {}
 
 class FileManager:
 
@@ -126,6 +137,7 @@ class FileManager:
         entry = FileEntry(
             file_id=info["id"],
             path=info["path"],
+            parent_path=os.path.dirname(info["path"]),
             name=info["name"],
             type="folder" if info["is_directory"] else "file",
             size=info["size"],
@@ -134,36 +146,375 @@ class FileManager:
         session.merge(entry)
 
     @staticmethod
-    def list_directory(path):
+    def index_file(full_path: str, checksum: str | None = None):
+        """
+            Upserts the FileEntry row of a file that was just written (upload finished) through the db writer,
+            with the digest computed while it was written if there is one.
+        """
+        row = path_row(full_path, os.path.relpath(full_path, STORAGE_DIR), datetime.now())
+        row["checksum"] = checksum
+        db_writer.run(lambda session: upsert_rows(session, [row]))
+
+    @staticmethod
+    def _relocate(abs_src: str, abs_dst: str):
+        """
+            Moves abs_src to abs_dst and re-roots its FileEntry rows with one UPDATE.
+
+            On the same device the UPDATE and the rename run in one transaction, if the rename fails the
+            UPDATE is rolled back. Across devices (EXDEV) the data is copied (move_file for a file, shutil.move for
+            a folder), the old rows are dropped and the new tree is indexed since every inode changed.
+        """
+        old_rel_path = os.path.relpath(abs_src, STORAGE_DIR)
+        new_rel_path = os.path.relpath(abs_dst, STORAGE_DIR)
+
+        with get_session() as session:
+            # rows left at the destination by changes made outside the API
+            session.execute(delete_subtree_statement(new_rel_path))
+            session.execute(move_subtree_statement(old_rel_path, new_rel_path))
+            try:
+                os.rename(abs_src, abs_dst)
+            except OSError as e:
+                session.rollback()
+                if e.errno != errno.EXDEV:
+                    raise
+            else:
+                session.commit()
+                return
+
+        if os.path.isdir(abs_src) and not os.path.islink(abs_src):
+            shutil.move(abs_src, abs_dst)
+        else:
+            move_file(abs_src, abs_dst)
+
+        with get_session() as session:
+            session.execute(delete_subtree_statement(old_rel_path))
+            session.execute(delete_subtree_statement(new_rel_path))
+            FileManager._index_tree(session, abs_dst, new_rel_path)
+
+    @staticmethod
+    def _index_tree(session, abs_path: str, rel_path: str):
+        """
+            Upserts the row of abs_path and, for a folder, of everything below it, committing every
+            INDEX_BATCH_SIZE rows.
+        """
+        rows = [path_row(abs_path, rel_path, datetime.now())]
+        if os.path.isdir(abs_path) and not os.path.islink(abs_path):
+            for row in iter_tree(abs_path, rel_root=rel_path):
+                rows.append(row)
+                if len(rows) >= INDEX_BATCH_SIZE:
+                    upsert_rows(session, rows)
+                    session.commit()
+                    rows = []
+        upsert_rows(session, rows)
+        session.commit()
+
+    @staticmethod
+    def _remove(abs_path: str):
+        """
+            Deletes a file or a whole folder, nothing if it's already gone.
+        """
+        if os.path.isdir(abs_path) and not os.path.islink(abs_path):
+            shutil.rmtree(abs_path)
+        elif os.path.lexists(abs_path):
+            os.remove(abs_path)
+
+    @staticmethod
+    def _discard_copy(abs_path: str):
+        """
+            Removes a copy that didn't complete and the rows it was indexed with so far.
+        """
+        FileManager._remove(abs_path)
+        rel_path = os.path.relpath(abs_path, STORAGE_DIR)
+        db_writer.run(lambda session: session.execute(delete_subtree_statement(rel_path)))
+
+    @staticmethod
+    def _queue_job(kind: str, params: dict, path: str) -> JSONResponse:
+        """
+            Queues a job for a long operation. returns - 202 with the job id to follow it on /api/v1/jobs
+        """
+        job_id = job_engine.submit(kind, params)
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "path": path})
+
+    @staticmethod
+    def _copy_tree(abs_src: str, abs_dst: str, ctx: JobContext, checkpoint: bool = False) -> int:
+        """
+            Copies a file or a folder with its contents to abs_dst with file_copy, reporting bytes done/total to the
+            job and stopping at the next file/chunk when it's cancelled.
+
+            Every entry is indexed as it lands, INDEX_BATCH_SIZE rows at a time through the db writer, so the copy
+            isn't walked again to index it. The caller drops the rows if the copy doesn't complete.
+
+            checkpoint - abs_dst may hold what an interrupted attempt copied, the files already there are kept. Every
+                         file is checked against the checksum stored for the source before it gets its name (or, with
+                         MOVE_VERIFY_CHECKSUMS, against a hash of the source) and the checksum is carried over.
+            returns - the number of bytes copied
+        """
+        now = datetime.now()
+        rows = []
+
+        def flush():
+            batch = list(rows)
+            rows.clear()
+            db_writer.run(lambda session: upsert_rows(session, batch))
+
+        def stored_checksum(src_path: str) -> str | None:
+            with get_session() as session:
+                entry = session.exec(
+                    select(FileEntry).where(FileEntry.path == os.path.relpath(src_path, STORAGE_DIR))
+                ).first()
+            if entry is None or entry.checksum is None:
+                return None
+            # only while it still describes what's on disk, the watcher may not have caught up with a change
+            stats = os.stat(src_path)
+            if entry.size != stats.st_size or entry.modified_at != datetime.fromtimestamp(stats.st_mtime):
+                return None
+            return entry.checksum
+
+        def verify(src_path: str, tmp_path: str):
+            expected = stored_checksum(src_path)
+            if expected is None:
+                if not MOVE_VERIFY_CHECKSUMS:
+                    return
+                expected = file_checksum(src_path)
+            if file_checksum(tmp_path, expected.partition(":")[0]) != expected:
+                raise OSError(errno.EIO, f"Copy of {src_path} doesn't match its checksum", tmp_path)
+
+        def on_copied(path: str):
+            try:
+                row = path_row(path, os.path.relpath(path, STORAGE_DIR), now)
+            except OSError:
+                # a dangling symlink, the indexer skips them too
+                return
+            if checkpoint:
+                src_path = os.path.normpath(os.path.join(abs_src, os.path.relpath(path, abs_dst)))
+                row["checksum"] = stored_checksum(src_path) if row["type"] == "file" else None
+            rows.append(row)
+            if len(rows) >= INDEX_BATCH_SIZE:
+                flush()
+
+        def on_progress(copied: int, total: int | None):
+            ctx.progress(copied, total)
+
+        if os.path.isdir(abs_src):
+            # the index knows the size of the tree, no walk needed
+            with get_session() as session:
+                total = folder_stats.subtree_totals(session, os.path.relpath(abs_src, STORAGE_DIR))["total_size"] or None
+            ctx.progress(0, total, force=True)
+            copied = copy_tree(abs_src, abs_dst, on_copied, on_progress, ctx.check, total,
+                               checkpoint=checkpoint, verify=verify if checkpoint else None)
+        else:
+            total = os.path.getsize(abs_src)
+            ctx.progress(0, total, force=True)
+
+            def on_file_progress(copied: int, size: int):
+                ctx.check()
+                on_progress(copied, size)
+
+            if checkpoint:
+                copied = copy_file_checkpointed(abs_src, abs_dst, on_file_progress, verify)
+            else:
+                copied = copy_file(abs_src, abs_dst, on_file_progress)
+            on_copied(abs_dst)
+
+        flush()
+        return copied
+
+    @staticmethod
+    def list_directory(
+        path,
+        sort: str | None = None,
+        order: str | None = None,
+        dirs_first: bool = True,
+        limit: int | None = None,
+        offset: int | None = None,
+        cursor: str | None = None,
+        source: str | None = None
+    ):
+        """
+            Lists one level of the given folder.
+
+            Without sort/limit/offset/cursor the whole folder is returned unsorted (legacy response).
+            With any of them a sorted page is returned along with total and next_cursor.
+
+            source="index" serves the sorted page from FileEntry without touching the disk (it may be spun down),
+            as fresh as the last watcher flush.
+        """
+        source = source or "disk"
+        if source not in listing_utils.LIST_SOURCES:
+            raise HTTPException(status_code=400, detail=f"Invalid source, expected one of {sorted(listing_utils.LIST_SOURCES)}")
+
+        if source == "index":
+            return FileManager.list_directory_from_index(path, sort=sort, order=order, dirs_first=dirs_first, limit=limit, offset=offset, cursor=cursor)
+
         abs_path = FileManager.validate_path(path)
-        
+
         if not os.path.exists(abs_path):
             raise HTTPException(status_code=404, detail="Path not found")
-        
+
         if not os.path.isdir(abs_path):
             raise HTTPException(status_code=400, detail="Not a directory")
-        
-        items = []
-        for item in os.listdir(abs_path):
-            try:
-                full_path = os.path.join(abs_path, item)
-                file_info = FileManager.get_file_info(full_path)
-                items.append(file_info)
-            except Exception:
-                continue
-
-        #do the sorting if required
-        #items.sort(key=lambda x: (not x["is_directory"], x["name"].lower()))
-            
+
         rel_path = os.path.relpath(abs_path, STORAGE_DIR)
-        parent_dir = os.path.dirname(rel_path) if rel_path != "." else None
+        rel_path = rel_path if rel_path != "." else ""
+        parent_dir = os.path.dirname(rel_path) if rel_path else None
 
-        return {
-            "current_path": rel_path if rel_path != "." else "",
-            "files": items,
+        result = {
+            "current_path": rel_path,
             "parent_directory": parent_dir if parent_dir else None
         }
+
+        if sort is None and limit is None and offset is None and cursor is None:
+            result["files"] = list(listing_utils.iter_directory(abs_path, rel_path))
+            FileManager._attach_folder_totals(rel_path, result["files"])
+            return result
+
+        page = listing_utils.list_page(
+            abs_path,
+            rel_path,
+            sort=sort or "name",
+            order=order or "asc",
+            dirs_first=dirs_first,
+            limit=limit or listing_utils.LIST_DEFAULT_LIMIT,
+            offset=offset or 0,
+            cursor=cursor
+        )
+        result.update(page)
+        FileManager._attach_folder_totals(rel_path, result["files"])
+
+        return result
+
+    @staticmethod
+    def _attach_folder_totals(rel_path: str, infos: list[dict]):
+        """
+            Folder sizes in a listing come from the folder aggregates, a missing aggregate never fails the listing.
+        """
+        try:
+            with get_session() as session:
+                folder_stats.attach_folder_totals(session, rel_path, infos)
+        except Exception as e:
+            logger.warning(f"Could not load folder totals for {rel_path} - {e}")
     
+    @staticmethod
+    def normalize_rel_path(path) -> str:
+        """
+            Lexical version of validate_path for db-only lookups: returns the path relative to the storage dir
+            without resolving it on disk. The db only holds paths inside the storage dir, so ".." is all to reject.
+        """
+        rel_path = os.path.normpath(("" if path is None else str(path)).lstrip("/"))
+        if rel_path == ".":
+            return ""
+        if rel_path == ".." or rel_path.startswith("../"):
+            raise HTTPException(status_code=403, detail="Access Denied")
+        return rel_path
+
+    @staticmethod
+    def list_directory_from_index(
+        path,
+        sort: str | None = None,
+        order: str | None = None,
+        dirs_first: bool = True,
+        limit: int | None = None,
+        offset: int | None = None,
+        cursor: str | None = None
+    ):
+        """
+            Sorted, paginated listing answered from the parent_path index only.
+        """
+        if not STORAGE_DIR:
+            raise HTTPException(status_code=503, detail="Storage directory not configured/mounted")
+
+        rel_path = FileManager.normalize_rel_path(path)
+        parent_dir = os.path.dirname(rel_path) if rel_path else None
+
+        with get_session() as session:
+            if rel_path:
+                entry_type = session.exec(select(FileEntry.type).where(FileEntry.path == rel_path)).first()
+                if entry_type is None:
+                    raise HTTPException(status_code=404, detail="Path not found")
+                if (entry_type.value if hasattr(entry_type, "value") else entry_type) != "folder":
+                    raise HTTPException(status_code=400, detail="Not a directory")
+
+            page = listing_utils.list_page_from_index(
+                session,
+                rel_path,
+                sort=sort or "name",
+                order=order or "asc",
+                dirs_first=dirs_first,
+                limit=limit or listing_utils.LIST_DEFAULT_LIMIT,
+                offset=offset or 0,
+                cursor=cursor
+            )
+            folder_stats.attach_folder_totals(session, rel_path, page["files"])
+
+        return {
+            "current_path": rel_path,
+            "parent_directory": parent_dir if parent_dir else None,
+            **page
+        }
+
+    @staticmethod
+    def get_usage(path, limit: int | None = None):
+        """
+            Disk usage of a folder for a treemap, answered from the folder aggregates without walking the disk.
+
+            path - folder relative to the storage dir
+            limit - max children returned (largest first), the rest is summed up in "others"
+
+            returns - the folder's recursive totals and its children with their totals
+        """
+        if not STORAGE_DIR:
+            raise HTTPException(status_code=503, detail="Storage directory not configured/mounted")
+
+        limit = max(1, min(int(limit or folder_stats.USAGE_DEFAULT_LIMIT), folder_stats.USAGE_MAX_LIMIT))
+        rel_path = FileManager.normalize_rel_path(path)
+
+        with get_session() as session:
+            if rel_path:
+                entry_type = session.exec(select(FileEntry.type).where(FileEntry.path == rel_path)).first()
+                if entry_type is None:
+                    raise HTTPException(status_code=404, detail="Path not found")
+                if (entry_type.value if hasattr(entry_type, "value") else entry_type) != "folder":
+                    raise HTTPException(status_code=400, detail="Not a directory")
+
+            totals = folder_stats.subtree_totals(session, rel_path)
+
+            children = [
+                {
+                    "name": name,
+                    "path": os.path.join(rel_path, name) if rel_path else name,
+                    "is_directory": True,
+                    **child
+                }
+                for name, child in folder_stats.child_totals(session, rel_path).items()
+            ]
+            children += [
+                {
+                    "name": entry.name,
+                    "path": entry.path,
+                    "is_directory": False,
+                    "total_size": entry.size,
+                    "file_count": 1,
+                    "folder_count": 0,
+                    "last_modified": entry.modified_at
+                }
+                for entry in folder_stats.top_files(session, rel_path, limit)
+            ]
+
+        children.sort(key=lambda child: child["total_size"], reverse=True)
+        shown = children[:limit]
+        shown_size = sum(child["total_size"] for child in shown)
+        shown_files = sum(child["file_count"] for child in shown)
+
+        return {
+            "path": rel_path,
+            **totals,
+            "children": shown,
+            "others": {
+                "total_size": max(0, totals["total_size"] - shown_size),
+                "file_count": max(0, totals["file_count"] - shown_files),
+            }
+        }
+
     @staticmethod
     def create_directory(path, directory_name):
         """
@@ -186,67 +537,27 @@ class FileManager:
         if os.path.exists(new_dir_path):
             raise HTTPException(status_code=400, detail="Directory already exists")
         
-        with get_session() as session:
-            try:
-                os.makedirs(new_dir_path)
-                info = FileManager.get_file_info(new_dir_path)
-
-                file = FileEntry(
-                    file_id=info["id"],
-                    path=info["path"],
-                    name=info["name"],
-                    type="folder",
-                    size=info["size"],
-                    modified_at=info["modified_at"]
-                )
-
-                session.merge(file)
-                session.commit()
-
-                return info
-            except Exception as e:
-                logger.error(f'Exception occurred while creating a directory: {e}')
-                raise HTTPException(status_code=500, detail="Failed to create directory")
-
-    @staticmethod
-    async def handle_upload(request: Request, dest_dir, task_id, filename):
-        """Handle multiple large file uploads in streaming fashion"""
-        async with UPLOAD_SEMAPHORE:
-            # only 3 uploads at a time can enter here
-            try:
-                content_type = request.headers.get("Content-Type", "")
-                if not content_type or not content_type.startswith("multipart/form-data"):
-                    raise ValueError("Content-Type must be multipart/form-data for file uploads")
-
-                parser = StreamingFormDataParser(headers=request.headers)
-
-                with get_session() as session:
-                    await init_task(session, task_id, filename=filename)
+        try:
+            os.makedirs(new_dir_path)
+            info = FileManager.get_file_info(new_dir_path)
 
-                parser = SingleFileStreamingParser(request_headers=request.headers, dest_dir=dest_dir, task_id=task_id, filename=filename)
-                saved_filename = await parser.parse_and_save_files(request)
+            row = path_row(new_dir_path, info["path"], datetime.now())
 
-                if not saved_filename:
-                    raise ValueError("No file was uploaded")
-                
-                with get_session() as session:
-                    await complete_task(session, task_id)
+            # an upsert, the watcher may have inserted the row already
+            db_writer.run(lambda session: upsert_rows(session, [row]))
 
-                return {"uploaded_file": saved_filename}
+            return info
+        except Exception as e:
+            logger.error(f'Exception occurred while creating a directory: {e}')
+            raise HTTPException(status_code=500, detail="Failed to create directory")
 
-            except ClientDisconnect:
-                with get_session() as session:
-                    await fail_task(session, task_id, error="Client disconnected")
-            except Exception as e:
-                with get_session() as session:
-                    await fail_task(session, task_id, str(e))
-                    raise
-    
     @staticmethod
-    async def new_start_upload(request: Request, path: str, filename: str):
+    async def new_start_upload(request: Request, path: str, filename: str, upload_id: str | None = None, user: str | None = None):
         """
             path - destination path
-            file - the file that needs to be uploaded. 
+            filename - name of the file in the destination folder
+            upload_id - optional id picked by the client, so it can poll /upload-progress while the body is sent
+            user - the uploading user, the upload scheduler shares the slots fairly per user (like TUS uploads)
         """
 
         abs_path = FileManager.validate_path(path)
@@ -256,67 +567,65 @@ class FileManager:
         
         if not FileManager.validate_itemname(filename):
             raise HTTPException(status_code=400, detail="Invalid filename provided")
-        
-        task_id = str(uuid.uuid4())
+
+        content_type = request.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            raise HTTPException(status_code=400, detail="Content-Type must be multipart/form-data for file uploads")
+
+        try:
+            task_id = str(uuid.UUID(upload_id)) if upload_id else str(uuid.uuid4())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="upload_id must be a UUID")
 
         file_path = os.path.join(abs_path, filename)
-        #file_target = FileTarget(file_path)
-        file_target = ProgressFileTarget(file_path, task_id, progress_store)
-        
-        parser = StreamingFormDataParser(headers=request.headers)
-        parser.register("file", file_target)
+        if os.path.isdir(file_path):
+            raise HTTPException(status_code=409, detail="A folder with that name already exists")
 
         try:
-            async for chunk in request.stream():
-                parser.data_received(chunk)
+            parser = SingleFileStreamingParser(request.headers, file_path, task_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # the same user retrying the same upload keeps its place in the queue
+        ticket = f"{user}:{file_path}"
+        admission = upload_scheduler.try_acquire(ticket, user, kind="multipart", measure=lambda: parser.target.bytes_written)
+        if not admission.granted:
+            raise HTTPException(status_code=503, detail="Upload queued, retry later", headers=admission.headers())
+
+        try:
+            await init_task(task_id, filename=filename)
+            target = await parser.parse_and_save(request)
 
         except ClientDisconnect:
+            await fail_task(task_id, error="Client disconnected")
             raise HTTPException(status_code=499, detail="Client Disconnected")
+
+        except ValueError as e:
+            await fail_task(task_id, str(e))
+            raise HTTPException(status_code=422, detail=str(e))
         
         except Exception as e:
+            logger.error(f"Upload of {file_path} failed: {e}")
+            await fail_task(task_id, str(e))
             raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
-        if not file_target.multipart_filename:
-            raise HTTPException(status_code=422, detail="File field is missing in form-data")
-
-        return {"upload_id": task_id, "filename": filename, "path": file_path}
-
-    @staticmethod
-    async def start_upload(request: Request, background_tasks: BackgroundTasks, path: str, filename: str):
-        """
-            path - destination path
-            file - the file that needs to be uploaded. 
-        """
+        finally:
+            upload_scheduler.release(ticket)
 
-        abs_path = FileManager.validate_path(path)
+        checksum = target.checksum
+        await run_in_threadpool(FileManager.index_file, file_path, checksum)
+        await complete_task(task_id)
 
-        if not os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail="Destination is not a directory")
-        
-        task_id = str(uuid.uuid4())
+        return {"upload_id": task_id, "filename": filename, "path": file_path, "size": target.bytes_written, "checksum": checksum}
 
-        async def run_upload():
-            try:
-                await FileManager.handle_upload(request=request, dest_dir=abs_path, task_id=task_id, filename=filename)
-            except Exception as e:
-                with get_session() as session:
-                    await fail_task(session, task_id, str(e))
-                    raise
-    
-        asyncio.create_task(run_upload())
-        return {"task_id": task_id, "status": "started"}
-
-    
     @staticmethod
     def get_upload_progress(upload_id):
-        # with get_session() as session:
-        #     task = get_task_status(session, task_id=task_id)
-        #     return task
-
-        bytes_received = progress_store.get(upload_id, None)
-        if bytes_received is None:
-            return {"upload_id": upload_id, "status": "completed or not found"}
-        return {"upload_id": upload_id, "bytes_received": bytes_received}
+        """
+            Status of a multipart upload from the UploadTask table, written/total are bytes (total is the
+            Content-Length of the request while it's uploading). Blocking, run it with run_db.
+        """
+        with get_session() as session:
+            return get_task_status(session, task_id=upload_id)
 
     @staticmethod
     async def delete_item(path):
@@ -335,46 +644,30 @@ class FileManager:
         if not os.path.exists(abs_path):
             raise HTTPException(status_code=404, detail="Path not found")
 
-        with get_session() as session:
-            try:
-                if os.path.isdir(abs_path):
-                    dir_info = FileManager.get_file_info(abs_path)
-
-                    # Remove directory entry + all descendants from the DB
-                    rel_dir_path = dir_info["path"]
-                    prefix = f"{rel_dir_path}/"
-                    entries = session.exec(
-                        select(FileEntry).where(
-                            or_(
-                                FileEntry.path == rel_dir_path,
-                                FileEntry.path.startswith(prefix),
-                            )
-                        )
-                    ).all()
-                    for entry in entries:
-                        session.delete(entry)
-
-                    shutil.rmtree(abs_path)
-                    session.commit()
-                else:
-                    file_info = FileManager.get_file_info(abs_path)
+        is_directory = os.path.isdir(abs_path) and not os.path.islink(abs_path)
+        rel_path = os.path.relpath(abs_path, STORAGE_DIR)
 
-                    file = session.exec(select(FileEntry).where(FileEntry.path == file_info["path"])).first()
-                    if file is not None:
-                        session.delete(file)
-                    os.remove(abs_path)
-                    session.commit()
+        if is_directory:
+            # a folder can hold anything, it's removed by a job
+            return await run_in_threadpool(FileManager._queue_job, "delete", {"path": abs_path}, abs_path)
 
-                return {"status": "completed"}
-            
-            except Exception as e:
-                logger.error(f'Exception occurred: {e}')
-                raise HTTPException(status_code=500, detail="Failed to delete the given path")
+        try:
+            # the disk and the db work both happen off the event loop
+            await run_in_threadpool(os.remove, abs_path)
+            # one range DELETE for the whole subtree
+            await db_writer.run_async(lambda session: session.execute(delete_subtree_statement(rel_path)))
+
+            return {"status": "completed"}
+        
+        except Exception as e:
+            logger.error(f'Exception occurred: {e}')
+            raise HTTPException(status_code=500, detail="Failed to delete the given path")
          
     @staticmethod
     def download(path, inline = False):
         """
             This will download file/folder at the given path. 
+            Folders are streamed as a zip archive.
         """
 
         if path == "":
@@ -386,7 +679,7 @@ class FileManager:
             raise HTTPException(status_code=404, detail="File/Folder Path not found")
         
         if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail="Invalid Request")
+            return FileManager.download_folder(abs_path)
         
         file_name = os.path.basename(abs_path)
         content_type, _ = mimetypes.guess_type(file_name)
@@ -394,58 +687,149 @@ class FileManager:
         if not content_type:
             content_type = "application/octet-stream"
 
+        disposition = "attachment"
         if inline and (content_type.startswith(('image/', 'application/pdf', 'text/'))):
-            return FileResponse(
-                path=abs_path,
-                filename=file_name,
-                media_type=content_type,
-                content_disposition_type="inline"
-            )
-        
-        return FileResponse(
+            disposition = "inline"
+
+        # Range/If-Range, ETag and 304s, see http_files
+        return RangeFileResponse(
             path=abs_path,
             filename=file_name,
-            media_type=content_type
+            media_type=content_type,
+            content_disposition_type=disposition
         )
     
     @staticmethod
-    def zip_folder(folder_path, output_path, task_id):
+    def download_folder(abs_path):
+        """
+            Streams the folder as a zip, generated on the fly while the client downloads it.
+            Nothing is written to the disk and the first bytes go out right away.
+        """
+        zip_name = f"{os.path.basename(abs_path)}.zip"
+
+        return StreamingResponse(
+            zip_stream.iter_zip(abs_path),
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(zip_name)}",
+                "X-Accel-Buffering": "no",
+            }
+        )
+
+    @staticmethod
+    def zip_folder(folder_path, output_path, ctx: JobContext, level: int | None = None):
         all_files = [f for f in folder_path.rglob("*") if f.is_file()]
         total_files = len(all_files)
+        # done/total are bytes like the parallel path, so streamed progress gets a real bytes/s, percent is by file
+        total_bytes = sum(f.stat().st_size for f in all_files)
+        bytes_done = 0
 
-        try:
-            if total_files == 0:
-                # Create an empty zip and mark progress complete.
-                with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED):
-                    pass
-                progress_store[task_id] = 100
-                return
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as zipf:
+            for idx, file in enumerate(all_files):
+                ctx.check()
+                try:
+                    relative_path = file.relative_to(folder_path)
+                    zipf.write(file, arcname=relative_path)
+                    bytes_done += file.stat().st_size
+                except Exception as file_error:
+                    logger.error(f"Failed to add {file}: {file_error}")
+                progress = int((idx + 1) / total_files * 100)
+                ctx.progress(bytes_done, total_bytes, progress=progress)
 
-            with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for idx, file in enumerate(all_files):
-                    try:
-                        relative_path = file.relative_to(folder_path)
-                        zipf.write(file, arcname=relative_path)
-                    except Exception as file_error:
-                        print(f"Failed to add {file}: {file_error}")
-                    progress = int((idx + 1) / total_files * 100)
-                    progress_store[task_id] = progress
-            progress_store[task_id] = 100
-        except Exception as e:
-            logger.error(f'Exception occurred while zipping: {e}')
-            progress_store[task_id] = -1
+    @staticmethod
+    def zip_folder_parallel(folder_path: str, output_path: str, ctx: JobContext, level: int = COMPRESS_LEVEL):
+        """
+            Same archive as zip_folder, but members are deflated on COMPRESS_WORKERS threads and
+            already compressed/incompressible files are STORED. Progress is by bytes, with throughput.
+        """
+        members = []
+        total_bytes = 0
+        for dirpath, dirnames, filenames in os.walk(folder_path):
+            rel_dir = os.path.relpath(dirpath, folder_path)
+            if not dirnames and not filenames and rel_dir != ".":
+                members.append((dirpath, rel_dir, True))
+            for name in filenames:
+                full_path = os.path.join(dirpath, name)
+                if os.path.islink(full_path) or not os.path.isfile(full_path):
+                    continue
+                members.append((full_path, os.path.relpath(full_path, folder_path), False))
+                total_bytes += os.path.getsize(full_path)
+
+        started = time.monotonic()
+
+        def on_progress(bytes_done):
+            elapsed = time.monotonic() - started
+            ctx.progress(
+                bytes_done, total_bytes,
+                progress=min(99, int(bytes_done / total_bytes * 100)) if total_bytes else 99,
+                bytes_per_second=int(bytes_done / elapsed) if elapsed > 0 else 0,
+            )
+
+        ctx.progress(0, total_bytes, force=True, progress=0, bytes_per_second=0)
+
+        with ParallelZipWriter(output_path, workers=COMPRESS_WORKERS, level=level, on_progress=on_progress) as writer:
+            for abs_path, arcname, is_directory in members:
+                ctx.check()
+                try:
+                    if is_directory:
+                        st = os.stat(abs_path)
+                        writer.add_directory(arcname, st.st_mtime, st.st_mode)
+                    else:
+                        writer.add_file(abs_path, arcname)
+                except OSError as file_error:
+                    logger.error(f"Failed to add {abs_path}: {file_error}")
+
+    @staticmethod
+    def run_compress_job(ctx: JobContext):
+        """
+            Job handler of "compress". A cancelled or failed job doesn't leave a partial archive behind.
+        """
+        folder_path, output_path = ctx.params["folder"], ctx.params["output"]
+        try:
+            if ctx.params["parallel"]:
+                FileManager.zip_folder_parallel(folder_path, output_path, ctx, level=ctx.params["level"])
+            else:
+                FileManager.zip_folder(Path(folder_path), output_path, ctx, level=ctx.params["level"])
+        except BaseException:
+            FileManager._remove(output_path)
+            raise
+        ctx.last["progress"] = 100
+        return {"zip_path": output_path}
 
     @staticmethod
     def get_progress(task_id):
-        progress = progress_store.get(task_id)
+        """
+            Progress of a compress job from the shared progress store, so any worker can answer. Blocking.
+        """
+        job = progress_store.get("compress", task_id)
 
-        if progress is None:
+        if job is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        return {"task_id": task_id, "progress": progress}
+
+        progress = job.get("progress", 0)
+        if job["status"] in ("failed", "cancelled"):
+            progress = -1
+
+        return {
+            "task_id": task_id,
+            "progress": progress,
+            "status": job["status"],
+            "bytes_done": job["done"],
+            "bytes_total": job["total"],
+            "bytes_per_second": job.get("bytes_per_second", 0),
+        }
 
     @staticmethod
-    def compress_folder(path, background_tasks: BackgroundTasks):
+    def compress_folder(path, parallel: bool = True, level: int | None = None):
+        """
+            Queues a job that compresses the folder into <folder>.zip next to it.
+
+            parallel - deflate members on all cores, STORED for already compressed files
+            level - zlib level 0-9, COMPRESS_LEVEL by default
+
+            The job id is the task_id of /compress-progress, JOB_CPU_WORKERS compress jobs run at once and the
+            others wait in the queue.
+        """
 
         if path == "" or path == "/":
             raise HTTPException(status_code=404, detail="File/Folder Path not found")
@@ -462,44 +846,35 @@ class FileManager:
         parentFolder = os.path.dirname(abs_path)
        
         output_zip = f"{parentFolder}/{folder_name}.zip"
-        task_id = str(uuid.uuid4())
-        progress_store[task_id] = 0
+        level = COMPRESS_LEVEL if level is None else max(0, min(int(level), 9))
 
-        background_tasks.add_task(FileManager.zip_folder, Path(abs_path), output_zip, task_id)
+        # the queued row is written before the response goes out, so the first poll finds the job on any worker
+        task_id = job_engine.submit("compress", {"folder": abs_path, "output": output_zip, "parallel": parallel, "level": level})
 
         return {"task_id": task_id, "zip_path": str(output_zip)}
     
     @staticmethod
-    def get_recent_activity():
-        try:
-
-            if not os.path.exists(RECENT_ACTIVITY_FILE):
-                return []
-
-            with open(RECENT_ACTIVITY_FILE) as f:
-                data = json.load(f)
-
-            latest_by_path = {}
-            for entry in data:
-                try:
-                    path = entry["path"]
-                    ts = datetime.fromisoformat(entry["timestamp"])
-
-                    if path not in latest_by_path or ts > datetime.fromisoformat(latest_by_path[path]["timestamp"]):
-                        latest_by_path[path] = entry
-                except Exception as e:
-                    logger.warning(f"Skipping invalid log entry: {entry} ({e})")
-                    continue
+    def get_recent_activity(limit: int | None = None, cursor: str | None = None, since: datetime | None = None):
+        """
+            Returns the latest event per path in the Folder1 path, newest first.
 
-            recent = sorted(latest_by_path.values(), key=lambda e: e["timestamp"], reverse=True)
-            return recent
+            limit - page size
+            cursor - next_cursor of the previous page
+            since - only events at/after this time
 
-        except json.JSONDecodeError:
-            logger.error(f"RECENT_ACTIVITY_FILE exists but contains invalid JSON")
-            return []
-        except FileNotFoundError:
-            logger.error(f'Exception occurred: recent activity file not found')
-            return []
+            returns - (events, next_cursor)
+        """
+        with get_session() as session:
+            try:
+                events, next_cursor = activity_store.query(session, limit=limit, cursor=cursor, since=since)
+                return [
+                    {"path": e.path, "event": e.event, "timestamp": e.timestamp} for e in events
+                ], next_cursor
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.error(f'Exception occurred while reading recent activity: {e}')
+                raise HTTPException(status_code=500, detail="Error while reading recent activity")
     
     @staticmethod
     def rename_item(path: str, is_directory: bool, new_name: str) -> str:
@@ -527,43 +902,8 @@ class FileManager:
         if os.path.exists(new_path):
             raise HTTPException(status_code=409, detail="File or folder with the new name already exists")
 
-        old_rel_path = os.path.relpath(abs_path, STORAGE_DIR)
-        new_rel_path = os.path.relpath(new_path, STORAGE_DIR)
-
         try:
-            shutil.move(abs_path, new_path)
-
-            with get_session() as session:
-                if is_directory:
-                    old_prefix = f"{old_rel_path}/"
-                    new_prefix = f"{new_rel_path}/"
-
-                    entries = session.exec(
-                        select(FileEntry).where(
-                            or_(
-                                FileEntry.path == old_rel_path,
-                                FileEntry.path.startswith(old_prefix),
-                            )
-                        )
-                    ).all()
-
-                    for entry in entries:
-                        if entry.path == old_rel_path:
-                            entry.path = new_rel_path
-                            entry.name = os.path.basename(new_rel_path)
-                        else:
-                            entry.path = entry.path.replace(old_prefix, new_prefix, 1)
-                        session.add(entry)
-                    session.commit()
-                else:
-                    # File move/rename: delete old row and insert fresh from filesystem (file_id can change).
-                    existing = session.exec(select(FileEntry).where(FileEntry.path == old_rel_path)).first()
-                    if existing is not None:
-                        session.delete(existing)
-                        session.commit()
-
-                    FileManager._upsert_entry_from_full_path(session, new_path)
-                    session.commit()
+            FileManager._relocate(abs_path, new_path)
 
             return new_path
         
@@ -572,14 +912,15 @@ class FileManager:
             raise HTTPException(status_code=500, detail="Error while renaming the file/folder")
 
     @staticmethod
-    def move_item(path: str, dst_path: str) -> str:
+    def move_item(path: str, dst_path: str):
         """
             This function will move the file from the source path to the destination path
 
             path - source path
             dst_path - destination path
 
-            returns the new path after moving. 
+            returns the new path after moving. A move to another disk of a folder or of a file of
+            JOB_INLINE_MAX_BYTES or more is a job, 202 with its id is returned instead.
         """
 
         abs_src_path = FileManager.validate_path(path)
@@ -604,44 +945,17 @@ class FileManager:
         if os.path.exists(new_path):
             raise HTTPException(status_code=409, detail="Item with same name already exists at destination")
 
-        try:
-            if os.path.isdir(abs_src_path) and os.path.commonpath([abs_src_path, abs_dst_path]) == abs_src_path:
-                raise HTTPException(status_code=400, detail="Destination cannot be inside the source directory")
-
-            old_rel_path = os.path.relpath(abs_src_path, STORAGE_DIR)
-            new_rel_path = os.path.relpath(new_path, STORAGE_DIR)
-
-            shutil.move(abs_src_path, new_path)
+        is_directory = os.path.isdir(abs_src_path)
+        if is_directory and os.path.commonpath([abs_src_path, abs_dst_path]) == abs_src_path:
+            raise HTTPException(status_code=400, detail="Destination cannot be inside the source directory")
 
-            with get_session() as session:
-                if os.path.isdir(new_path):
-                    old_prefix = f"{old_rel_path}/"
-                    new_prefix = f"{new_rel_path}/"
-
-                    entries = session.exec(
-                        select(FileEntry).where(
-                            or_(
-                                FileEntry.path == old_rel_path,
-                                FileEntry.path.startswith(old_prefix),
-                            )
-                        )
-                    ).all()
-
-                    for entry in entries:
-                        if entry.path == old_rel_path:
-                            entry.path = new_rel_path
-                        else:
-                            entry.path = entry.path.replace(old_prefix, new_prefix, 1)
-                        session.add(entry)
-                    session.commit()
-                else:
-                    existing = session.exec(select(FileEntry).where(FileEntry.path == old_rel_path)).first()
-                    if existing is not None:
-                        session.delete(existing)
-                        session.commit()
+        # a rename can't cross devices, the data has to be copied
+        if os.stat(abs_src_path).st_dev != os.stat(abs_dst_path).st_dev:
+            if is_directory or os.path.getsize(abs_src_path) >= JOB_INLINE_MAX_BYTES:
+                return FileManager._queue_job("move", {"src": abs_src_path, "dst": new_path}, new_path)
 
-                    FileManager._upsert_entry_from_full_path(session, new_path)
-                    session.commit()
+        try:
+            FileManager._relocate(abs_src_path, new_path)
 
             logger.info(f"Moved from src - {abs_src_path} to {abs_dst_path}")
             return new_path
@@ -657,7 +971,8 @@ class FileManager:
             path - source path
             dst_path - destination path
 
-            returns the new path after copying. 
+            returns the new path after copying. Folders and files of JOB_INLINE_MAX_BYTES or more are copied by a
+            job, 202 with its id is returned instead.
         """
 
         abs_src_path = FileManager.validate_path(path)
@@ -682,34 +997,155 @@ class FileManager:
         if os.path.exists(new_path):
             raise HTTPException(status_code=409, detail="Item with same name already exists at destination")
 
+        if os.path.isdir(abs_src_path):
+            if os.path.commonpath([abs_src_path, abs_dst_path]) == abs_src_path:
+                raise HTTPException(status_code=400, detail="Destination cannot be inside the source directory")
+            return FileManager._queue_job("copy", {"src": abs_src_path, "dst": new_path}, new_path)
+
+        if not os.path.isfile(abs_src_path):
+            raise HTTPException(status_code=400, detail="Unsupported item type")
+
+        if os.path.getsize(abs_src_path) >= JOB_INLINE_MAX_BYTES:
+            return FileManager._queue_job("copy", {"src": abs_src_path, "dst": new_path}, new_path)
+
         try:
-            if os.path.isfile(abs_src_path):
-                shutil.copy2(abs_src_path, new_path)
-            elif os.path.isdir(abs_src_path):
-                shutil.copytree(abs_src_path, new_path)
-            else:
-                raise HTTPException(status_code=400, detail="Unsupported item type")
+            copy_file(abs_src_path, new_path)
+            FileManager.index_file(new_path)
 
-            # Insert copied entries into DB.
-            with get_session() as session:
-                if os.path.isdir(new_path):
-                    for dirpath, dirnames, filenames in os.walk(new_path):
-                        FileManager._upsert_entry_from_full_path(session, dirpath)
-                        for name in dirnames:
-                            FileManager._upsert_entry_from_full_path(session, os.path.join(dirpath, name))
-                        for name in filenames:
-                            FileManager._upsert_entry_from_full_path(session, os.path.join(dirpath, name))
-                    session.commit()
-                else:
-                    FileManager._upsert_entry_from_full_path(session, new_path)
-                    session.commit()
-            
             logger.info(f"Copied from src - {abs_src_path} to {new_path}")
             return new_path
         except Exception as e:  
             logger.error(f"Exception occurred while copying file/folder: {e}")
             raise HTTPException(status_code=500, detail="Error while copying the file/folder")
 
+    @staticmethod
+    def run_copy_job(ctx: JobContext):
+        """
+            Job handler of "copy". The copy is made under a hidden .part name next to the destination and renamed
+            into place when it's complete, a cancelled, failed or interrupted copy never shows up half done.
+        """
+        src, dst = ctx.params["src"], ctx.params["dst"]
+        tmp = part_path(dst)
+
+        # an earlier attempt got as far as the rename, only the index is missing
+        renamed = ctx.attempt > 1 and os.path.lexists(dst) and not os.path.lexists(tmp)
+        copied = None
+
+        if renamed:
+            with get_session() as session:
+                FileManager._index_tree(session, dst, os.path.relpath(dst, STORAGE_DIR))
+        else:
+            if os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, "Item with same name already exists at destination", dst)
+            # left by an interrupted attempt
+            FileManager._discard_copy(tmp)
+            try:
+                copied = FileManager._copy_tree(src, tmp, ctx)
+                # the rows of the copy move with it, in the same transaction as the rename
+                FileManager._relocate(tmp, dst)
+            except BaseException:
+                FileManager._discard_copy(tmp)
+                raise
+
+        logger.info(f"Copied from src - {src} to {dst}")
+        return {"path": dst, "bytes": copied}
+
+    @staticmethod
+    def run_move_job(ctx: JobContext):
+        """
+            Job handler of "move", for moves across devices. The tree is copied under a hidden .part name next to
+            the destination, renamed into place and only then is the source removed. Once the copy is in place the
+            job can't be cancelled any more.
+
+            The copy is checkpointed per file: each one is fsynced, verified (size, stored checksum) and only then
+            renamed to its name inside the .part tree. A move that runs again after a crash, a restart or an I/O
+            error keeps the .part tree and skips the files that are already there, instead of starting over. A
+            retry after the rename only finishes removing the source.
+        """
+        src, dst = ctx.params["src"], ctx.params["dst"]
+        tmp = part_path(dst)
+        src_rel_path = os.path.relpath(src, STORAGE_DIR)
+        tmp_rel_path = os.path.relpath(tmp, STORAGE_DIR)
+        new_rel_path = os.path.relpath(dst, STORAGE_DIR)
+
+        # an earlier attempt got the copy into place, what's left of the source still has to go
+        renamed = ctx.attempt > 1 and os.path.lexists(dst) and not os.path.lexists(tmp)
+
+        if renamed:
+            def reroot(session):
+                # the rows are still under the .part name if the crash came between the rename and the commit
+                if session.exec(select(FileEntry.path).where(FileEntry.path == tmp_rel_path)).first() is not None:
+                    session.execute(delete_subtree_statement(new_rel_path))
+                    session.execute(move_subtree_statement(tmp_rel_path, new_rel_path))
+
+            db_writer.run(reroot)
+        else:
+            if os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, "Item with same name already exists at destination", dst)
+            if ctx.attempt > 1 and os.path.lexists(tmp):
+                logger.info(f"Resuming the move of {src}, keeping what was copied to {tmp}")
+            try:
+                FileManager._copy_tree(src, tmp, ctx, checkpoint=True)
+                FileManager._relocate(tmp, dst)
+            except BaseException as e:
+                # a move that runs again picks up where this one stopped
+                if not ctx.will_retry(e):
+                    FileManager._discard_copy(tmp)
+                raise
+
+        FileManager._remove(src)
+        db_writer.run(lambda session: session.execute(delete_subtree_statement(src_rel_path)))
+
+        logger.info(f"Moved from src - {src} to {dst}")
+        return {"path": dst}
+
+    @staticmethod
+    def run_delete_job(ctx: JobContext):
+        """
+            Job handler of "delete". The folder is removed bottom up one entry at a time, so a cancel stops it
+            part way, the rows of what was removed until then are dropped either way.
+        """
+        abs_path = ctx.params["path"]
+        rel_path = os.path.relpath(abs_path, STORAGE_DIR)
+
+        with get_session() as session:
+            totals = folder_stats.subtree_totals(session, rel_path)
+        total = totals["file_count"] + totals["folder_count"] + 1
+        removed = 0
+
+        try:
+            for dirpath, dirnames, filenames in os.walk(abs_path, topdown=False):
+                for name in filenames + dirnames:
+                    ctx.check()
+                    full_path = os.path.join(dirpath, name)
+                    if os.path.isdir(full_path) and not os.path.islink(full_path):
+                        os.rmdir(full_path)
+                    else:
+                        os.remove(full_path)
+                    removed += 1
+                    ctx.progress(removed, total)
+            if os.path.lexists(abs_path):
+                os.rmdir(abs_path)
+            removed += 1
+        finally:
+            if os.path.lexists(abs_path):
+                # stopped part way, the rows of the entries that are left are put back
+                with get_session() as session:
+                    session.execute(delete_subtree_statement(rel_path))
+                    FileManager._index_tree(session, abs_path, rel_path)
+            else:
+                db_writer.run(lambda session: session.execute(delete_subtree_statement(rel_path)))
+
+        ctx.progress(removed, max(total, removed))
+        return {"path": abs_path, "removed": removed}
+
+    @staticmethod
+    def get_index_state() -> str:
+        """
+            returns "indexing" while the file index is being built (search results are partial) else "ready"
+        """
+        return "indexing" if index_job.is_building() else "ready"
+
     @staticmethod
     def search(
         q: str = "", 
@@ -734,19 +1170,42 @@ class FileManager:
                     return []
 
                 query = select(FileEntry)
-                if q:
+                use_index = search_index.can_use_index(q)
+
+                if use_index:
+                    # substring match served by the trigram index instead of a LIKE '%q%' table scan
+                    query = query.join(
+                        search_index.fts_table,
+                        search_index.fts_table.c.rowid == literal_column("fileentry.rowid")
+                    ).where(search_index.match_clause(q))
+                else:
                     query = query.where(FileEntry.name.contains(q))
-                
+
                 if type in ["file", "folder"]:
                     query = query.where(FileEntry.type == type)
-                
-                sort_column = getattr(FileEntry, sort, FileEntry.modified_at)
-                sort_order = sort_column.desc() if order == "desc" else sort_column.asc()
 
-                query = query.order_by(sort_order).limit(limit)
+                if sort == "relevance":
+                    # exact name first, then prefix matches, then the best bm25 score, then shorter names
+                    sort_order = [
+                        case((func.lower(FileEntry.name) == q.lower(), 0), else_=1),
+                        case((FileEntry.name.istartswith(q, autoescape=True), 0), else_=1),
+                    ]
+                    if use_index:
+                        sort_order.append(search_index.rank_column())
+                    sort_order.append(func.length(FileEntry.name))
+                else:
+                    sort_column = getattr(FileEntry, sort, FileEntry.modified_at)
+                    sort_order = [sort_column.desc() if order == "desc" else sort_column.asc()]
+
+                query = query.order_by(*sort_order).limit(limit)
                 results = session.exec(query).all()
 
                 return results
             except Exception as e:
                 logger.error(f'Exception occurred while searching: {e}')
                 raise HTTPException(status_code=500, detail="Error while searching")
+
+job_engine.register("delete", FileManager.run_delete_job, "io", priority=10)
+job_engine.register("move", FileManager.run_move_job, "io", priority=5)
+job_engine.register("copy", FileManager.run_copy_job, "io")
+job_engine.register("compress", FileManager.run_compress_job, "cpu")
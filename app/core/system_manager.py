@@ -5,6 +5,10 @@ import json
 from app.config import HARDDISKS_INFO_FILE, FILESYSTEM_INFO_FILE, SYSTEMS_METRICS_FILE, SMART_INFO_FILE
 from app.api.routes.models import LoadAverage, SystemMetrics
 from app.logger import logger
+from app.core.utils.indexer import index_job
+from app.core.utils.reconciler import reconcile_job
+from app.core.utils.job_engine import job_engine, JobContext
+from app.config import STORAGE_DIR
 
 class SystemManager:
 
@@ -67,3 +71,60 @@ class SystemManager:
         except Exception as e:
             logger.error(f'Exception occurred while retrieving system metrics data: {e}')
             raise HTTPException(500, detail="Internal Error")
+
+    @staticmethod
+    def get_index_status():
+        """
+            returns the state of the background file index build (indexed count, rate, ETA)
+        """
+        return {"status": "success", "data": index_job.status()}
+
+    @staticmethod
+    def start_reconcile(full: bool = False):
+        """
+            Starts a db <-> filesystem reconciliation in the background.
+            full - stat and compare every entry instead of skipping folders whose mtime didn't change
+        """
+        if not STORAGE_DIR:
+            raise HTTPException(status_code=503, detail="Storage directory not configured/mounted")
+
+        if index_job.is_building():
+            raise HTTPException(status_code=409, detail="Initial indexing is still in progress")
+
+        if not reconcile_job.start(STORAGE_DIR, full=full):
+            raise HTTPException(status_code=409, detail="Reconciliation is already running")
+
+        return {"status": "started", "data": reconcile_job.status()}
+
+    @staticmethod
+    def get_reconcile_status():
+        """
+            returns whether a reconciliation is running and the counts/duration of the last run
+        """
+        return {"status": "success", "data": reconcile_job.status()}
+
+    @staticmethod
+    def start_reindex():
+        """
+            Queues a full re-index of the storage dir (every entry stat'ed and compared) as a job.
+            returns - the job id, to follow it on /api/v1/jobs
+        """
+        if not STORAGE_DIR:
+            raise HTTPException(status_code=503, detail="Storage directory not configured/mounted")
+
+        if index_job.is_building():
+            raise HTTPException(status_code=409, detail="Initial indexing is still in progress")
+
+        return {"job_id": job_engine.submit("reindex", {"full": True}), "status": "queued"}
+
+    @staticmethod
+    def run_reindex_job(ctx: JobContext):
+        """
+            Job handler of "reindex".
+        """
+        result = reconcile_job.run(STORAGE_DIR, full=ctx.params.get("full", True))
+        if result is None:
+            raise RuntimeError("A reconciliation or the initial index build is already running")
+        return result
+
+job_engine.register("reindex", SystemManager.run_reindex_job, "index", max_attempts=1)
@@ -0,0 +1,97 @@
+import json
+import base64
+import time
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import delete, and_, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import select
+from app.db.models import ActivityEvent
+from app.config import ACTIVITY_RETENTION_DAYS
+from app.logger import logger
+
+ACTIVITY_DEFAULT_LIMIT = 100
+ACTIVITY_MAX_LIMIT = 500
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+_last_prune = 0.0
+
+def record(session, events: list[dict]):
+    """
+        Stores the latest event per path. events - [{"path", "event", "timestamp"}]
+        An upsert on the unique path index, so a write costs the same no matter how big the log is.
+        The caller commits.
+    """
+    if not events:
+        return
+
+    stmt = insert(ActivityEvent)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ActivityEvent.path],
+        set_={"event": stmt.excluded.event, "timestamp": stmt.excluded.timestamp}
+    )
+    session.execute(stmt, events)
+    maybe_prune(session)
+
+def prune(session, retention_days: int = ACTIVITY_RETENTION_DAYS) -> int:
+    """
+        Deletes events older than the retention window using the timestamp index. The caller commits.
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    result = session.execute(delete(ActivityEvent).where(ActivityEvent.timestamp < cutoff))
+    return result.rowcount or 0
+
+def maybe_prune(session):
+    global _last_prune
+
+    now = time.monotonic()
+    if now - _last_prune < PRUNE_INTERVAL_SECONDS:
+        return
+
+    _last_prune = now
+    removed = prune(session)
+    if removed:
+        logger.info(f"Pruned {removed} recent activity entries older than {ACTIVITY_RETENTION_DAYS} days")
+
+def encode_cursor(event: ActivityEvent) -> str:
+    raw = json.dumps([event.timestamp.isoformat(), event.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(timestamp), int(event_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def query(session, limit: int | None = None, cursor: str | None = None, since: datetime | None = None):
+    """
+        Returns the newest events first (one per path) within the retention window.
+
+        limit - page size
+        cursor - next_cursor of the previous page
+        since - only events at/after this time
+
+        returns - (events, next_cursor)
+    """
+    limit = max(1, min(int(limit or ACTIVITY_DEFAULT_LIMIT), ACTIVITY_MAX_LIMIT))
+
+    floor = datetime.now() - timedelta(days=ACTIVITY_RETENTION_DAYS)
+    if since is not None:
+        since = since.astimezone().replace(tzinfo=None) if since.tzinfo else since
+        floor = max(floor, since)
+
+    stmt = select(ActivityEvent).where(ActivityEvent.timestamp >= floor)
+
+    if cursor:
+        timestamp, event_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            ActivityEvent.timestamp < timestamp,
+            and_(ActivityEvent.timestamp == timestamp, ActivityEvent.id < event_id)
+        ))
+
+    stmt = stmt.order_by(ActivityEvent.timestamp.desc(), ActivityEvent.id.desc()).limit(limit + 1)
+    events = session.exec(stmt).all()
+
+    next_cursor = encode_cursor(events[limit - 1]) if len(events) > limit else None
+    return events[:limit], next_cursor
@@ -0,0 +1,57 @@
+import os
+from sqlalchemy import and_, or_, func, case, literal, update, delete
+from app.db.models import FileEntry
+
+# '0' is the character right after '/', so every path under "a/" sorts in ["a/", "a0")
+_PATH_SEP_NEXT = chr(ord("/") + 1)
+
+def descendants_clause(rel_path: str):
+    """
+        WHERE clause for every entry below rel_path (not including rel_path itself).
+        A range predicate instead of LIKE 'a/%' so SQLite can use the path index.
+    """
+    return and_(FileEntry.path >= f"{rel_path}/", FileEntry.path < f"{rel_path}{_PATH_SEP_NEXT}")
+
+def subtree_clause(rel_path: str):
+    """
+        WHERE clause for rel_path and everything below it.
+    """
+    return or_(FileEntry.path == rel_path, descendants_clause(rel_path))
+
+def children_clause(rel_path: str):
+    """
+        WHERE clause for the direct children of rel_path ("" is the storage root), served by the parent_path index.
+    """
+    return FileEntry.parent_path == rel_path
+
+def move_subtree_statement(old_path: str, new_path: str):
+    """
+        One UPDATE that re-roots rel old_path and everything below it at new_path:
+        path = new_path || substr(path, len(old_path) + 1), the same for parent_path, and the name of the top entry.
+        Only file paths change, so file_id (dev-inode) must still be valid, i.e. a rename on the same device.
+    """
+    return (
+        update(FileEntry)
+        .where(subtree_clause(old_path))
+        .values(
+            path=case(
+                (FileEntry.path == old_path, new_path),
+                else_=literal(new_path) + func.substr(FileEntry.path, len(old_path) + 1),
+            ),
+            name=case(
+                (FileEntry.path == old_path, os.path.basename(new_path)),
+                else_=FileEntry.name,
+            ),
+            parent_path=case(
+                (FileEntry.path == old_path, os.path.dirname(new_path)),
+                else_=literal(new_path) + func.substr(FileEntry.parent_path, len(old_path) + 1),
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def delete_subtree_statement(rel_path: str):
+    """
+        One DELETE for rel_path and everything below it.
+    """
+    return delete(FileEntry).where(subtree_clause(rel_path)).execution_options(synchronize_session=False)
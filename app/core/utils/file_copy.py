@@ -0,0 +1,423 @@
+import os
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+import stat
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from app.config import COPY_WORKERS, COPY_PARALLEL_MAX_BYTES
+from app.logger import logger
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# fallocate(2) mode, reserves the blocks without changing st_size
+FALLOC_FL_KEEP_SIZE = 0x01
+
+# ioctl(dst, FICLONE, src) makes dst share all the extents of src (btrfs, xfs with reflink=1), no data is copied
+FICLONE = 0x40049409
+
+# errors that mean "this kernel/filesystem can't do that syscall", the next method is tried
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+# an ioctl the filesystem doesn't know fails with ENOTTY
+_NO_REFLINK = _UNSUPPORTED | {errno.ENOTTY}
+
+_libc = None
+# devices whose filesystem said no to FICLONE, not asked again for every file
+_no_reflink_devices: set[int] = set()
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+def _fallocate():
+    libc = _load_libc()
+    return libc.fallocate if libc else None
+
+def preallocate(path: str, size: int) -> bool:
+    """
+        Reserves size bytes of disk for path without changing its length, so a file written by appending
+        (like a TUS upload) lands in one contiguous extent instead of being fragmented across the HDD.
+
+        returns - False if the filesystem doesn't support it, the file is left untouched in that case
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        return _reserve(fd, size, path)
+    finally:
+        os.close(fd)
+
+def _reserve(fd: int, size: int, path: str, offset: int = 0) -> bool:
+    fallocate = _fallocate()
+    if fallocate is None or size <= 0:
+        return False
+    if fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, size) != 0:
+        err = ctypes.get_errno()
+        if err not in _UNSUPPORTED:
+            raise OSError(err, os.strerror(err), path)
+        return False
+    return True
+
+def _copy_range(in_fd: int, out_fd: int, in_offset: int, out_offset: int, count: int, on_chunk=None,
+                chunk_size: int = COPY_CHUNK_SIZE) -> int:
+    """
+        Copies count bytes between two fds at the given offsets, without going through python when the kernel can.
+
+        copy_file_range is tried first (in-kernel, reflinks on filesystems that can), then sendfile, then
+        pread/pwrite. A method that isn't supported hands over to the next one where it stopped.
+        on_chunk(n) is called with the size of every chunk copied.
+
+        returns - the number of bytes copied, less than count only if the source is shorter
+    """
+    done = 0
+
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            if method == "sendfile":
+                # sendfile writes at the current position of out_fd
+                os.lseek(out_fd, out_offset + done, os.SEEK_SET)
+            while done < count:
+                size = min(chunk_size, count - done)
+                if method == "copy_file_range":
+                    n = os.copy_file_range(in_fd, out_fd, size, in_offset + done, out_offset + done)
+                else:
+                    n = os.sendfile(out_fd, in_fd, in_offset + done, size)
+                if n == 0:
+                    return done
+                done += n
+                if on_chunk:
+                    on_chunk(n)
+            return done
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            logger.debug(f"{method} not usable ({e}), falling back")
+
+    while done < count:
+        chunk = os.pread(in_fd, min(chunk_size, count - done), in_offset + done)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            n = os.pwrite(out_fd, view, out_offset + done)
+            view = view[n:]
+            done += n
+        if on_chunk:
+            on_chunk(len(chunk))
+    return done
+
+def reflink(in_fd: int, out_fd: int) -> bool:
+    """
+        Clones the whole of in_fd into the empty out_fd (FICLONE), instant and no extra space on btrfs/xfs.
+        returns - False if the filesystem can't, out_fd is left untouched in that case
+    """
+    device = os.fstat(out_fd).st_dev
+    if device in _no_reflink_devices:
+        return False
+    try:
+        fcntl.ioctl(out_fd, FICLONE, in_fd)
+        return True
+    except OSError as e:
+        if e.errno not in _NO_REFLINK:
+            raise
+        # EXDEV only says these two files can't share extents, other pairs on the device might
+        if e.errno != errno.EXDEV:
+            _no_reflink_devices.add(device)
+        return False
+
+def sync_filesystem(path: str):
+    """
+        Writes out every dirty page of the filesystem holding path (syncfs), one flush for a whole copied tree
+        instead of an fsync per file. Falls back to sync() where syncfs isn't available.
+    """
+    libc = _load_libc()
+    syncfs = getattr(libc, "syncfs", None) if libc else None
+    if syncfs is None:
+        os.sync()
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if syncfs(fd) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+    finally:
+        os.close(fd)
+
+def copy_file(src: str, dst: str, on_progress=None, chunk_size: int = COPY_CHUNK_SIZE, fsync: bool = True) -> int:
+    """
+        Copies the contents of src into dst (created or truncated) without pulling the data through python.
+        A reflink is tried first, then the kernel copy of _copy_range.
+        on_progress(copied, total) is called after every chunk.
+        fsync - False when the caller syncs the filesystem once for many files
+
+        returns - the number of bytes copied
+    """
+    total = os.path.getsize(src)
+    copied = 0
+
+    def on_chunk(n: int):
+        nonlocal copied
+        copied += n
+        if on_progress:
+            on_progress(copied, total)
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        if total and reflink(in_fd, out_fd):
+            on_chunk(total)
+        else:
+            # a file written in one chunk lands in one extent anyway
+            if total > chunk_size:
+                _reserve(out_fd, total, dst)
+            _copy_range(in_fd, out_fd, 0, 0, total, on_chunk, chunk_size)
+        if fsync:
+            os.fsync(out_fd)
+
+    shutil.copystat(src, dst)
+    return copied
+
+def is_copy_of(src_stat: os.stat_result, dst: str) -> bool:
+    """
+        returns - whether dst is a regular file with the size and mtime of the source, what a completed copy_file
+        leaves behind
+    """
+    try:
+        dst_stat = os.stat(dst, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(dst_stat.st_mode)
+        and dst_stat.st_size == src_stat.st_size
+        and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+    )
+
+def copy_file_checkpointed(src: str, dst: str, on_progress=None, verify=None) -> int:
+    """
+        copy_file for copies that have to survive a crash. The data goes to a hidden temp file next to dst, is
+        fsynced, checked and renamed onto dst, so a file that has its final name is complete. A dst that already
+        has the size and mtime of src (done by an earlier run that was interrupted) isn't copied again.
+
+        verify(src, tmp) - called before the rename, raise from it to reject the copy (the sizes are always checked)
+
+        returns - the size of the file, copied now or before
+    """
+    src_stat = os.stat(src)
+    size = src_stat.st_size
+
+    if is_copy_of(src_stat, dst):
+        if on_progress:
+            on_progress(size, size)
+        return size
+
+    tmp = part_path(dst)
+    try:
+        copy_file(src, tmp, on_progress)
+        if os.path.getsize(tmp) != size or os.path.getsize(src) != size:
+            raise OSError(errno.EIO, f"{src} changed while it was being copied", src)
+        if verify:
+            verify(src, tmp)
+        os.rename(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return size
+
+def copy_tree(src: str, dst: str, on_copied=None, on_progress=None, check=None, total: int | None = None,
+              workers: int = COPY_WORKERS, parallel_max_bytes: int = COPY_PARALLEL_MAX_BYTES,
+              checkpoint: bool = False, verify=None) -> int:
+    """
+        Copies the folder src to dst (which must not exist) like shutil.copytree(symlinks=True), but many small
+        files at a time and with progress.
+
+        Folders are created as the source is scanned and every file is copied with copy_file (reflink, then
+        copy_file_range) on a pool of workers threads. Files bigger than parallel_max_bytes are copied one at a
+        time, a HDD streams one big file faster than it seeks between several. Files aren't fsynced one by one,
+        the filesystem is synced once at the end. Entries that are neither files, folders nor symlinks are skipped.
+
+        on_copied(dst_path) - called in the calling thread for every file, symlink and folder once it's in place,
+                              folders after their contents (when their times are final)
+        on_progress(copied, total) - bytes, called from the copy threads
+        check() - called before every file and chunk, raise from it to stop the copy
+        total - the bytes to copy if the caller knows it, passed on to on_progress
+        checkpoint - dst may be what an interrupted run left, files are copied with copy_file_checkpointed (each one
+                     fsynced, verified and renamed into place) and the ones already done are skipped
+        verify(src, tmp) - with checkpoint, see copy_file_checkpointed
+
+        returns - the number of bytes copied (with checkpoint, the skipped files count too)
+    """
+    lock = threading.Lock()
+    large = threading.Lock()
+    copied = 0
+
+    def copy_one(src_path: str, dst_path: str, size: int) -> str:
+        last = 0
+
+        def on_file_progress(file_copied: int, file_total: int):
+            nonlocal copied, last
+            with lock:
+                copied += file_copied - last
+                done = copied
+            last = file_copied
+            if on_progress:
+                on_progress(done, total)
+            if check:
+                check()
+
+        def copy():
+            if checkpoint:
+                copy_file_checkpointed(src_path, dst_path, on_file_progress, verify)
+            else:
+                copy_file(src_path, dst_path, on_file_progress, fsync=False)
+
+        if check:
+            check()
+        if size > parallel_max_bytes:
+            with large:
+                copy()
+        else:
+            copy()
+        return dst_path
+
+    def finish(futures, return_when) -> set:
+        done, not_done = wait(futures, return_when=return_when)
+        for future in done:
+            path = future.result()
+            if on_copied:
+                on_copied(path)
+        return not_done
+
+    os.makedirs(dst, exist_ok=checkpoint)
+    folders = [(src, dst)]
+    stack = [(src, dst)]
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="storagepod-copy") as pool:
+        try:
+            while stack:
+                src_dir, dst_dir = stack.pop()
+                with os.scandir(src_dir) as it:
+                    for entry in it:
+                        if check:
+                            check()
+                        dst_path = os.path.join(dst_dir, entry.name)
+                        if entry.is_symlink():
+                            if not (checkpoint and os.path.islink(dst_path)):
+                                os.symlink(os.readlink(entry.path), dst_path)
+                            if on_copied:
+                                on_copied(dst_path)
+                        elif entry.is_dir():
+                            os.makedirs(dst_path, exist_ok=checkpoint)
+                            stack.append((entry.path, dst_path))
+                            folders.append((entry.path, dst_path))
+                        elif entry.is_file():
+                            pending.add(pool.submit(copy_one, entry.path, dst_path, entry.stat().st_size))
+                            # keeps the queue (and the memory) bounded on trees with millions of files
+                            if len(pending) >= workers * 4:
+                                pending = finish(pending, FIRST_COMPLETED)
+                        else:
+                            logger.warning(f"Skipping {entry.path}, not a regular file")
+            pending = finish(pending, ALL_COMPLETED)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    # deepest first, creating the entries of a folder changed its mtime
+    for src_dir, dst_dir in reversed(folders):
+        shutil.copystat(src_dir, dst_dir)
+        if on_copied:
+            on_copied(dst_dir)
+
+    sync_filesystem(dst)
+    return copied
+
+def part_path(dst: str) -> str:
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.part")
+
+def move_file(src: str, dst: str, on_progress=None) -> bool:
+    """
+        Moves a single file to dst, an existing dst is replaced (like os.rename).
+
+        On the same device this is one atomic rename. Across devices the data is copied with copy_file
+        into a hidden temp file next to dst, fsynced and renamed into place, so dst never shows up half written,
+        then src is removed.
+
+        returns - True if it was a rename, False if the data had to be copied
+    """
+    try:
+        os.rename(src, dst)
+        return True
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp = part_path(dst)
+    try:
+        copy_file(src, tmp, on_progress)
+        os.rename(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    os.remove(src)
+    return False
+
+def concat_files(sources: list[str], dst: str, on_progress=None, chunk_size: int = COPY_CHUNK_SIZE) -> int:
+    """
+        Stitches sources, in order, into dst (replaced if it exists).
+
+        The first source is moved into a hidden temp file next to dst (a rename when it's on the same device,
+        so its bytes are never copied), the others are appended to it with copy_file_range and the result is
+        renamed onto dst. The other sources are left in place, the caller removes them. If anything fails the
+        first source is put back so the parts can be concatenated again.
+
+        returns - the size of dst
+    """
+    first, rest = sources[0], sources[1:]
+    first_size = os.path.getsize(first)
+    sizes = [os.path.getsize(path) for path in rest]
+    total = first_size + sum(sizes)
+    copied = first_size
+
+    def on_chunk(n: int):
+        nonlocal copied
+        copied += n
+        if on_progress:
+            on_progress(copied, total)
+
+    tmp = part_path(dst)
+    move_file(first, tmp)
+    try:
+        with open(tmp, "r+b") as fdst:
+            out_fd = fdst.fileno()
+            _reserve(out_fd, total - first_size, tmp, offset=first_size)
+            offset = first_size
+            for path, size in zip(rest, sizes):
+                with open(path, "rb") as fsrc:
+                    if _copy_range(fsrc.fileno(), out_fd, 0, offset, size, on_chunk, chunk_size) != size:
+                        raise OSError(errno.EIO, f"{path} changed while it was being concatenated")
+                offset += size
+            os.fsync(out_fd)
+        os.rename(tmp, dst)
+    except BaseException:
+        try:
+            os.truncate(tmp, first_size)
+            move_file(tmp, first)
+        except OSError:
+            logger.error(f"Could not restore {first} after a failed concatenation")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    return total
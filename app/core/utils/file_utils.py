@@ -1,110 +1,175 @@
 import asyncio, os
-from streaming_form_data.targets import FileTarget
-from app.core.utils.upload_tasks import update_progress
+from streaming_form_data.targets import BaseTarget
 from streaming_form_data import StreamingFormDataParser
-from app.db.main import get_session
-import re
+from streaming_form_data.parser import ParseFailedException
 from fastapi import Request
-from starlette.requests import ClientDisconnect
+from fastapi.concurrency import run_in_threadpool
+from app.config import UPLOAD_WRITE_BUFFER, UPLOAD_PROGRESS_INTERVAL
+from app.core.utils.upload_tasks import update_progress
+from app.core.utils.upload_checksum import RunningHash
+from app.core.utils.file_copy import preallocate
+
+# writes are cut on this boundary so every write but the last starts on a page aligned offset
+WRITE_ALIGNMENT = 4096
 
-class TrackingFileTarget(FileTarget):
-    """File target that tracks upload progress for large files"""
+class BufferedFileTarget(BaseTarget):
+    """
+        Multipart target that writes one file through a hidden temp file next to its destination.
 
-    def __init__(self, file_path: str, task_id: str, filename: str):
+        The parser hands it whatever chunk sizes the client and Starlette produce (often 64KB), they are only
+        appended to a buffer here. Every UPLOAD_WRITE_BUFFER bytes the buffer is cut into a block (a multiple of
+        WRITE_ALIGNMENT) that the caller writes with write_block off the event loop. commit() writes the tail,
+        fsyncs and renames the temp file onto the destination, so the destination is never half written.
+    """
+
+    def __init__(self, file_path: str, buffer_size: int = UPLOAD_WRITE_BUFFER):
         """
-            file_path - the abs path of the file
-            task_id - the task id of the upload
-            filename - the file name. 
+            file_path - the abs path of the destination file
         """
-        super().__init__(filename=file_path)
-        self.task_id = task_id
-        self.bytes_written = 0 # bytes written to the dest filepath
-        self.last_progress_update = 0
-        self.progress_threshold = 1024 * 1024 * 16  # Update every 16MB to avoid too frequent updates
-
-    async def update_progress_wrapper(self, written, total):
-        with get_session() as session:
-            await update_progress(session, self.task_id, written, total)
-    
+        super().__init__()
+        self.file_path = file_path
+        self.tmp_path = os.path.join(os.path.dirname(file_path), f".{os.path.basename(file_path)}.part")
+        self.buffer_size = max(WRITE_ALIGNMENT, buffer_size - buffer_size % WRITE_ALIGNMENT)
+        self.bytes_received = 0 # bytes of the file parsed out of the body
+        self.bytes_written = 0 # bytes of the file on disk
+        self.hash = RunningHash() # digest of the file, fed with the blocks as they are written
+        self._buffer = bytearray()
+        self._ready = []
+        self._fd = None
+        self.started = False # the "file" field was in the body
+
+    @property
+    def checksum(self) -> str:
+        return self.hash.checksum
+
+    def open(self, size_hint: int | None = None):
+        """
+            Creates the temp file, blocking. size_hint (the Content-Length) reserves the disk up front, it's a bit
+            more than the file because of the multipart framing, commit() gives the rest back.
+        """
+        self._fd = os.open(self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if size_hint:
+            preallocate(self.tmp_path, size_hint)
+
     def on_start(self):
-        """Called when file upload starts"""
-        super().on_start()
-        #asyncio.create_task(self.update_progress_wrapper(0, 0))
-    
+        self.started = True
+
     def on_data_received(self, chunk: bytes):
-        """Called for each chunk - optimized for large files"""
-        super().on_data_received(chunk)
-        self.bytes_written += len(chunk)
-
-        # Only update progress every 16MB to avoid performance overhead
-        if self.bytes_written - self.last_progress_update >= self.progress_threshold:
-            self.last_progress_update = self.bytes_written
-            #asyncio.create_task(self.update_progress_wrapper(self.bytes_written, self.bytes_written))
-    
-    def on_finish(self):
-        super().on_finish()
-        #asyncio.create_task(self.update_progress_wrapper(self.bytes_written, self.bytes_written))
+        self._buffer += chunk
+        self.bytes_received += len(chunk)
+        if len(self._buffer) >= self.buffer_size:
+            cut = len(self._buffer) - len(self._buffer) % WRITE_ALIGNMENT
+            block, self._buffer = self._buffer, self._buffer[cut:]
+            del block[cut:]
+            self._ready.append(block)
+
+    def take_ready(self) -> list:
+        """
+            returns - the full blocks buffered since the last call, in file order
+        """
+        ready, self._ready = self._ready, []
+        return ready
+
+    def write_block(self, block: bytes):
+        """
+            Hashes and writes a block at the end of the temp file, blocking (hashlib and os.pwrite release the GIL).
+        """
+        self.hash.update(block)
+        view = memoryview(block)
+        while view:
+            n = os.pwrite(self._fd, view, self.bytes_written)
+            view = view[n:]
+            self.bytes_written += n
+
+    def commit(self):
+        """
+            Writes what is left in the buffer, trims the preallocated blocks past the end, fsyncs and renames the
+            temp file onto the destination (replacing it). Blocking.
+        """
+        for block in self.take_ready():
+            self.write_block(block)
+        if self._buffer:
+            self.write_block(self._buffer)
+            self._buffer = bytearray()
+        os.ftruncate(self._fd, self.bytes_written)
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        os.replace(self.tmp_path, self.file_path)
+
+    def abort(self):
+        """
+            Drops the temp file, blocking. The destination is left as it was.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
 
 class SingleFileStreamingParser:
-    """Custom parser to handle multiple large files in streaming fashion"""
+    """
+        Streams a multipart/form-data body with one "file" field into file_path.
+
+        The body is parsed on the event loop as it arrives (the parser is a C extension), the file is written in
+        UPLOAD_WRITE_BUFFER blocks on the threadpool. One block is written while the next one fills up, and the
+        request isn't read further until the previous write is done, so a slow disk slows down the client instead
+        of piling up buffers in memory. Progress goes to the UploadTask table every UPLOAD_PROGRESS_INTERVAL bytes.
+    """
 
-    def __init__(self, request_headers: dict, dest_dir: str, task_id: str, filename: str):
+    def __init__(self, request_headers, file_path: str, task_id: str, buffer_size: int = UPLOAD_WRITE_BUFFER):
+        """
+            raises - ValueError if the headers don't describe a multipart body (e.g. no boundary)
+        """
         self.headers = request_headers
-        self.dest_dir = dest_dir
         self.task_id = task_id
-        self.filename = filename
-        self.parser = StreamingFormDataParser(headers=request_headers)
-
-    def _sanitize_filename(self, filename: str):
-        """Sanitize filename to prevent directory traversal and ensure uniqueness"""
-        filename = os.path.basename(filename)
-
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-
-        # Ensure we have a filename
-        if not filename or filename.startswith('.'):
-            raise ValueError("Invalid Filename")
-         
-        return filename
-    
-    def _create_file_target(self, filename: str):
-        """Create a file target for the given filename"""
-
-        safe_filename = self._sanitize_filename(filename=filename)
-        file_path = os.path.join(self.dest_dir, safe_filename)
-
-        target = TrackingFileTarget(file_path=file_path, task_id=self.task_id, filename=safe_filename)
-        self.saved_filename = safe_filename
+        self.target = BufferedFileTarget(file_path, buffer_size)
+        try:
+            self.parser = StreamingFormDataParser(headers=request_headers)
+        except ParseFailedException as e:
+            raise ValueError(f"Invalid multipart request: {e}") from e
+        self.parser.register("file", self.target)
 
-        return target
-    
-    async def parse_and_save_files(self, request: Request):
-        """Parse multipart stream and save files, returning list of saved filenames"""
-        print("HEADERS:", dict(request.headers))
+    async def parse_and_save(self, request: Request) -> BufferedFileTarget:
+        """
+            Reads the whole body and commits the file.
 
-        self.parser.register('file', TrackingFileTarget(file_path="/tmp/pavan.py", task_id=self.task_id, filename="sample.py"))
+            returns - the target, its checksum and bytes_written describe the saved file
+            raises - ClientDisconnect, ValueError if the body has no "file" field, anything the parser or the
+                     disk raise. The destination is untouched and the temp file is removed in all those cases.
+        """
+        target = self.target
+        total = int(self.headers.get("content-length") or 0)
 
+        pending = None
+        reported = 0
         try:
+            await run_in_threadpool(target.open, total)
             async for chunk in request.stream():
                 self.parser.data_received(chunk)
-
-            self.parser.finalize()    
-        except ClientDisconnect:
+                for block in target.take_ready():
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.ensure_future(run_in_threadpool(target.write_block, block))
+
+                if target.bytes_written - reported >= UPLOAD_PROGRESS_INTERVAL:
+                    reported = target.bytes_written
+                    await update_progress(self.task_id, reported, total)
+
+            if pending is not None:
+                await pending
+                pending = None
+
+            if not target.started:
+                raise ValueError("File field is missing in form-data")
+
+            await run_in_threadpool(target.commit)
+        except BaseException:
+            if pending is not None:
+                # the thread can't be cancelled, let the write finish before the file goes away
+                await asyncio.gather(pending, return_exceptions=True)
+            await run_in_threadpool(target.abort)
             raise
-        except Exception as e:
-            raise Exception(f"Upload parsing failed: {str(e)}")
-        
-        return self.filename
-
-class ProgressFileTarget(FileTarget):
-    def __init__(self, file_path, upload_id, progress_store):
-        super().__init__(file_path)
-        self.upload_id = upload_id
-        self.progress_store = progress_store
-        self.bytes_written = 0
-
-    def on_data_received(self, chunk):
-        super().on_data_received(chunk)
-        self.bytes_written += len(chunk)
-        # Save progress bytes atomically in shared store
-        self.progress_store[self.upload_id] = self.bytes_written
+
+        await update_progress(self.task_id, target.bytes_written, target.bytes_written)
+        return target
@@ -0,0 +1,277 @@
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import delete
+from sqlmodel import select
+from app.db.main import get_session
+from app.db.models import FileEntry
+from app.core.utils import activity_store
+from app.core.utils.db_utils import subtree_clause, move_subtree_statement, delete_subtree_statement
+from app.core.utils.indexer import path_row, iter_tree, upsert_rows
+from app.logger import logger
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # pragma: no cover - watcher is optional
+    Observer = None
+    FileSystemEventHandler = object
+
+# flush early if this many distinct paths are waiting, keeps memory flat during bulk copies
+MAX_PENDING_PATHS = 10000
+
+# kinds of pending changes, a later event on the same path replaces the earlier one
+_UPSERT = "upsert"
+_TREE = "tree"       # a folder appeared (created/moved in), its whole subtree needs indexing
+_DELETE = "delete"
+
+def _has_row(session, rel_path: str) -> bool:
+    return session.exec(select(FileEntry.path).where(FileEntry.path == rel_path)).first() is not None
+
+class _EventHandler(FileSystemEventHandler):
+
+    def __init__(self, watcher: "FileSystemWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def dispatch(self, event):
+        # the entries inside a folder that was moved, or created/moved in with its contents, are reported one by
+        # one as synthetic events, the event of the folder itself already covers them
+        if event.is_synthetic:
+            return
+        super().dispatch(event)
+
+    def on_created(self, event):
+        self.watcher.queue(event.src_path, _TREE if event.is_directory else _UPSERT, "created")
+
+    def on_modified(self, event):
+        if event.is_directory:
+            # its listing changed, the children report themselves, only the folder's own row (mtime) is refreshed
+            self.watcher.queue(event.src_path, _UPSERT)
+        else:
+            self.watcher.queue(event.src_path, _UPSERT, "modified")
+
+    def on_deleted(self, event):
+        self.watcher.queue(event.src_path, _DELETE)
+
+    def on_moved(self, event):
+        self.watcher.queue_move(event.src_path, event.dest_path, event.is_directory)
+
+    def on_closed(self, event):
+        # end of a write, carries the final size
+        self.watcher.queue(event.src_path, _UPSERT)
+
+class FileSystemWatcher:
+    """
+        Keeps FileEntry in sync with changes made outside the API (samba, jellyfin, ssh ...).
+
+        Events are coalesced per path and applied by a single flusher thread every debounce interval, so a
+        burst of thousands of modify events for one file costs one stat and one row. Each flush is one transaction,
+        and created/modified files are recorded in the activity store in the same transaction.
+
+        A rename inside the root re-roots the rows of the moved entry and everything below it with one UPDATE,
+        and a path below a folder that is re-indexed or deleted in the same flush isn't handled on its own.
+    """
+
+    def __init__(self, root_path: str, debounce_seconds: float = 1.0, ignore_paths: list[str] | None = None):
+        self.root_path = os.path.realpath(root_path)
+        self.debounce_seconds = debounce_seconds
+        self.ignore_paths = [os.path.realpath(p) for p in (ignore_paths or []) if p]
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[str, str | None]] = {}
+        # (old, new) abs paths of renames inside the root, in the order they happened
+        self._moves: list[tuple[str, str]] = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._flusher: threading.Thread | None = None
+        self.events_applied = 0
+
+    def _is_ignored(self, abs_path: str) -> bool:
+        for ignored in self.ignore_paths:
+            if abs_path == ignored or abs_path.startswith(ignored + os.sep):
+                return True
+        return False
+
+    def _is_watched(self, abs_path: str) -> bool:
+        return abs_path.startswith(self.root_path + os.sep) and not self._is_ignored(abs_path)
+
+    def queue(self, abs_path: str, kind: str, activity: str | None = None):
+        if isinstance(abs_path, bytes):
+            abs_path = os.fsdecode(abs_path)
+
+        if not self._is_watched(abs_path):
+            return
+
+        with self._lock:
+            previous = self._pending.get(abs_path)
+            # keep a pending subtree scan and the first activity seen for the path
+            if previous is not None:
+                if previous[0] == _TREE and kind == _UPSERT:
+                    kind = _TREE
+                activity = previous[1] or activity
+            self._pending[abs_path] = (kind, activity)
+            overflow = len(self._pending) + len(self._moves) >= MAX_PENDING_PATHS
+
+        if overflow:
+            self._wakeup.set()
+
+    def queue_move(self, src_path: str, dest_path: str, is_directory: bool):
+        src_path, dest_path = os.fsdecode(src_path), os.fsdecode(dest_path)
+
+        if not self._is_watched(src_path):
+            # moved in from outside the root (or from an ignored folder), there are no rows to re-root
+            self.queue(dest_path, _TREE if is_directory else _UPSERT, "created")
+            return
+        if not self._is_watched(dest_path):
+            self.queue(src_path, _DELETE)
+            return
+
+        with self._lock:
+            self._moves.append((src_path, dest_path))
+            # what is still pending for the moved entry or below it happened before the rename, its rows are
+            # re-rooted first so the change is applied at the new path
+            prefix = src_path + os.sep
+            moved = [path for path in self._pending if path == src_path or path.startswith(prefix)]
+            for path in moved:
+                self._pending[dest_path + path[len(src_path):]] = self._pending.pop(path)
+            # the entry's own row, in case it wasn't indexed yet
+            self._pending.setdefault(dest_path, (_UPSERT, None))
+            overflow = len(self._pending) + len(self._moves) >= MAX_PENDING_PATHS
+
+        if overflow:
+            self._wakeup.set()
+
+    def _take_pending(self) -> tuple[list, dict]:
+        with self._lock:
+            moves, self._moves = self._moves, []
+            pending, self._pending = self._pending, {}
+        return moves, pending
+
+    def _is_covered(self, abs_path: str, covering: set) -> bool:
+        """
+            Whether a folder above abs_path is re-indexed or deleted in this flush, which takes care of abs_path too.
+        """
+        parent = os.path.dirname(abs_path)
+        while parent != self.root_path and len(parent) > len(self.root_path):
+            if parent in covering:
+                return True
+            parent = os.path.dirname(parent)
+        return False
+
+    def flush(self):
+        """
+            Applies every pending change in one transaction.
+        """
+        moves, pending = self._take_pending()
+        if not moves and not pending:
+            return
+
+        now = datetime.now()
+        rows = []
+        removed = []
+        trees = []
+        activity = []
+        covering = {abs_path for abs_path, (kind, _) in pending.items() if kind in (_TREE, _DELETE)}
+
+        for abs_path, (kind, event) in pending.items():
+            rel_path = os.path.relpath(abs_path, self.root_path)
+
+            if self._is_covered(abs_path, covering):
+                # no row of its own, but a file created in a folder that was just copied in is still activity
+                if event is not None and os.path.isfile(abs_path):
+                    activity.append({"path": abs_path, "event": event, "timestamp": now})
+                continue
+
+            if kind == _DELETE or not os.path.lexists(abs_path):
+                removed.append(rel_path)
+                continue
+
+            try:
+                rows.append(path_row(abs_path, rel_path, now))
+            except OSError:
+                removed.append(rel_path)
+                continue
+
+            if kind == _TREE and os.path.isdir(abs_path) and not os.path.islink(abs_path):
+                trees.append((abs_path, rel_path))
+
+            if event is not None and rows[-1]["type"] == "file":
+                activity.append({"path": abs_path, "event": event, "timestamp": now})
+
+        with get_session() as session:
+            for src_path, dest_path in moves:
+                old_rel_path = os.path.relpath(src_path, self.root_path)
+                new_rel_path = os.path.relpath(dest_path, self.root_path)
+                if _has_row(session, old_rel_path):
+                    # rows left at the destination by whatever was replaced
+                    session.execute(delete_subtree_statement(new_rel_path))
+                    session.execute(move_subtree_statement(old_rel_path, new_rel_path))
+                elif (
+                    not _has_row(session, new_rel_path)
+                    and os.path.isdir(dest_path) and not os.path.islink(dest_path)
+                    and dest_path not in covering and not self._is_covered(dest_path, covering)
+                ):
+                    # never indexed, the rename is the first time it's seen
+                    trees.append((dest_path, new_rel_path))
+                # else the API made the rename and already moved the rows
+
+            for rel_path in removed:
+                session.execute(delete(FileEntry).where(subtree_clause(rel_path)))
+
+            upsert_rows(session, rows)
+
+            activity_store.record(session, activity)
+
+            session.commit()
+
+            # folders moved in from outside don't report their children, index them in batches
+            for abs_path, rel_path in trees:
+                batch = []
+                for row in iter_tree(abs_path, rel_root=rel_path):
+                    batch.append(row)
+                    if len(batch) >= MAX_PENDING_PATHS:
+                        upsert_rows(session, batch)
+                        session.commit()
+                        batch = []
+                upsert_rows(session, batch)
+                session.commit()
+
+        self.events_applied += len(moves) + len(pending)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.debounce_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error while applying filesystem events - {e}")
+
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error while applying filesystem events - {e}")
+
+    def start(self) -> bool:
+        if Observer is None:
+            logger.warning("watchdog is not installed, filesystem watcher disabled")
+            return False
+
+        self._observer = Observer()
+        self._observer.schedule(_EventHandler(self), self.root_path, recursive=True)
+        self._observer.start()
+
+        self._flusher = threading.Thread(target=self._run, name="storagepod-watcher", daemon=True)
+        self._flusher.start()
+        logger.info(f"Watching {self.root_path} for changes")
+        return True
+
+    def stop(self, timeout: float | None = 5):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout)
+        self._stop.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
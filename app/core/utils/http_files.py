@@ -0,0 +1,271 @@
+import os
+import stat
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from secrets import token_hex
+from urllib.parse import quote
+import anyio
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+FILE_CHUNK_SIZE = 256 * 1024
+# more ranges than this in one request is either a broken client or abuse, the whole file is sent instead
+MAX_RANGES = 32
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """
+        Strong validator from inode, size and mtime (ns). Changes whenever the file is replaced or rewritten.
+    """
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def _etag_list(header: str) -> list[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _weak_match(tag: str, etag: str) -> bool:
+    return tag.removeprefix("W/") == etag.removeprefix("W/")
+
+def is_not_modified(request_headers: Headers, etag: str, mtime: float) -> bool:
+    """
+        If-None-Match (weak comparison) wins over If-Modified-Since, as in RFC 9110 13.2.2.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or any(_weak_match(tag, etag) for tag in tags)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified only has second precision
+        return int(mtime) <= since
+
+    return False
+
+def if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    """
+        A weak etag never matches If-Range, a date has to be exactly our Last-Modified.
+    """
+    if_range = if_range.strip()
+    if if_range.startswith("W/"):
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return if_range == last_modified
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+        Parses a bytes Range header into sorted, merged [start, end) ranges.
+
+        returns - None if the header should be ignored (malformed, other unit, too many ranges)
+        raises RangeNotSatisfiable if none of the ranges overlap the file
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if not parts or len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, dash, last = part.partition("-")
+        if not dash:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first:
+                start = int(first)
+                end = int(last) + 1 if last else size
+                if start < 0 or (last and end <= start):
+                    return None
+            else:
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size
+        except ValueError:
+            return None
+
+        if start < size:
+            ranges.append((start, min(end, size)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+class RangeFileResponse(Response):
+    """
+        Sends a file with Range/If-Range (single and multipart/byteranges), ETag/Last-Modified validators and
+        304s for If-None-Match/If-Modified-Since.
+
+        The body goes out with the ASGI zero-copy extension (sendfile) when the server offers it, otherwise it's
+        read with pread in the threadpool. Streaming stops as soon as the client disconnects, which is what
+        makes seeking in a video player cheap: every seek aborts the previous request.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result | None = None,
+        filename: str | None = None,
+        media_type: str | None = None,
+        content_disposition_type: str = "attachment",
+    ):
+        self.path = path
+        self.status_code = 200
+        self.background = None
+        self.stat_result = stat_result or os.stat(path)
+        if not stat.S_ISREG(self.stat_result.st_mode):
+            raise RuntimeError(f"{path} is not a regular file")
+
+        self.media_type = media_type or mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+        self.etag = file_etag(self.stat_result)
+        self.last_modified = formatdate(self.stat_result.st_mtime, usegmt=True)
+
+        self.init_headers({
+            "accept-ranges": "bytes",
+            "etag": self.etag,
+            "last-modified": self.last_modified,
+            "cache-control": "private, no-cache",
+        })
+        self.headers["content-length"] = str(self.stat_result.st_size)
+
+        if filename is not None:
+            quoted = quote(filename)
+            if quoted != filename:
+                self.headers["content-disposition"] = f"{content_disposition_type}; filename*=utf-8''{quoted}"
+            else:
+                self.headers["content-disposition"] = f'{content_disposition_type}; filename="{filename}"'
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        method = scope.get("method", "GET").upper()
+        size = self.stat_result.st_size
+
+        if is_not_modified(request_headers, self.etag, self.stat_result.st_mtime):
+            headers = [(k, v) for k, v in self.raw_headers if k not in (b"content-length", b"content-type", b"content-disposition")]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and size > 0 and (if_range is None or if_range_matches(if_range, self.etag, self.last_modified)):
+            try:
+                ranges = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                await send({"type": "http.response.start", "status": 416, "headers": [
+                    (b"content-range", f"bytes */{size}".encode("latin-1")),
+                    (b"content-length", b"0"),
+                ]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if not ranges:
+            status, headers, parts = 200, self.raw_headers, [(None, 0, size)]
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            headers = [(k, v) for k, v in self.raw_headers if k != b"content-length"]
+            headers += [
+                (b"content-range", f"bytes {start}-{end - 1}/{size}".encode("latin-1")),
+                (b"content-length", str(end - start).encode("latin-1")),
+            ]
+            status, parts = 206, [(None, start, end)]
+        else:
+            status, headers, parts = 206, *self._multipart(ranges, size)
+
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+        if method == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async with anyio.create_task_group() as task_group:
+
+            async def stream():
+                await self._send_parts(send, parts, scope)
+                task_group.cancel_scope.cancel()
+
+            async def watch_disconnect():
+                while True:
+                    message = await receive()
+                    if message["type"] == "http.disconnect":
+                        task_group.cancel_scope.cancel()
+                        return
+
+            task_group.start_soon(stream)
+            task_group.start_soon(watch_disconnect)
+
+    def _multipart(self, ranges: list[tuple[int, int]], size: int):
+        boundary = token_hex(13)
+        parts = []
+        length = 0
+        for start, end in ranges:
+            head = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            parts.append((head, start, end))
+            parts.append((b"\r\n", 0, 0))
+            length += len(head) + (end - start) + 2
+        parts.append((f"--{boundary}--\r\n".encode("latin-1"), 0, 0))
+        length += len(parts[-1][0])
+
+        headers = [(k, v) for k, v in self.raw_headers if k not in (b"content-length", b"content-type")]
+        headers += [
+            (b"content-type", f"multipart/byteranges; boundary={boundary}".encode("latin-1")),
+            (b"content-length", str(length).encode("latin-1")),
+        ]
+        return headers, parts
+
+    async def _send_parts(self, send, parts, scope):
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+
+        with open(self.path, "rb") as file:
+            fd = file.fileno()
+            for prefix, start, end in parts:
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+
+                if end <= start:
+                    continue
+
+                if zero_copy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": start,
+                        "count": end - start,
+                        "more_body": True,
+                    })
+                    continue
+
+                offset = start
+                while offset < end:
+                    chunk = await run_in_threadpool(os.pread, fd, min(FILE_CHUNK_SIZE, end - offset), offset)
+                    if not chunk:
+                        raise RuntimeError(f"{self.path} is shorter than expected")
+                    offset += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,318 @@
+import os
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import delete, case, and_
+from sqlalchemy.dialects.sqlite import insert
+from app.db.main import get_session
+from app.db.models import FileEntry
+from app.core.utils import progress_store
+from app.logger import logger
+
+INDEX_BATCH_SIZE = 5000
+# paths per stale-row check, keeps the IN lists well under the sqlite variable limit
+STALE_CHECK_CHUNK = 500
+PROGRESS_LOG_INTERVAL = 50000
+
+class IndexProgress:
+    """
+        Counters of a running index build, updated after every committed batch.
+    """
+
+    def __init__(self):
+        self.indexed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.finished_at: float | None = None
+        self.cancel_requested = False
+        self.on_batch = None   # called after every committed batch
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.indexed / elapsed if elapsed > 0 else 0.0
+
+def entry_row(entry: os.DirEntry, rel_path: str, now: datetime) -> dict:
+    """
+        Builds a FileEntry row from a DirEntry. stat() is cached on the entry so this costs a single syscall.
+    """
+    stats = entry.stat()
+    return {
+        "file_id": f"{stats.st_dev}-{stats.st_ino}",
+        "path": rel_path,
+        "parent_path": os.path.dirname(rel_path),
+        "name": entry.name,
+        "type": "folder" if entry.is_dir() else "file",
+        "size": stats.st_size,
+        "modified_at": datetime.fromtimestamp(stats.st_mtime),
+        "created_at": now,
+    }
+
+def path_row(abs_path: str, rel_path: str, now: datetime) -> dict:
+    """
+        Same as entry_row but for a single path (used when there is no DirEntry at hand).
+    """
+    stats = os.stat(abs_path)
+    return {
+        "file_id": f"{stats.st_dev}-{stats.st_ino}",
+        "path": rel_path,
+        "parent_path": os.path.dirname(rel_path),
+        "name": os.path.basename(rel_path),
+        "type": "folder" if os.path.isdir(abs_path) else "file",
+        "size": stats.st_size,
+        "modified_at": datetime.fromtimestamp(stats.st_mtime),
+        "created_at": now,
+    }
+
+def iter_tree(root_path: str, on_error=None, rel_root: str = ""):
+    """
+        Yields a FileEntry row for every file and folder under root_path.
+
+        Uses an explicit stack of pending folders instead of os.walk, so only one open scandir iterator
+        and the list of not yet visited folders are held in memory. Symlinked folders are listed but not followed.
+        rel_root is the path of root_path relative to the storage dir when indexing a sub folder.
+    """
+    now = datetime.now()
+    stack = [(rel_root, root_path)]
+
+    while stack:
+        rel_dir, abs_dir = stack.pop()
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    try:
+                        row = entry_row(entry, rel_path, now)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((rel_path, entry.path))
+                    except OSError as e:
+                        if on_error:
+                            on_error(entry.path, e)
+                        continue
+
+                    yield row
+        except OSError as e:
+            if on_error:
+                on_error(abs_dir, e)
+
+def upsert_statement():
+    stmt = insert(FileEntry)
+    return stmt.on_conflict_do_update(
+        index_elements=[FileEntry.file_id],
+        set_={
+            "path": stmt.excluded.path,
+            "parent_path": stmt.excluded.parent_path,
+            "name": stmt.excluded.name,
+            "type": stmt.excluded.type,
+            "size": stmt.excluded.size,
+            "modified_at": stmt.excluded.modified_at,
+            # rows from a scan carry no checksum, an upload's digest is kept until the file's size or mtime changes
+            "checksum": case(
+                (stmt.excluded.checksum.is_not(None), stmt.excluded.checksum),
+                (and_(FileEntry.size == stmt.excluded.size, FileEntry.modified_at == stmt.excluded.modified_at), FileEntry.checksum),
+                else_=None,
+            ),
+        }
+    )
+
+def upsert_rows(session, rows: list[dict]):
+    """
+        Writes the rows with a single executemany INSERT ... ON CONFLICT(file_id) DO UPDATE.
+        Same semantics as session.merge() but without a SELECT per row or the ORM identity map.
+
+        A path whose row belongs to another inode (file replaced by an atomic save, folder re-created) has that
+        old row dropped first, otherwise the insert would hit the unique path index.
+    """
+    if not rows:
+        return
+
+    for start in range(0, len(rows), STALE_CHECK_CHUNK):
+        chunk = rows[start:start + STALE_CHECK_CHUNK]
+        session.execute(delete(FileEntry).where(
+            FileEntry.path.in_([row["path"] for row in chunk]),
+            FileEntry.file_id.not_in([row["file_id"] for row in chunk])
+        ))
+
+    session.execute(upsert_statement(), rows)
+
+def build_index(root_path: str, batch_size: int = INDEX_BATCH_SIZE, progress: IndexProgress | None = None) -> IndexProgress:
+    """
+        Streams the whole tree under root_path into FileEntry, committing every batch_size rows.
+        Memory stays bounded by one batch no matter how large the tree is, and an interrupted build keeps
+        every batch committed so far.
+    """
+    progress = progress or IndexProgress()
+
+    def on_error(path, error):
+        progress.skipped += 1
+        logger.warning(f"Skipping {path} while indexing - {error}")
+
+    batch = []
+    next_log = PROGRESS_LOG_INTERVAL
+
+    with get_session() as session:
+        for row in iter_tree(root_path, on_error=on_error):
+            if progress.cancel_requested:
+                logger.info(f"Indexing cancelled after {progress.indexed} entries")
+                break
+
+            batch.append(row)
+            if len(batch) < batch_size:
+                continue
+
+            upsert_rows(session, batch)
+            session.commit()
+            progress.indexed += len(batch)
+            batch = []
+            if progress.on_batch:
+                progress.on_batch()
+
+            if progress.indexed >= next_log:
+                logger.info(f"Indexed {progress.indexed} entries ({progress.rate:.0f}/s)")
+                next_log += PROGRESS_LOG_INTERVAL
+
+        upsert_rows(session, batch)
+        session.commit()
+        progress.indexed += len(batch)
+
+    progress.finished_at = time.monotonic()
+    logger.info(f"Indexed {progress.indexed} entries in {progress.elapsed:.1f}s, skipped {progress.skipped}")
+
+    return progress
+
+def estimate_total_entries(root_path: str) -> int | None:
+    """
+        Estimates how many entries a full index will hold from the used inode count of the filesystem.
+        It counts the whole filesystem, not only root_path, so it's an upper bound. returns None if the
+        filesystem doesn't report inodes (e.g. exFAT/NTFS through FUSE).
+    """
+    try:
+        stats = os.statvfs(root_path)
+        used = stats.f_files - stats.f_ffree
+        return used if used > 0 else None
+    except OSError:
+        return None
+
+class IndexJob:
+    """
+        Runs build_index in a background thread so startup doesn't wait for a full disk walk.
+        Only one build runs at a time, the last run's progress is kept for the status endpoint and published to
+        the progress store (kind "index"), so workers that don't run the build can report it too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.progress: IndexProgress | None = None
+        self.estimated_total: int | None = None
+        self.state = "idle"   # idle, indexing, done, failed, cancelled
+        self.error: str | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.state == "indexing"
+
+    def start(self, root_path: str, on_done=None) -> bool:
+        """
+            Starts a build unless one is already running. on_done is called in the worker thread after a
+            successful (not cancelled) build, e.g. to mark first boot as done.
+            returns - bool - False if a build was already running
+        """
+        with self._lock:
+            if self.is_running:
+                return False
+
+            self.progress = IndexProgress()
+            self.estimated_total = estimate_total_entries(root_path)
+            self.state = "indexing"
+            self.error = None
+            self._thread = threading.Thread(
+                target=self._run, args=(root_path, self.progress, on_done), name="storagepod-indexer", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _run(self, root_path: str, progress: IndexProgress, on_done):
+        progress.on_batch = self._publish
+        self._publish(force=True)
+        try:
+            build_index(root_path, progress=progress)
+            if progress.cancel_requested:
+                self.state = "cancelled"
+                return
+
+            if on_done:
+                on_done()
+            self.state = "done"
+        except Exception as e:
+            logger.error(f"Error while building the file index - {e}")
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            progress.finished_at = progress.finished_at or time.monotonic()
+            self._publish()
+
+    def _publish(self, force: bool = False):
+        status = self.status()
+        progress_store.publish(
+            "index", "build",
+            status={"indexing": "running", "done": "done", "cancelled": "cancelled"}.get(status["state"], "failed"),
+            done=status["indexed"], total=status["estimated_total"], error=status["error"], force=force,
+            **{key: value for key, value in status.items() if key != "error"},
+        )
+
+    def is_building(self) -> bool:
+        """
+            is_running, or a build running in another worker process (only one worker runs background jobs).
+            Blocking, it may read the progress store.
+        """
+        if self.is_running:
+            return True
+        if self.progress is not None:
+            return False
+        shared = progress_store.get("index", "build")
+        return shared is not None and shared["status"] == "running"
+
+    def cancel(self, timeout: float | None = None):
+        if self.progress is not None:
+            self.progress.cancel_requested = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> dict:
+        progress = self.progress
+        if progress is None:
+            # the build runs in another worker, or never ran
+            shared = progress_store.get("index", "build")
+            if shared is None:
+                return {"state": self.state}
+            return {key: shared.get(key) for key in (
+                "state", "indexed", "skipped", "estimated_total", "rate_per_second", "elapsed_seconds", "eta_seconds", "error"
+            )}
+
+        rate = progress.rate
+        total = self.estimated_total
+        if total is not None and progress.indexed > total:
+            total = None
+
+        eta = None
+        if self.is_running and total is not None and rate > 0:
+            eta = round((total - progress.indexed) / rate)
+
+        return {
+            "state": self.state,
+            "indexed": progress.indexed,
+            "skipped": progress.skipped,
+            "estimated_total": total,
+            "rate_per_second": round(rate, 1),
+            "elapsed_seconds": round(progress.elapsed, 1),
+            "eta_seconds": eta,
+            "error": self.error,
+        }
+
+index_job = IndexJob()
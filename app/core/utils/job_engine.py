@@ -0,0 +1,364 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete, exc as sa_exc
+from sqlmodel import select
+from app.db.main import get_session, db_writer
+from app.db.models import Job
+from app.core.utils import progress_store
+from app.config import (
+    JOB_IO_WORKERS, JOB_CPU_WORKERS, JOB_INDEX_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_POLL_INTERVAL,
+    JOB_RETENTION_DAYS,
+)
+from app.logger import logger
+
+# a running job looks at its cancel flag in the db at most this often
+CANCEL_CHECK_INTERVAL = 1.0
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+FINISHED = ("done", "failed", "cancelled")
+
+class JobCancelled(Exception):
+    """
+        Raised by JobContext.check() when the job was cancelled, the handler cleans up and lets it propagate.
+    """
+
+class JobInterrupted(Exception):
+    """
+        Raised by JobContext.check() when the engine shuts down, the job is queued again for the next start.
+    """
+
+def is_transient(error: BaseException) -> bool:
+    """
+        Errors worth retrying: I/O errors that may go away (EIO on a flaky USB disk, ENOSPC after cleanup, a
+        locked db). Missing or existing paths and permissions won't change by waiting.
+    """
+    if isinstance(error, (FileNotFoundError, FileExistsError, PermissionError, NotADirectoryError, IsADirectoryError)):
+        return False
+    return isinstance(error, (OSError, sqlite3.OperationalError, sa_exc.OperationalError))
+
+class JobContext:
+    """
+        Handed to a job handler: its params, progress reporting and the cancel check.
+    """
+
+    def __init__(self, engine: "JobEngine", job_id: str, kind: str, params: dict, attempt: int, max_attempts: int = 1):
+        self.engine = engine
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+        self.last: dict = {}
+        self._checked_at = 0.0
+        self._cancelled = False
+
+    def progress(self, done: int, total: int | None = None, force: bool = False, **data):
+        """
+            Publishes the progress to the progress store (throttled there), so /jobs/{id}/events streams it.
+            The last one is kept and published again with the final status.
+        """
+        self.last = {"done": done, "total": total, **data}
+        progress_store.publish(self.kind, self.id, done=done, total=total, force=force, **data)
+
+    def cancelled(self) -> bool:
+        if not self._cancelled:
+            now = time.monotonic()
+            if self.id in self.engine._cancelling:
+                self._cancelled = True
+            elif now - self._checked_at >= CANCEL_CHECK_INTERVAL:
+                # the cancel may have come through another worker
+                self._checked_at = now
+                with get_session() as session:
+                    self._cancelled = bool(session.exec(select(Job.cancel_requested).where(Job.id == self.id)).first())
+        return self._cancelled
+
+    def will_retry(self, error: BaseException) -> bool:
+        """
+            Whether the job runs again after failing with error, e.g. to keep the work done so far for the next run.
+        """
+        if isinstance(error, JobInterrupted):
+            return True
+        return self.attempt < self.max_attempts and is_transient(error)
+
+    def check(self):
+        """
+            Call it between units of work (files, chunks). Raises JobCancelled or JobInterrupted.
+        """
+        if self.engine._stop.is_set():
+            raise JobInterrupted()
+        if self.cancelled():
+            raise JobCancelled()
+
+class _Handler:
+    __slots__ = ("fn", "job_class", "priority", "max_attempts")
+
+    def __init__(self, fn, job_class: str, priority: int, max_attempts: int):
+        self.fn = fn
+        self.job_class = job_class
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+class JobEngine:
+    """
+        Runs long file operations in the background, with their state in the Job table.
+
+        Every kind of job is registered with a handler fn(ctx) -> result and a job class. Each class has its own
+        bounded pool of threads (JOB_IO_WORKERS for copy/move/delete, JOB_CPU_WORKERS for compress,
+        JOB_INDEX_WORKERS for reindex) so a big compress can't hold up deletes. A free thread claims the queued job of
+        its class with the highest priority (oldest first) with one UPDATE ... RETURNING, so a job runs once
+        even if several processes look at the queue.
+
+        Any worker process can submit, cancel and read jobs. Only the process that called start() (the one holding
+        the background lock) runs them; it picks up jobs queued elsewhere every JOB_POLL_INTERVAL. Jobs that were
+        running when the process died are queued again by the next start(), handlers are written so a job can be
+        run again from the start. A job that fails on a transient error is retried with a backoff.
+    """
+
+    CLASSES = {"io": JOB_IO_WORKERS, "cpu": JOB_CPU_WORKERS, "index": JOB_INDEX_WORKERS}
+
+    def __init__(self):
+        self._handlers: dict[str, _Handler] = {}
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = {job_class: threading.Event() for job_class in self.CLASSES}
+        self._cancelling: set[str] = set()
+        self._last_prune = 0.0
+        self.running = False
+
+    def register(self, kind: str, fn, job_class: str = "io", priority: int = 0, max_attempts: int = JOB_MAX_ATTEMPTS):
+        if job_class not in self.CLASSES:
+            raise ValueError(f"Unknown job class {job_class}")
+        self._handlers[kind] = _Handler(fn, job_class, priority, max_attempts)
+
+    # api, usable from any worker
+
+    def submit(self, kind: str, params: dict, priority: int | None = None) -> str:
+        """
+            Queues a job and waits for its row and its queued progress entry to be committed, so a poll right after
+            this returns finds the job on any worker. Blocking.
+            returns - the job id
+        """
+        handler = self._handlers[kind]
+        job = Job(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            status="queued",
+            priority=handler.priority if priority is None else priority,
+            params=json.dumps(params),
+            max_attempts=handler.max_attempts,
+        )
+        db_writer.run(lambda session: session.add(job))
+        progress_store.publish(kind, job.id, status="queued").result()
+        self._wake[handler.job_class].set()
+        return job.id
+
+    def get(self, job_id: str) -> dict | None:
+        with get_session() as session:
+            job = session.get(Job, job_id)
+            return self._as_dict(job) if job is not None else None
+
+    def list_jobs(self, status: str | None = None, kind: str | None = None, limit: int = 100) -> list[dict]:
+        with get_session() as session:
+            query = select(Job)
+            if status:
+                query = query.where(Job.status == status)
+            if kind:
+                query = query.where(Job.kind == kind)
+            jobs = session.exec(query.order_by(Job.created_at.desc()).limit(limit)).all()
+            return [self._as_dict(job) for job in jobs]
+
+    def cancel(self, job_id: str) -> dict | None:
+        """
+            A queued job is cancelled right away, a running one is flagged and stops at its next check().
+            returns - the job, None if there is no such job
+        """
+        now = datetime.now()
+
+        def write(session):
+            session.execute(
+                update(Job).where(Job.id == job_id, Job.status == "queued")
+                .values(status="cancelled", cancel_requested=True, finished_at=now)
+            )
+            session.execute(update(Job).where(Job.id == job_id, Job.status == "running").values(cancel_requested=True))
+
+        db_writer.run(write)
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "cancelled":
+            progress_store.publish(job["kind"], job_id, status="cancelled")
+        elif job["status"] == "running" and self.running:
+            # saves the job the db read if it runs in this process
+            self._cancelling.add(job_id)
+        return job
+
+    def retry(self, job_id: str) -> dict | None:
+        """
+            Queues a failed or cancelled job again, with a fresh set of attempts.
+            returns - the job, None if there is no such job
+        """
+        def write(session):
+            return session.execute(
+                update(Job).where(Job.id == job_id, Job.status.in_(("failed", "cancelled")))
+                .values(status="queued", attempts=0, error=None, cancel_requested=False, not_before=datetime.now(),
+                        started_at=None, finished_at=None)
+            ).rowcount
+
+        if db_writer.run(write):
+            job = self.get(job_id)
+            progress_store.publish(job["kind"], job_id, status="queued")
+            handler = self._handlers.get(job["kind"])
+            if handler is not None:
+                self._wake[handler.job_class].set()
+        return self.get(job_id)
+
+    # runner, in the process that holds the background lock
+
+    def start(self):
+        """
+            Queues again the jobs a previous process left running and starts the worker threads.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+
+        def requeue(session):
+            session.execute(
+                update(Job).where(Job.status == "running", Job.attempts >= Job.max_attempts)
+                .values(status="failed", error="Interrupted by a restart", finished_at=datetime.now())
+            )
+            return session.execute(update(Job).where(Job.status == "running").values(status="queued")).rowcount
+
+        requeued = db_writer.run(requeue)
+        if requeued:
+            logger.info(f"Requeued {requeued} jobs interrupted by a restart")
+
+        for job_class, workers in self.CLASSES.items():
+            for i in range(max(1, workers)):
+                thread = threading.Thread(target=self._worker, args=(job_class,), name=f"storagepod-job-{job_class}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self.running = True
+
+    def stop(self, timeout: float = 5):
+        """
+            Stops the workers. Running jobs are interrupted at their next check() and queued for the next start.
+        """
+        self._stop.set()
+        for event in self._wake.values():
+            event.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        self.running = False
+
+    def _kinds(self, job_class: str) -> list[str]:
+        return [kind for kind, handler in self._handlers.items() if handler.job_class == job_class]
+
+    def _claim(self, job_class: str) -> Job | None:
+        kinds = self._kinds(job_class)
+        if not kinds:
+            return None
+        now = datetime.now()
+        ready = (Job.status == "queued", Job.kind.in_(kinds), Job.not_before <= now)
+
+        # a read first, an idle queue costs no write
+        with get_session() as session:
+            if session.exec(select(Job.id).where(*ready).limit(1)).first() is None:
+                return None
+
+        def write(session):
+            next_id = (
+                select(Job.id).where(*ready)
+                .order_by(Job.priority.desc(), Job.created_at).limit(1).scalar_subquery()
+            )
+            row = session.execute(
+                update(Job).where(Job.id == next_id, Job.status == "queued")
+                .values(status="running", started_at=now, attempts=Job.attempts + 1)
+                .returning(Job.id, Job.kind, Job.params, Job.attempts, Job.max_attempts)
+            ).first()
+            return Job(id=row.id, kind=row.kind, params=row.params, attempts=row.attempts, max_attempts=row.max_attempts) if row else None
+
+        return db_writer.run(write)
+
+    def _worker(self, job_class: str):
+        wake = self._wake[job_class]
+        while not self._stop.is_set():
+            try:
+                job = self._claim(job_class)
+            except Exception as e:
+                logger.error(f"Could not claim a {job_class} job - {e}")
+                job = None
+
+            if job is None:
+                self._maybe_prune()
+                wake.wait(JOB_POLL_INTERVAL)
+                wake.clear()
+                continue
+
+            self._run(job)
+
+    def _run(self, job: Job):
+        handler = self._handlers[job.kind]
+        ctx = JobContext(self, job.id, job.kind, json.loads(job.params), job.attempts, job.max_attempts)
+        progress_store.publish(job.kind, job.id, force=True)
+        logger.info(f"Running {job.kind} job {job.id} (attempt {job.attempts})")
+
+        try:
+            result = handler.fn(ctx)
+            values = {"status": "done", "result": json.dumps(result, default=str), "error": None, "finished_at": datetime.now()}
+        except JobCancelled:
+            values = {"status": "cancelled", "error": None, "finished_at": datetime.now()}
+        except JobInterrupted:
+            # not the job's fault, the attempt doesn't count
+            values = {"status": "queued", "attempts": job.attempts - 1, "started_at": None}
+        except Exception as e:
+            if ctx.will_retry(e):
+                delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+                logger.warning(f"{job.kind} job {job.id} failed ({e}), retrying in {delay:.0f}s")
+                values = {"status": "queued", "error": str(e), "not_before": datetime.now() + timedelta(seconds=delay)}
+            else:
+                logger.error(f"{job.kind} job {job.id} failed - {e}")
+                values = {"status": "failed", "error": str(e), "finished_at": datetime.now()}
+        finally:
+            self._cancelling.discard(job.id)
+
+        db_writer.run(lambda session: session.execute(update(Job).where(Job.id == job.id).values(**values)))
+        progress_store.publish(job.kind, job.id, status=values["status"], error=values.get("error"), **ctx.last)
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        cutoff = datetime.now() - timedelta(days=JOB_RETENTION_DAYS)
+        removed = db_writer.run(lambda session: session.execute(
+            delete(Job).where(Job.status.in_(FINISHED), Job.finished_at < cutoff)
+        ).rowcount)
+        if removed:
+            logger.info(f"Pruned {removed} jobs finished more than {JOB_RETENTION_DAYS} days ago")
+
+    @staticmethod
+    def _as_dict(job: Job) -> dict:
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "priority": job.priority,
+            "params": json.loads(job.params),
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "cancel_requested": job.cancel_requested,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+job_engine = JobEngine()
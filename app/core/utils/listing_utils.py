@@ -0,0 +1,291 @@
+import os
+import json
+import base64
+import heapq
+from datetime import datetime
+from functools import total_ordering
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, func
+from sqlmodel import select
+from app.db.models import FileEntry
+
+SORT_FIELDS = {"name", "size", "modified_at"}
+LIST_SOURCES = {"disk", "index"}
+LIST_DEFAULT_LIMIT = 200
+LIST_MAX_LIMIT = 1000
+
+# what sqlite's NOCASE collation folds
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+@total_ordering
+class _Reverse:
+    """
+        Wraps a sort key so that it compares in the opposite order. Used to build desc keys that still
+        keep the dirs-first rank ascending.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+def entry_info(entry: os.DirEntry, rel_dir: str) -> dict | None:
+    """
+        Builds the same metadata dict as FileManager.get_file_info but from a DirEntry.
+        is_dir() is answered from d_type and stat() is cached on the entry, so this is a single stat per item.
+        returns None if the entry disappeared while listing.
+    """
+    try:
+        stats = entry.stat()
+        is_directory = entry.is_dir()
+    except OSError:
+        return None
+
+    return {
+        "id": f"{stats.st_dev}-{stats.st_ino}",
+        "name": entry.name,
+        "size": stats.st_size,
+        "path": os.path.join(rel_dir, entry.name) if rel_dir else entry.name,
+        "is_directory": is_directory,
+        "modified_at": datetime.fromtimestamp(stats.st_mtime)
+    }
+
+def iter_directory(abs_path: str, rel_dir: str):
+    """
+        Yields the metadata dict of every direct child of abs_path using os.scandir.
+    """
+    with os.scandir(abs_path) as it:
+        for entry in it:
+            info = entry_info(entry, rel_dir)
+            if info is not None:
+                yield info
+
+def _primary_value(info: dict, sort: str):
+    if sort == "size":
+        return info["size"]
+    if sort == "modified_at":
+        return info["modified_at"].timestamp()
+    return info["name"].lower()
+
+def _build_key(rank: int, primary, name: str, order: str):
+    if order == "desc":
+        return (rank, _Reverse((primary, name)))
+    return (rank, (primary, name))
+
+def sort_key(info: dict, sort: str, order: str, dirs_first: bool):
+    rank = 0 if (dirs_first and info["is_directory"]) else 1
+    return _build_key(rank, _primary_value(info, sort), info["name"], order)
+
+def _pack_cursor(sort: str, order: str, dirs_first: bool, values: list) -> str:
+    raw = json.dumps([sort, order, bool(dirs_first), *values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _unpack_cursor(cursor: str, sort: str, order: str, dirs_first: bool) -> list:
+    """
+        returns - the key values stored in the cursor
+        raises - 400 if it can't be read or was made for another sort/order/dirs_first, its key wouldn't compare
+                 with the keys of this listing
+    """
+    try:
+        cursor_sort, cursor_order, cursor_dirs_first, *values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if (cursor_sort, cursor_order, cursor_dirs_first) != (sort, order, bool(dirs_first)):
+        raise HTTPException(status_code=400, detail="The cursor belongs to a listing with another sort, order or dirs_first")
+    return values
+
+def encode_cursor(info: dict, sort: str, order: str, dirs_first: bool) -> str:
+    """
+        The cursor is the sort key of the last item of a page, so the next page is every item sorting after it.
+        This keeps pages stable while files are added/removed, unlike plain offsets. The sort, order and dirs_first
+        it was made for are stored along, a cursor is only valid for the same listing.
+    """
+    rank = 0 if (dirs_first and info["is_directory"]) else 1
+    return _pack_cursor(sort, order, dirs_first, [rank, _primary_value(info, sort), info["name"]])
+
+def decode_cursor(cursor: str, sort: str, order: str, dirs_first: bool):
+    values = _unpack_cursor(cursor, sort, order, dirs_first)
+    try:
+        rank, primary, name = values
+        primary = str(primary) if sort == "name" else float(primary) if sort == "modified_at" else int(primary)
+        return _build_key(int(rank), primary, str(name), order)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def list_page(
+    abs_path: str,
+    rel_dir: str,
+    sort: str = "name",
+    order: str = "asc",
+    dirs_first: bool = True,
+    limit: int = LIST_DEFAULT_LIMIT,
+    offset: int = 0,
+    cursor: str | None = None
+) -> dict:
+    """
+        Returns one sorted page of the directory at abs_path.
+
+        The directory is streamed through a bounded heap, so memory stays at O(offset + limit) items
+        no matter how many entries the folder holds.
+
+        returns - dict with files, total, next_cursor
+    """
+    _validate_page_params(sort, order)
+
+    limit = max(1, min(int(limit), LIST_MAX_LIMIT))
+    offset = max(0, int(offset or 0))
+    after = decode_cursor(cursor, sort, order, dirs_first) if cursor else None
+
+    total = 0
+
+    def candidates():
+        nonlocal total
+        for info in iter_directory(abs_path, rel_dir):
+            total += 1
+            key = sort_key(info, sort, order, dirs_first)
+            if after is not None and not key > after:
+                continue
+            # name is unique within a folder so the key never ties and the info dict is never compared
+            yield key, info
+
+    window = heapq.nsmallest(offset + limit + 1, candidates(), key=lambda pair: pair[0])
+    page = [info for _, info in window[offset:offset + limit]]
+    has_more = len(window) > offset + limit
+
+    return {
+        "files": page,
+        "total": total,
+        "next_cursor": encode_cursor(page[-1], sort, order, dirs_first) if (page and has_more) else None
+    }
+
+def _validate_page_params(sort: str, order: str):
+    if sort not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort field, expected one of {sorted(SORT_FIELDS)}")
+
+    if order not in {"asc", "desc"}:
+        raise HTTPException(status_code=400, detail="Invalid order, expected asc/desc")
+
+def row_info(row) -> dict:
+    """
+        The FileManager.get_file_info dict of a FileEntry row.
+    """
+    entry_type = row.type.value if hasattr(row.type, "value") else row.type
+    return {
+        "id": row.file_id,
+        "name": row.name,
+        "size": row.size,
+        "path": row.path,
+        "is_directory": entry_type == "folder",
+        "modified_at": row.modified_at
+    }
+
+def _index_columns(sort: str):
+    """
+        returns - (primary sort column, the same column to compare cursor values against)
+    """
+    if sort == "size":
+        return FileEntry.size
+    if sort == "modified_at":
+        return FileEntry.modified_at
+    return FileEntry.name.collate("NOCASE")
+
+def _index_key(row, sort: str):
+    """
+        The ORDER BY of list_page_from_index in python, to merge folders and files without dirs_first.
+        NOCASE only folds ASCII letters, so does this.
+    """
+    if sort == "name":
+        return row.name.translate(_ASCII_LOWER), row.name
+    return getattr(row, sort), row.name
+
+def _encode_index_cursor(info: dict, sort: str, order: str, dirs_first: bool) -> str:
+    rank = 0 if (dirs_first and info["is_directory"]) else 1
+    primary = info[sort] if sort != "modified_at" else info["modified_at"].isoformat()
+    return _pack_cursor(sort, order, dirs_first, [rank, primary, info["name"]])
+
+def _decode_index_cursor(cursor: str, sort: str, order: str, dirs_first: bool):
+    values = _unpack_cursor(cursor, sort, order, dirs_first)
+    try:
+        rank, primary, name = values
+        if sort == "modified_at":
+            primary = datetime.fromisoformat(primary)
+        elif sort == "size":
+            primary = int(primary)
+        else:
+            primary = str(primary)
+        return int(rank), primary, str(name)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def list_page_from_index(
+    session,
+    rel_dir: str,
+    sort: str = "name",
+    order: str = "asc",
+    dirs_first: bool = True,
+    limit: int = LIST_DEFAULT_LIMIT,
+    offset: int = 0,
+    cursor: str | None = None
+) -> dict:
+    """
+        Same page as list_page but answered from FileEntry through the (parent_path, type, name) index,
+        without touching the disk. Reflects the disk as of the last watcher flush/reconciliation.
+
+        Folders and files are read as two ranges of the index (one per type) and concatenated, or merged without
+        dirs_first. Sorted by name each range comes out of the index in order; by size/modified_at it still
+        has to be sorted.
+
+        returns - dict with files, total, next_cursor
+    """
+    _validate_page_params(sort, order)
+
+    limit = max(1, min(int(limit), LIST_MAX_LIMIT))
+    offset = max(0, int(offset or 0))
+
+    primary = _index_columns(sort)
+    descending = order == "desc"
+    later = (lambda col, value: col < value) if descending else (lambda col, value: col > value)
+    ordering = [primary.desc(), FileEntry.name.desc()] if descending else [primary.asc(), FileEntry.name.asc()]
+    after = _decode_index_cursor(cursor, sort, order, dirs_first) if cursor else None
+    # a cursor already says where the page starts, the offset only applies without one
+    skip = 0 if after is not None else offset
+
+    def segment(entry_type: str, rank: int) -> list:
+        # one (parent_path, type) range of the index, already in name order, so SQLite reads at most
+        # skip + limit + 1 rows of it instead of sorting every child of the folder
+        query = select(FileEntry).where(FileEntry.parent_path == rel_dir, FileEntry.type == entry_type)
+        if after is not None:
+            after_rank, after_primary, after_name = after
+            if rank < after_rank:
+                return []
+            if rank == after_rank:
+                query = query.where(or_(
+                    later(primary, after_primary),
+                    and_(primary == after_primary, later(FileEntry.name, after_name)),
+                ))
+        return session.exec(query.order_by(*ordering).limit(skip + limit + 1)).all()
+
+    # same ranks as sort_key, folders first only with dirs_first
+    folders = segment("folder", 0 if dirs_first else 1)
+    files = segment("file", 1)
+    if dirs_first:
+        rows = folders + files
+    else:
+        rows = list(heapq.merge(folders, files, key=lambda row: _index_key(row, sort), reverse=descending))
+
+    rows = rows[skip:skip + limit + 1]
+    page = [row_info(row) for row in rows[:limit]]
+
+    total = session.exec(select(func.count()).select_from(FileEntry).where(FileEntry.parent_path == rel_dir)).one()
+
+    return {
+        "files": page,
+        "total": total,
+        "next_cursor": _encode_index_cursor(page[-1], sort, order, dirs_first) if (page and len(rows) > limit) else None
+    }
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import select
+from app.db.main import get_session, db_writer
+from app.db.models import JobProgress, UploadTask
+from app.config import PROGRESS_TTL_SECONDS, PROGRESS_UPDATE_INTERVAL, TEMP_UPLOADS_DIR
+from app.logger import logger
+
+PRUNE_INTERVAL_SECONDS = 5 * 60
+# tuspyserver upload ids are uuid4().hex
+TUS_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# keys of running jobs -> when this process last wrote them, for throttling
+_last_publish: dict[str, float] = {}
+_lock = threading.Lock()
+_last_prune = 0.0
+
+def _key(kind: str, job_id: str) -> str:
+    return f"{kind}:{job_id}"
+
+def publish(kind: str, job_id: str, status: str = "running", done: int = 0, total: int | None = None,
+            error: str | None = None, force: bool = False, **data):
+    """
+        Stores the progress of a job, shared by every worker process. Thread safe and doesn't wait for the write.
+
+        Updates of a running job closer than PROGRESS_UPDATE_INTERVAL to the previous one are dropped unless force,
+        a queued or finished job (status queued/done/failed/cancelled) is always written.
+        data - kind specific fields, stored as json (datetimes as strings)
+
+        returns - the Future of the write, None if the update was dropped
+    """
+    key = _key(kind, job_id)
+    now = time.monotonic()
+    with _lock:
+        if status == "running":
+            if not force and now - _last_publish.get(key, 0.0) < PROGRESS_UPDATE_INTERVAL:
+                return None
+            _last_publish[key] = now
+        else:
+            _last_publish.pop(key, None)
+
+    updated_at = datetime.now()
+    row = {
+        "key": key,
+        "kind": kind,
+        "status": status,
+        "done": done,
+        "total": total,
+        "data": json.dumps(data, default=str) if data else None,
+        "error": error,
+        "updated_at": updated_at,
+        "expires_at": updated_at + timedelta(seconds=PROGRESS_TTL_SECONDS),
+    }
+
+    def write(session):
+        stmt = insert(JobProgress).values(row)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[JobProgress.key],
+            set_={column: stmt.excluded[column] for column in row if column != "key"},
+        ))
+        maybe_prune(session)
+
+    return db_writer.submit(write)
+
+def _as_dict(row: JobProgress, job_id: str) -> dict:
+    return {
+        "id": job_id,
+        "kind": row.kind,
+        "status": row.status,
+        "done": row.done,
+        "total": row.total,
+        "error": row.error,
+        "updated_at": row.updated_at,
+        **(json.loads(row.data) if row.data else {}),
+    }
+
+def get(kind: str, job_id: str) -> dict | None:
+    """
+        returns - the last published progress of the job, None if it's unknown or expired. Blocking.
+    """
+    with get_session() as session:
+        row = session.get(JobProgress, _key(kind, job_id))
+        if row is None or row.expires_at < datetime.now():
+            return None
+        return _as_dict(row, job_id)
+
+def find(job_id: str) -> dict | None:
+    """
+        Progress of a job by its id alone, whatever its kind, multipart uploads (UploadTask) and TUS uploads
+        still being PATCHed included.
+        The table only holds jobs that haven't expired, so the suffix scan stays small. Blocking.
+    """
+    with get_session() as session:
+        row = session.exec(
+            select(JobProgress)
+            .where(JobProgress.key.endswith(f":{job_id}", autoescape=True), JobProgress.expires_at >= datetime.now())
+            .order_by(JobProgress.updated_at.desc())
+        ).first()
+        if row is not None:
+            return _as_dict(row, job_id)
+
+        task = session.get(UploadTask, job_id)
+        if task is None:
+            return _tus_upload(job_id)
+        return {
+            "id": job_id,
+            "kind": "upload",
+            "status": {"uploading": "running"}.get(task.status, task.status),
+            "done": task.written,
+            "total": task.total or None,
+            "error": task.error,
+            "updated_at": task.updated_at,
+            "filename": task.filename,
+        }
+
+def _tus_upload(upload_id: str) -> dict | None:
+    """
+        A TUS upload that is still being PATCHed, its offset is in the sidecar tuspyserver keeps in TEMP_UPLOADS_DIR.
+    """
+    if not TEMP_UPLOADS_DIR or not TUS_UPLOAD_ID_RE.match(upload_id):
+        return None
+    info_path = os.path.join(TEMP_UPLOADS_DIR, f"{upload_id}.info")
+    try:
+        with open(info_path) as f:
+            info = json.load(f) or {}
+        updated_at = datetime.fromtimestamp(os.path.getmtime(info_path))
+    except (OSError, ValueError):
+        return None
+    return {
+        "id": upload_id,
+        "kind": "tus",
+        "status": "running",
+        "done": info.get("offset") or 0,
+        "total": info.get("size"),
+        "error": None,
+        "updated_at": updated_at,
+    }
+
+def prune(session) -> int:
+    """
+        Deletes expired job rows and upload tasks untouched for PROGRESS_TTL_SECONDS. The caller commits.
+    """
+    removed = session.execute(delete(JobProgress).where(JobProgress.expires_at < datetime.now())).rowcount or 0
+    # upload tasks are stamped in UTC
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=PROGRESS_TTL_SECONDS)
+    removed += session.execute(delete(UploadTask).where(UploadTask.updated_at < cutoff)).rowcount or 0
+    return removed
+
+def maybe_prune(session):
+    global _last_prune
+
+    now = time.monotonic()
+    if now - _last_prune < PRUNE_INTERVAL_SECONDS:
+        return
+
+    _last_prune = now
+    removed = prune(session)
+    if removed:
+        logger.info(f"Pruned {removed} expired job progress entries")
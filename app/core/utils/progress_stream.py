@@ -0,0 +1,149 @@
+import json
+import time
+import asyncio
+from app.config import PROGRESS_STREAM_INTERVAL, PROGRESS_STREAM_HEARTBEAT
+from app.core.utils import progress_store
+from app.db.main import run_db
+from app.logger import logger
+
+# rate samples are smoothed with this weight for the newest one
+RATE_WEIGHT = 0.3
+# a client that loses the stream reconnects after this many ms (EventSource retry)
+RECONNECT_MS = 3000
+
+FINISHED = ("done", "failed", "cancelled")
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+class _Watch:
+    """
+        One job watched by this process. A single poller reads the job every interval and, when it changed, keeps
+        the newest snapshot. Every subscriber waits on the condition and only ever sees the latest one, so a slow
+        client skips updates instead of queueing them.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.snapshot: dict | None = None
+        self.version = 0
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+        self._job: dict | None = None
+        self._sample: tuple[float, int] | None = None
+        self._rate = 0.0
+
+    def metrics(self, job: dict) -> dict:
+        """
+            Adds percent, bytes_per_second and eta_seconds to a job read from the progress store. Jobs that
+            report their own rate keep it, for the others it's measured from how done moved between polls.
+        """
+        now = time.monotonic()
+        done, total = job.get("done") or 0, job.get("total")
+
+        rate = job.get("bytes_per_second")
+        if rate is None:
+            if self._sample is not None and now > self._sample[0]:
+                sample = max(0, done - self._sample[1]) / (now - self._sample[0])
+                self._rate = sample if not self._rate else (1 - RATE_WEIGHT) * self._rate + RATE_WEIGHT * sample
+            rate = round(self._rate)
+        self._sample = (now, done)
+
+        percent = job.get("progress")
+        if percent is None or percent < 0:
+            percent = round(done / total * 100, 1) if total else None
+        if job["status"] == "done":
+            percent = 100
+
+        eta = None
+        if job["status"] == "running" and total and rate:
+            eta = max(0, round((total - done) / rate))
+
+        return {**job, "percent": percent, "bytes_per_second": rate, "eta_seconds": eta}
+
+    async def poll(self, interval: float):
+        try:
+            while True:
+                job = await run_db(progress_store.find, self.job_id)
+                if job != self._job or self.version == 0:
+                    self._job = job
+                    async with self.changed:
+                        self.snapshot = self.metrics(job) if job is not None else None
+                        self.version += 1
+                        self.changed.notify_all()
+                if job is None or job["status"] in FINISHED:
+                    return
+                await asyncio.sleep(interval)
+        except Exception as e:
+            logger.error(f"Progress stream of {self.job_id} failed - {e}")
+            async with self.changed:
+                self.snapshot = None
+                self.version += 1
+                self.changed.notify_all()
+
+class ProgressHub:
+    """
+        Streams job progress to any number of clients as server-sent events.
+
+        Each job is read from the progress store by one poller per process, at most every PROGRESS_STREAM_INTERVAL,
+        and only while somebody is watching it. An event goes out only when the job changed, a comment line every
+        PROGRESS_STREAM_HEARTBEAT keeps proxies from closing an idle stream. So a hundred browsers on one compress
+        job cost one small query a second.
+    """
+
+    def __init__(self, interval: float = PROGRESS_STREAM_INTERVAL, heartbeat: float = PROGRESS_STREAM_HEARTBEAT):
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self._watches: dict[str, _Watch] = {}
+
+    def _subscribe(self, job_id: str) -> _Watch:
+        watch = self._watches.get(job_id)
+        if watch is None or (watch.task is not None and watch.task.done()):
+            watch = self._watches[job_id] = _Watch(job_id)
+            watch.task = asyncio.create_task(watch.poll(self.interval))
+        watch.subscribers += 1
+        return watch
+
+    def _unsubscribe(self, watch: _Watch):
+        watch.subscribers -= 1
+        if watch.subscribers <= 0:
+            if watch.task is not None:
+                watch.task.cancel()
+            if self._watches.get(watch.job_id) is watch:
+                del self._watches[watch.job_id]
+
+    async def stream(self, job_id: str):
+        """
+            Yields the SSE stream of a job: a "progress" event whenever it changes, then one "done"/"failed"/"cancelled" event
+            (or "gone" if the job expired) and the stream ends.
+        """
+        watch = self._subscribe(job_id)
+        seen = 0
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            while True:
+                # nothing is yielded while holding the condition, a slow client mustn't hold up the others
+                async with watch.changed:
+                    try:
+                        await asyncio.wait_for(watch.changed.wait_for(lambda: watch.version > seen), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                    idle = watch.version == seen
+                    seen = watch.version
+                    snapshot = watch.snapshot
+
+                if idle:
+                    yield ": keep-alive\n\n"
+                    continue
+                if snapshot is None:
+                    yield sse("gone", {"id": job_id})
+                    return
+                if snapshot["status"] in FINISHED:
+                    yield sse(snapshot["status"], snapshot)
+                    return
+                yield sse("progress", snapshot)
+        finally:
+            self._unsubscribe(watch)
+
+progress_hub = ProgressHub()
@@ -0,0 +1,306 @@
+import os
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import delete, and_
+from sqlmodel import select
+from app.db.main import get_session
+from app.db.models import FileEntry
+from app.core.utils.db_utils import subtree_clause, descendants_clause, children_clause
+from app.core.utils.indexer import entry_row, upsert_rows, index_job
+from app.core.utils import progress_store, worker_lock
+from app.logger import logger
+
+RECONCILE_BATCH_SIZE = 2000
+
+class ReconcileStats:
+
+    def __init__(self, full: bool):
+        self.full = full
+        self.dirs_scanned = 0
+        self.dirs_skipped = 0
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.errors = 0
+        self.started_at = datetime.now()
+        self._start = time.monotonic()
+        self.duration: float | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "full": self.full,
+            "dirs_scanned": self.dirs_scanned,
+            "dirs_skipped": self.dirs_skipped,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "errors": self.errors,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration if self.duration is not None else time.monotonic() - self._start, 2),
+        }
+
+class _Writer:
+    """
+        Buffers the diff and applies it in batched transactions. Stale rows are deleted before the upserts
+        of the same batch, so a path that now points to a different inode never hits the unique path index.
+    """
+
+    def __init__(self, session, stats: ReconcileStats, batch_size: int):
+        self.session = session
+        self.stats = stats
+        self.batch_size = batch_size
+        self.upserts: list[dict] = []
+        self.stale: list[tuple[str, str]] = []   # (path, file_id) of rows replaced by a new inode
+        self.removed: list[str] = []             # paths gone from disk, with their subtree
+        self.orphaned: list[str] = []            # folders that are now files, only their old subtree is removed
+
+    def pending(self) -> int:
+        return len(self.upserts) + len(self.stale) + len(self.removed) + len(self.orphaned)
+
+    def flush(self):
+        if not self.pending():
+            return
+
+        for path, file_id in self.stale:
+            self.session.execute(delete(FileEntry).where(and_(FileEntry.path == path, FileEntry.file_id == file_id)))
+
+        for path in self.removed:
+            result = self.session.execute(delete(FileEntry).where(subtree_clause(path)))
+            self.stats.deleted += result.rowcount or 0
+
+        for path in self.orphaned:
+            result = self.session.execute(delete(FileEntry).where(descendants_clause(path)))
+            self.stats.deleted += result.rowcount or 0
+
+        upsert_rows(self.session, self.upserts)
+        self.session.commit()
+
+        self.upserts, self.stale, self.removed, self.orphaned = [], [], [], []
+
+    def maybe_flush(self):
+        if self.pending() >= self.batch_size:
+            self.flush()
+
+def _db_mtime(session, rel_path: str):
+    return session.exec(select(FileEntry.modified_at).where(FileEntry.path == rel_path)).first()
+
+def _diff_directory(session, writer: _Writer, stats: ReconcileStats, rel_dir: str, abs_dir: str, stack: list, now: datetime):
+    """
+        Compares the children of one folder on disk with its FileEntry rows and queues the changes.
+        Child folders are pushed on the stack with whether their own mtime changed. The row of a changed child
+        folder goes along and is only written once that folder is diffed, see reconcile().
+    """
+    known = {
+        row.path: row for row in session.exec(
+            select(FileEntry.path, FileEntry.file_id, FileEntry.type, FileEntry.size, FileEntry.modified_at)
+            .where(children_clause(rel_dir))
+        ).all()
+    }
+
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            try:
+                row = entry_row(entry, rel_path, now)
+                is_real_dir = entry.is_dir(follow_symlinks=False)
+            except OSError as e:
+                stats.errors += 1
+                logger.warning(f"Skipping {entry.path} while reconciling - {e}")
+                # keep the existing row, it may be a transient error
+                known.pop(rel_path, None)
+                continue
+
+            old = known.pop(rel_path, None)
+
+            if is_real_dir:
+                if old is None or old.modified_at != row["modified_at"]:
+                    if old is not None and old.file_id != row["file_id"]:
+                        writer.stale.append((rel_path, old.file_id))
+                    stack.append((rel_path, entry.path, True, (row, old is None)))
+                    continue
+                stack.append((rel_path, entry.path, False, None))
+
+            if old is None:
+                writer.upserts.append(row)
+                stats.inserted += 1
+                continue
+
+            old_type = old.type.value if hasattr(old.type, "value") else old.type
+            if (old.file_id, old_type, old.size, old.modified_at) == (row["file_id"], row["type"], row["size"], row["modified_at"]):
+                continue
+
+            if old.file_id != row["file_id"]:
+                writer.stale.append((rel_path, old.file_id))
+            if old_type == "folder" and row["type"] == "file":
+                writer.orphaned.append(rel_path)
+            writer.upserts.append(row)
+            stats.updated += 1
+
+    # whatever is left in the db is gone from the disk
+    writer.removed.extend(known.keys())
+
+def reconcile(root_path: str, full: bool = False, batch_size: int = RECONCILE_BATCH_SIZE) -> ReconcileStats:
+    """
+        Brings FileEntry in line with the filesystem under root_path.
+
+        A folder whose mtime matches its row has the same set of children as when it was indexed, so its listing
+        isn't diffed against the db, only its sub folders are visited. Changed folders are diffed entry by entry
+        and the inserts/updates/deletes are applied in batches.
+
+        An in-place content change doesn't touch the folder mtime, use full=True to stat and compare every entry.
+    """
+    stats = ReconcileStats(full=full)
+    now = datetime.now()
+
+    with get_session() as session:
+        writer = _Writer(session, stats, batch_size)
+        # the root has no row, always diff it
+        stack = [("", root_path, True, None)]
+
+        while stack:
+            # pending - (row, is_new) of a changed folder, written once its listing is diffed. Written earlier, a
+            # diff that fails would leave the new mtime in the db and later runs would skip the folder for good
+            rel_dir, abs_dir, changed, pending = stack.pop()
+
+            try:
+                if changed or full:
+                    stats.dirs_scanned += 1
+                    _diff_directory(session, writer, stats, rel_dir, abs_dir, stack, now)
+                    if pending is not None:
+                        row, is_new = pending
+                        writer.upserts.append(row)
+                        if is_new:
+                            stats.inserted += 1
+                        else:
+                            stats.updated += 1
+                else:
+                    stats.dirs_skipped += 1
+                    with os.scandir(abs_dir) as it:
+                        for entry in it:
+                            if not entry.is_dir(follow_symlinks=False):
+                                continue
+                            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                            row = entry_row(entry, rel_path, now)
+                            db_mtime = _db_mtime(session, rel_path)
+                            if db_mtime != row["modified_at"]:
+                                # the parent isn't diffed, the folder's own row comes along to be written with its diff
+                                stack.append((rel_path, entry.path, True, (row, db_mtime is None)))
+                            else:
+                                stack.append((rel_path, entry.path, False, None))
+            except OSError as e:
+                stats.errors += 1
+                logger.warning(f"Skipping {abs_dir} while reconciling - {e}")
+
+            writer.maybe_flush()
+
+        writer.flush()
+
+    stats.duration = time.monotonic() - stats._start
+    logger.info(f"Reconciliation finished - {stats.to_dict()}")
+
+    return stats
+
+class ReconcileJob:
+    """
+        Runs reconcile() on a schedule in a background thread and on demand.
+        Runs never overlap each other or the initial index build, also across worker processes (an flock is held
+        while running). The last result is published to the progress store (kind "reconcile") for every worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._scheduler: threading.Thread | None = None
+        self.running = False
+        self.last_result: dict | None = None
+        self.last_error: str | None = None
+
+    def run(self, root_path: str, full: bool = False) -> dict | None:
+        """
+            Runs a reconciliation in the calling thread.
+            returns - the stats, or None if a run (or the initial index build) is already in progress
+        """
+        if index_job.is_building():
+            return None
+
+        with self._lock:
+            if self.running:
+                return None
+            lock = worker_lock.try_lock("reconcile")
+            if lock is None:
+                return None
+            self.running = True
+
+        progress_store.publish("reconcile", "last", force=True, full=full, result=self.last_result)
+        try:
+            self.last_result = reconcile(root_path, full=full).to_dict()
+            self.last_error = None
+            progress_store.publish("reconcile", "last", status="done", full=full, result=self.last_result)
+            return self.last_result
+        except Exception as e:
+            logger.error(f"Error while reconciling the file index - {e}")
+            self.last_error = str(e)
+            progress_store.publish("reconcile", "last", status="failed", error=self.last_error, full=full)
+            raise
+        finally:
+            self.running = False
+            lock.release()
+
+    def start(self, root_path: str, full: bool = False) -> bool:
+        """
+            Starts a run in a background thread. returns False if one is already in progress.
+        """
+        if self.running or index_job.is_building():
+            return False
+
+        def target():
+            try:
+                self.run(root_path, full=full)
+            except Exception:
+                pass
+
+        threading.Thread(target=target, name="storagepod-reconcile", daemon=True).start()
+        return True
+
+    def schedule(self, root_path: str, interval_seconds: int, should_run=None):
+        """
+            Runs a quick reconciliation every interval_seconds until stop() is called.
+            should_run is checked before each run, e.g. to wait for first boot to finish.
+        """
+        if interval_seconds <= 0 or self._scheduler is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval_seconds):
+                if should_run is not None and not should_run():
+                    continue
+                try:
+                    self.run(root_path)
+                except Exception:
+                    continue
+
+        self._scheduler = threading.Thread(target=loop, name="storagepod-reconcile-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        """
+            The last run of any worker, from the progress store (local state if it expired). Blocking.
+        """
+        shared = progress_store.get("reconcile", "last")
+        if shared is None:
+            return {
+                "running": self.running,
+                "last_result": self.last_result,
+                "last_error": self.last_error,
+            }
+        return {
+            "running": shared["status"] == "running",
+            "last_result": shared.get("result"),
+            "last_error": shared["error"],
+        }
+
+reconcile_job = ReconcileJob()
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import binascii
+from typing import Dict
+from fastapi import HTTPException
+
+# TUS checksum extension, algorithms a client may use for Upload-Checksum on a PATCH
+CHECKSUM_ALGORITHMS = ("sha1", "sha256", "md5")
+# whole file digest stored on FileEntry.checksum
+FILE_CHECKSUM_ALGORITHM = "sha256"
+# not in the HTTP spec, the status code the TUS checksum extension uses for a chunk that doesn't match
+CHECKSUM_MISMATCH = 460
+
+# RFC 9530 names for Repr-Digest
+_DIGEST_NAMES = {"sha256": "sha-256", "sha1": "sha", "md5": "md5"}
+
+def parse_upload_checksum(header: str):
+    """
+        "Upload-Checksum: <algorithm> <base64 digest>"
+
+        returns - (a fresh hasher for the algorithm, the expected digest)
+    """
+    algorithm, _, value = header.strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise HTTPException(status_code=400, detail=f"Unsupported checksum algorithm, use one of {','.join(CHECKSUM_ALGORITHMS)}")
+    try:
+        expected = base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid Upload-Checksum")
+    return hashlib.new(algorithm), expected
+
+class RunningHash:
+    """
+        Digest of a file that is written front to back, fed with the same chunks that are written, so the file is
+        never read again. offset is the number of bytes hashed, a hash is only good for a file of exactly that size.
+    """
+
+    __slots__ = ("algorithm", "hasher", "offset")
+
+    def __init__(self, algorithm: str = FILE_CHECKSUM_ALGORITHM, hasher=None, offset: int = 0):
+        self.algorithm = algorithm
+        self.hasher = hasher or hashlib.new(algorithm)
+        self.offset = offset
+
+    def update(self, data: bytes):
+        if data:
+            self.hasher.update(data)
+            self.offset += len(data)
+
+    def copy(self) -> "RunningHash":
+        return RunningHash(self.algorithm, self.hasher.copy(), self.offset)
+
+    @property
+    def checksum(self) -> str:
+        """
+            The value stored on FileEntry.checksum, "<algorithm>:<hex digest>".
+        """
+        return f"{self.algorithm}:{self.hasher.hexdigest()}"
+
+def file_checksum(path: str, algorithm: str = FILE_CHECKSUM_ALGORITHM, chunk_size: int = 1024 * 1024) -> str:
+    """
+        Digest of a file on disk, in the FileEntry.checksum format. Reads the whole file, blocking.
+    """
+    running = RunningHash(algorithm)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            running.update(chunk)
+    return running.checksum
+
+def repr_digest(checksum: str) -> str:
+    """
+        FileEntry.checksum as a Repr-Digest header value (RFC 9530), e.g. sha-256=:<base64>:
+    """
+    algorithm, _, hexdigest = checksum.partition(":")
+    value = base64.b64encode(bytes.fromhex(hexdigest)).decode()
+    return f"{_DIGEST_NAMES.get(algorithm, algorithm)}=:{value}:"
+
+# running whole-file hash of every TUS upload in progress, by upload id. Lives in this process only: after a
+# restart (or on another worker) the upload still completes and is verified per chunk, it just gets no digest.
+running_hashes: Dict[str, RunningHash] = {}
@@ -0,0 +1,290 @@
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from app.config import (
+    UPLOAD_MIN_CONCURRENCY, UPLOAD_MAX_CONCURRENCY, UPLOAD_START_CONCURRENCY,
+    UPLOAD_MIN_FREE_MEMORY, UPLOAD_ADJUST_INTERVAL, UPLOAD_TICKET_TTL,
+)
+from app.logger import logger
+
+# a window has to beat the previous one by this much for another slot to be kept
+GAIN_THRESHOLD = 1.05
+# windows to stay at a limit after an extra slot didn't pay off, before probing again
+HOLD_WINDOWS = 12
+# rates and slot durations are smoothed with this weight for the newest sample
+EWMA_WEIGHT = 0.3
+
+def available_memory() -> int | None:
+    """
+        MemAvailable from /proc/meminfo in bytes, None where there is no procfs.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+class Admission:
+    __slots__ = ("granted", "position", "retry_after")
+
+    def __init__(self, granted: bool, position: int = 0, retry_after: int = 0):
+        self.granted = granted
+        self.position = position
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after), "X-Upload-Queue-Position": str(self.position)}
+
+class _Slot:
+    __slots__ = ("upload_id", "user", "kind", "started", "measure", "written", "rate", "_sampled_at", "_sampled")
+
+    def __init__(self, upload_id: str, user: str, kind: str, measure):
+        self.upload_id = upload_id
+        self.user = user
+        self.kind = kind
+        self.started = time.monotonic()
+        self.measure = measure
+        self.written = 0
+        self.rate = 0.0
+        self._sampled_at = self.started
+        self._sampled = 0
+
+    def sample(self, now: float) -> int:
+        """
+            returns - bytes written since the last sample, also updates the smoothed rate of this upload
+        """
+        try:
+            written = max(0, int(self.measure()))
+        except (OSError, ValueError, TypeError):
+            written = self.written
+        delta = max(0, written - self._sampled)
+        elapsed = now - self._sampled_at
+        if elapsed > 0:
+            self.rate = delta / elapsed if self.rate == 0 else (1 - EWMA_WEIGHT) * self.rate + EWMA_WEIGHT * delta / elapsed
+        self.written = written
+        self._sampled = written
+        self._sampled_at = now
+        return delta
+
+class UploadScheduler:
+    """
+        Admission control for uploads (TUS PATCHes and multipart uploads), shared by the whole process.
+
+        At most `limit` uploads write at once. The limit moves between UPLOAD_MIN_CONCURRENCY and
+        UPLOAD_MAX_CONCURRENCY: every UPLOAD_ADJUST_INTERVAL the bytes written in the window are compared to the
+        window before, another slot is kept only if it made the disk faster (hill climbing), and the limit is
+        halved while MemAvailable is under UPLOAD_MIN_FREE_MEMORY.
+
+        Nothing waits inside the server. An upload that can't start gets a ticket and an Admission with its
+        position and a Retry-After, the client comes back and is let in when its ticket is at the front.
+        Tickets are served round robin per user, so one user with many uploads can't starve the others.
+        A ticket whose client doesn't come back within UPLOAD_TICKET_TTL is dropped.
+    """
+
+    def __init__(
+        self,
+        min_limit: int = UPLOAD_MIN_CONCURRENCY,
+        max_limit: int = UPLOAD_MAX_CONCURRENCY,
+        start_limit: int = UPLOAD_START_CONCURRENCY,
+        min_free_memory: int = UPLOAD_MIN_FREE_MEMORY,
+        adjust_interval: float = UPLOAD_ADJUST_INTERVAL,
+        ticket_ttl: float = UPLOAD_TICKET_TTL,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, start_limit))
+        self.min_free_memory = min_free_memory
+        self.adjust_interval = adjust_interval
+        self.ticket_ttl = ticket_ttl
+
+        self._lock = threading.Lock()
+        self._active: dict[str, _Slot] = {}
+        # user -> OrderedDict(upload_id -> last seen), users in the order they are served
+        self._waiting: OrderedDict[str, OrderedDict[str, float]] = OrderedDict()
+
+        self._window_started = time.monotonic()
+        self._window_bytes = 0
+        self._window_saturated = False
+        self._previous_rate: float | None = None
+        self._last_step = 0
+        self._hold = 0
+        self.throughput = 0.0
+        self.free_memory = available_memory()
+        self._slot_seconds = 0.0
+        self._recent = deque(maxlen=20)
+
+    # admission
+
+    def try_acquire(self, upload_id: str, user: str | None = None, kind: str = "tus", measure=None) -> Admission:
+        """
+            Takes a slot for upload_id if one is free and nobody is queued ahead of it, otherwise queues it.
+
+            measure() returns the bytes this upload has written so far, it's sampled for the throughput.
+        """
+        user = user or "anonymous"
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._adjust(now)
+
+            if upload_id in self._active:
+                # a retried PATCH of an upload whose previous request is still being written
+                return Admission(False, 0, 1)
+
+            order = self._fair_order()
+            free = self.limit - len(self._active)
+            if free > 0:
+                if upload_id in order[:free] or (upload_id not in order and len(order) < free):
+                    self._unqueue(user, upload_id)
+                    self._active[upload_id] = _Slot(upload_id, user, kind, measure or (lambda: 0))
+                    return Admission(True)
+
+            self._window_saturated = True
+            queue = self._waiting.setdefault(user, OrderedDict())
+            queue[upload_id] = now
+            position = self._fair_order().index(upload_id) + 1
+            return Admission(False, position, self._retry_after(position))
+
+    def release(self, upload_id: str):
+        now = time.monotonic()
+        with self._lock:
+            slot = self._active.pop(upload_id, None)
+            if slot is None:
+                return
+            self._window_bytes += slot.sample(now)
+            duration = now - slot.started
+            self._slot_seconds = duration if not self._slot_seconds else (1 - EWMA_WEIGHT) * self._slot_seconds + EWMA_WEIGHT * duration
+            self._recent.append({"upload_id": upload_id, "user": slot.user, "kind": slot.kind, "bytes": slot.written, "seconds": round(duration, 3)})
+            self._adjust(now)
+
+    def cancel(self, upload_id: str):
+        """
+            Drops a queued ticket (upload aborted by the client).
+        """
+        with self._lock:
+            for user in list(self._waiting):
+                self._unqueue(user, upload_id)
+
+    # bookkeeping, called with the lock held
+
+    def _unqueue(self, user: str, upload_id: str):
+        queue = self._waiting.get(user)
+        if queue is not None:
+            queue.pop(upload_id, None)
+            if not queue:
+                del self._waiting[user]
+
+    def _expire(self, now: float):
+        for user in list(self._waiting):
+            queue = self._waiting[user]
+            for upload_id, seen in list(queue.items()):
+                if now - seen > self.ticket_ttl:
+                    del queue[upload_id]
+            if not queue:
+                del self._waiting[user]
+
+    def _fair_order(self) -> list[str]:
+        """
+            Queued upload ids in the order they'll be let in: round robin over users, users that already hold
+            slots go after the ones that don't.
+        """
+        active_per_user = {}
+        for slot in self._active.values():
+            active_per_user[slot.user] = active_per_user.get(slot.user, 0) + 1
+
+        queues = [(active_per_user.get(user, 0), i, list(queue)) for i, (user, queue) in enumerate(self._waiting.items())]
+        order = []
+        while queues:
+            queues.sort(key=lambda q: (q[0], q[1]))
+            held, i, ids = queues[0]
+            order.append(ids.pop(0))
+            queues[0] = (held + 1, i, ids)
+            queues = [q for q in queues if q[2]]
+        return order
+
+    def _retry_after(self, position: int) -> int:
+        # every round of `limit` uploads ahead takes about one average slot
+        rounds = math.ceil(position / max(1, self.limit))
+        return max(1, min(60, math.ceil(rounds * (self._slot_seconds or 1.0))))
+
+    def _adjust(self, now: float):
+        elapsed = now - self._window_started
+        if elapsed < self.adjust_interval:
+            return
+
+        for slot in self._active.values():
+            self._window_bytes += slot.sample(now)
+
+        rate = self._window_bytes / elapsed
+        self.throughput = rate
+        self.free_memory = available_memory()
+        old_limit = self.limit
+
+        if self.free_memory is not None and self.free_memory < self.min_free_memory:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._last_step = 0
+        elif self._window_saturated and rate > 0:
+            if self._last_step > 0 and self._previous_rate and rate < self._previous_rate * GAIN_THRESHOLD:
+                # the last extra slot didn't pay off, give it back and stay there for a while
+                step = -1
+                self._hold = HOLD_WINDOWS
+            elif self._hold > 0:
+                step = 0
+                self._hold -= 1
+            else:
+                # probe one more slot
+                step = 1
+            self.limit = min(self.max_limit, max(self.min_limit, self.limit + step))
+            self._last_step = self.limit - old_limit
+        else:
+            self._last_step = 0
+
+        if self.limit != old_limit:
+            logger.info(f"Upload concurrency {old_limit} -> {self.limit} ({rate / 1024 / 1024:.1f} MiB/s, free memory {self.free_memory})")
+
+        self._previous_rate = rate if rate > 0 else self._previous_rate
+        self._window_started = now
+        self._window_bytes = 0
+        self._window_saturated = len(self._active) >= self.limit
+
+    # metrics
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._adjust(now)
+            order = self._fair_order()
+            users = {upload_id: user for user, queue in self._waiting.items() for upload_id in queue}
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "active": len(self._active),
+                "queued": len(order),
+                "throughput_bytes_per_second": round(self.throughput),
+                "free_memory": self.free_memory,
+                "average_slot_seconds": round(self._slot_seconds, 3),
+                "uploads": [
+                    {
+                        "upload_id": slot.upload_id,
+                        "user": slot.user,
+                        "kind": slot.kind,
+                        "bytes": slot.written,
+                        "bytes_per_second": round(slot.rate),
+                        "seconds": round(now - slot.started, 3),
+                    }
+                    for slot in self._active.values()
+                ],
+                "queue": [
+                    {"upload_id": upload_id, "user": users[upload_id], "position": i + 1, "retry_after": self._retry_after(i + 1)}
+                    for i, upload_id in enumerate(order)
+                ],
+                "recent": list(self._recent),
+            }
+
+upload_scheduler = UploadScheduler()
@@ -0,0 +1,52 @@
+import os
+import fcntl
+from contextlib import contextmanager
+from app.db.main import engine
+
+# lock files live next to the db, every worker process of this deployment sees the same ones
+LOCK_DIR = os.path.dirname(os.path.abspath(engine.url.database))
+
+class WorkerLock:
+    """
+        An flock(2) on <LOCK_DIR>/<name>.lock, held until release() or until the process exits (the kernel drops
+        it when the process dies, so a crashed worker never leaves it behind).
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(LOCK_DIR, f"{name}.lock")
+        self._fd: int | None = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+def try_lock(name: str) -> WorkerLock | None:
+    """
+        returns - the held lock, None if another process (or another lock in this one) holds it
+    """
+    lock = WorkerLock(name)
+    return lock if lock.acquire(blocking=False) else None
+
+@contextmanager
+def hold(name: str):
+    """
+        Waits for the lock and holds it for the with block, e.g. to run startup migrations one worker at a time.
+    """
+    lock = WorkerLock(name)
+    lock.acquire()
+    try:
+        yield lock
+    finally:
+        lock.release()
@@ -0,0 +1,251 @@
+import os
+import time
+import zlib
+import struct
+import tempfile
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.core.utils.zip_stream import is_compressed_file
+from app.logger import logger
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+READ_CHUNK_SIZE = 1024 * 1024
+# compressed members smaller than this stay in memory, bigger ones spill to a temp file next to the archive
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+# sample compressed at level 1, if it doesn't shrink below this ratio the file is STORED
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_MIN_RATIO = 0.95
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_VERSION = 45                  # zip64
+_FLAG_UTF8 = 0x800
+
+class _Member:
+    __slots__ = ("arcname", "method", "crc", "size", "compressed_size", "data", "mtime", "mode", "offset")
+
+    def __init__(self, arcname: str, method: int, mtime: float, mode: int):
+        self.arcname = arcname
+        self.method = method
+        self.mtime = mtime
+        self.mode = mode
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self.data = None
+        self.offset = 0
+
+def choose_method(path: str) -> int:
+    """
+        STORED for already compressed formats (by mimetype) and for files whose first 64KB don't compress,
+        DEFLATED otherwise.
+    """
+    if is_compressed_file(path):
+        return ZIP_STORED
+
+    with open(path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+
+    if len(sample) < 512:
+        return ZIP_DEFLATED
+
+    return ZIP_DEFLATED if len(zlib.compress(sample, 1)) < len(sample) * SAMPLE_MIN_RATIO else ZIP_STORED
+
+def _dos_datetime(mtime: float) -> tuple[int, int]:
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, date
+
+def _compress(path: str, member: _Member, level: int, spool_dir: str) -> _Member:
+    """
+        Runs in the pool. zlib releases the GIL while deflating, so members compress on all cores.
+        The raw deflate stream is kept in a spool file until it's the member's turn to be written.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=spool_dir)
+
+    with open(path, "rb") as src:
+        while True:
+            chunk = src.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            member.crc = zlib.crc32(chunk, member.crc)
+            member.size += len(chunk)
+            spool.write(compressor.compress(chunk))
+        spool.write(compressor.flush())
+
+    member.compressed_size = spool.tell()
+    spool.seek(0)
+    member.data = spool
+    return member
+
+class ParallelZipWriter:
+    """
+        Writes a ZIP64 archive to a seekable file with members deflated in a thread pool.
+
+        Members are written in the order they were added. At most `workers * 2` members are in flight,
+        so memory is bounded by the spool size per in-flight member.
+    """
+
+    def __init__(self, output_path: str, workers: int | None = None, level: int = 6, on_progress=None):
+        self.output_path = output_path
+        self.level = level
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.on_progress = on_progress
+        self.bytes_done = 0
+        self._members: list[_Member] = []
+        self._pending = deque()
+        self._fp = None
+        self._pool = None
+        self._spool_dir = os.path.dirname(os.path.abspath(output_path))
+
+    def __enter__(self):
+        self._fp = open(self.output_path, "wb")
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storagepod-zip")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._drain(0)
+                self._write_central_directory()
+        finally:
+            try:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                for future in self._pending:
+                    # cancelled by the shutdown, exception() would raise CancelledError over the original error
+                    if future.cancelled():
+                        continue
+                    if future.exception() is None:
+                        future.result().data.close()
+            finally:
+                self._fp.close()
+
+    def add_file(self, path: str, arcname: str):
+        stats = os.stat(path)
+        method = choose_method(path)
+        member = _Member(arcname, method, stats.st_mtime, stats.st_mode)
+
+        if method == ZIP_STORED:
+            # nothing to compute in parallel, copy it once every member before it is written
+            self._drain(0)
+            self._write_stored(path, member)
+            return
+
+        self._pending.append(self._pool.submit(_compress, path, member, self.level, self._spool_dir))
+        self._drain(self.workers * 2)
+
+    def add_directory(self, arcname: str, mtime: float, mode: int):
+        self._drain(0)
+        member = _Member(arcname.rstrip("/") + "/", ZIP_STORED, mtime, mode)
+        member.offset = self._fp.tell()
+        self._write_local_header(member)
+        self._members.append(member)
+
+    def _drain(self, keep: int):
+        while len(self._pending) > keep:
+            try:
+                member = self._pending.popleft().result()
+            except OSError as e:
+                logger.error(f"Failed to compress a zip member: {e}")
+                continue
+            member.offset = self._fp.tell()
+            self._write_local_header(member)
+            with member.data:
+                shutil.copyfileobj(member.data, self._fp, READ_CHUNK_SIZE)
+            member.data = None
+            self._members.append(member)
+            self._advance(member.size)
+
+    def _write_stored(self, path: str, member: _Member):
+        member.offset = self._fp.tell()
+        self._write_local_header(member)
+
+        with open(path, "rb") as src:
+            while True:
+                chunk = src.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                member.crc = zlib.crc32(chunk, member.crc)
+                member.size += len(chunk)
+                self._fp.write(chunk)
+                self._advance(len(chunk))
+
+        member.compressed_size = member.size
+        # patch crc/sizes now that they're known
+        end = self._fp.tell()
+        self._fp.seek(member.offset)
+        self._write_local_header(member)
+        self._fp.seek(end)
+        self._members.append(member)
+
+    def _advance(self, nbytes: int):
+        self.bytes_done += nbytes
+        if self.on_progress:
+            self.on_progress(self.bytes_done)
+
+    def _write_local_header(self, member: _Member):
+        name = member.arcname.encode("utf-8")
+        dos_time, dos_date = _dos_datetime(member.mtime)
+        # always zip64 sizes in the local header so the header length doesn't change when it's patched
+        extra = struct.pack("<HHQQ", 0x0001, 16, member.size, member.compressed_size)
+        self._fp.write(struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50, _VERSION, _FLAG_UTF8, member.method, dos_time, dos_date,
+            member.crc & 0xFFFFFFFF, _ZIP64_LIMIT, _ZIP64_LIMIT, len(name), len(extra)
+        ))
+        self._fp.write(name)
+        self._fp.write(extra)
+
+    def _write_central_directory(self):
+        cd_offset = self._fp.tell()
+
+        for member in self._members:
+            name = member.arcname.encode("utf-8")
+            dos_time, dos_date = _dos_datetime(member.mtime)
+
+            zip64_fields = []
+            size = member.size
+            compressed_size = member.compressed_size
+            offset = member.offset
+            if size >= _ZIP64_LIMIT:
+                zip64_fields.append(size)
+                size = _ZIP64_LIMIT
+            if compressed_size >= _ZIP64_LIMIT:
+                zip64_fields.append(compressed_size)
+                compressed_size = _ZIP64_LIMIT
+            if offset >= _ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = _ZIP64_LIMIT
+
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields)
+
+            self._fp.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50, _VERSION | (3 << 8), _VERSION, _FLAG_UTF8, member.method, dos_time, dos_date,
+                member.crc & 0xFFFFFFFF, compressed_size, size, len(name), len(extra), 0, 0, 0,
+                (member.mode & 0xFFFF) << 16 | (0x10 if member.arcname.endswith("/") else 0), offset
+            ))
+            self._fp.write(name)
+            self._fp.write(extra)
+
+        cd_end = self._fp.tell()
+        cd_size = cd_end - cd_offset
+        count = len(self._members)
+
+        if count >= 0xFFFF or cd_size >= _ZIP64_LIMIT or cd_offset >= _ZIP64_LIMIT:
+            self._fp.write(struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, _VERSION, _VERSION, 0, 0, count, count, cd_size, cd_offset
+            ))
+            self._fp.write(struct.pack("<IIQI", 0x07064B50, 0, cd_end, 1))
+
+        self._fp.write(struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(cd_size, _ZIP64_LIMIT), min(cd_offset, _ZIP64_LIMIT), 0
+        ))
@@ -0,0 +1,134 @@
+import os
+import mimetypes
+import zipfile
+from app.logger import logger
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# formats that are already compressed, deflating them again only burns CPU
+COMPRESSED_MIMETYPE_PREFIXES = ("image/", "video/", "audio/")
+COMPRESSED_MIMETYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-zstd",
+    "application/pdf",
+    "application/epub+zip",
+    "application/java-archive",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+# uncompressed media that still deflates well
+UNCOMPRESSED_MEDIA = {"image/bmp", "image/x-ms-bmp", "image/tiff", "image/svg+xml", "audio/x-wav", "audio/wav"}
+COMPRESSED_EXTENSIONS = {".mkv", ".heic", ".heif", ".webp", ".avif", ".zst", ".7z", ".rar", ".apk"}
+
+def is_compressed_file(path: str) -> bool:
+    """
+        Guesses from the name whether the file is already compressed (jpg, mp4, mkv, zip ...).
+    """
+    mime_type, encoding = mimetypes.guess_type(path)
+    if encoding is not None:
+        return True
+
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+
+    if not mime_type:
+        return False
+
+    if mime_type in UNCOMPRESSED_MEDIA:
+        return False
+
+    return mime_type.startswith(COMPRESSED_MIMETYPE_PREFIXES) or mime_type in COMPRESSED_MIMETYPES
+
+class _StreamBuffer:
+    """
+        Write-only file object for zipfile. It has no tell/seek, which makes zipfile write data descriptors
+        instead of seeking back, and the bytes written so far are drained by the generator after each chunk.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_folder_members(folder_path: str):
+    """
+        Yields (abs_path, arcname, is_directory) for every regular file under folder_path and an entry for each
+        empty folder. Symlinks are skipped so the archive can't pull in files from outside the storage dir.
+    """
+    base = os.path.basename(folder_path.rstrip(os.sep))
+
+    for dirpath, dirnames, filenames in os.walk(folder_path):
+        dirnames[:] = sorted(d for d in dirnames if not os.path.islink(os.path.join(dirpath, d)))
+        rel_dir = os.path.relpath(dirpath, folder_path)
+        arc_dir = base if rel_dir == "." else os.path.join(base, rel_dir)
+
+        if not dirnames and not filenames:
+            yield dirpath, f"{arc_dir}/", True
+            continue
+
+        for name in sorted(filenames):
+            full_path = os.path.join(dirpath, name)
+            if os.path.islink(full_path) or not os.path.isfile(full_path):
+                continue
+            yield full_path, os.path.join(arc_dir, name), False
+
+def iter_zip(folder_path: str, chunk_size: int = ZIP_CHUNK_SIZE, compresslevel: int | None = None):
+    """
+        Generates a ZIP64 archive of folder_path as it's being written, no temp file on disk.
+        Memory is bounded by one chunk. Already compressed media is STORED, everything else is DEFLATED.
+    """
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=compresslevel) as zipf:
+        for abs_path, arcname, is_directory in iter_folder_members(folder_path):
+            if is_directory:
+                zipf.writestr(zipfile.ZipInfo.from_file(abs_path, arcname), b"")
+                yield buffer.drain()
+                continue
+
+            try:
+                zinfo = zipfile.ZipInfo.from_file(abs_path, arcname)
+                zinfo.compress_type = zipfile.ZIP_STORED if is_compressed_file(abs_path) else zipfile.ZIP_DEFLATED
+                if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+                    zinfo._compresslevel = compresslevel
+
+                with open(abs_path, "rb") as src, zipf.open(zinfo, mode="w", force_zip64=True) as dest:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            except OSError as e:
+                # the header may already be out, a broken member is better than a truncated archive
+                logger.error(f"Failed to add {abs_path} to the zip stream: {e}")
+
+            data = buffer.drain()
+            if data:
+                yield data
+
+    # central directory
+    data = buffer.drain()
+    if data:
+        yield data
@@ -0,0 +1,165 @@
+from sqlalchemy import text, func, and_, or_, true
+from sqlalchemy.engine import Engine
+from sqlmodel import select
+from app.db.models import FolderStats, FileEntry
+from app.logger import logger
+
+# '0' is the character right after '/'
+_PATH_SEP_NEXT = chr(ord("/") + 1)
+
+USAGE_DEFAULT_LIMIT = 50
+USAGE_MAX_LIMIT = 500
+
+def _add(row: str) -> str:
+    return f"""
+        INSERT INTO folderstats (path, file_count, folder_count, total_size, last_modified)
+        VALUES (
+            {row}.parent_path,
+            {row}.type = 'file',
+            {row}.type = 'folder',
+            CASE WHEN {row}.type = 'file' THEN {row}.size ELSE 0 END,
+            CASE WHEN {row}.type = 'file' THEN {row}.modified_at END
+        )
+        ON CONFLICT (path) DO UPDATE SET
+            file_count = file_count + excluded.file_count,
+            folder_count = folder_count + excluded.folder_count,
+            total_size = total_size + excluded.total_size,
+            last_modified = CASE
+                WHEN excluded.last_modified IS NULL OR last_modified >= excluded.last_modified THEN last_modified
+                ELSE excluded.last_modified
+            END;
+    """
+
+def _subtract(row: str) -> str:
+    # a folder with nothing left in it has no row, last_modified stays the newest mtime seen
+    return f"""
+        UPDATE folderstats SET
+            file_count = file_count - ({row}.type = 'file'),
+            folder_count = folder_count - ({row}.type = 'folder'),
+            total_size = total_size - CASE WHEN {row}.type = 'file' THEN {row}.size ELSE 0 END
+        WHERE path = {row}.parent_path;
+        DELETE FROM folderstats WHERE path = {row}.parent_path AND file_count <= 0 AND folder_count <= 0;
+    """
+
+_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS fileentry_stats_ai AFTER INSERT ON fileentry BEGIN {_add('new')} END",
+    f"CREATE TRIGGER IF NOT EXISTS fileentry_stats_ad AFTER DELETE ON fileentry BEGIN {_subtract('old')} END",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fileentry_stats_au AFTER UPDATE OF parent_path, type, size, modified_at ON fileentry BEGIN
+        {_subtract('old')}
+        {_add('new')}
+    END
+    """,
+]
+
+_REBUILD = [
+    "DELETE FROM folderstats",
+    """
+    INSERT INTO folderstats (path, file_count, folder_count, total_size, last_modified)
+    SELECT
+        parent_path,
+        SUM(type = 'file'),
+        SUM(type = 'folder'),
+        SUM(CASE WHEN type = 'file' THEN size ELSE 0 END),
+        MAX(CASE WHEN type = 'file' THEN modified_at END)
+    FROM fileentry
+    GROUP BY parent_path
+    """,
+]
+
+def init_folder_stats(engine: Engine):
+    """
+        Creates the triggers that keep FolderStats in sync with every FileEntry write (API, indexer, watcher,
+        reconciler). Each row only holds what's directly inside one folder, so a write touches a single row no
+        matter how deep the file is. When the triggers are first created the table is rebuilt from FileEntry.
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'fileentry_stats_ai'")
+        ).first() is not None
+
+        for trigger in _TRIGGERS:
+            conn.execute(text(trigger))
+
+        if not exists:
+            logger.info("Building folder size aggregates from existing file entries")
+            for statement in _REBUILD:
+                conn.execute(text(statement))
+
+def _subtree(rel_path: str):
+    if not rel_path:
+        return true()
+    return or_(
+        FolderStats.path == rel_path,
+        and_(FolderStats.path >= f"{rel_path}/", FolderStats.path < f"{rel_path}{_PATH_SEP_NEXT}")
+    )
+
+def _totals(file_count, folder_count, total_size, last_modified) -> dict:
+    return {
+        "total_size": int(total_size or 0),
+        "file_count": int(file_count or 0),
+        "folder_count": int(folder_count or 0),
+        "last_modified": last_modified,
+    }
+
+def subtree_totals(session, rel_path: str) -> dict:
+    """
+        Recursive size/file count/folder count/newest file mtime of rel_path ("" is the storage root).
+        One range scan over the folder rows of the subtree, not over its files.
+    """
+    row = session.exec(
+        select(
+            func.sum(FolderStats.file_count),
+            func.sum(FolderStats.folder_count),
+            func.sum(FolderStats.total_size),
+            func.max(FolderStats.last_modified),
+        ).where(_subtree(rel_path))
+    ).one()
+    return _totals(*row)
+
+def child_totals(session, rel_path: str) -> dict[str, dict]:
+    """
+        Recursive totals of every sub folder directly inside rel_path, keyed by folder name, in one grouped query.
+        Folders without anything in them are missing from the result.
+    """
+    offset = len(rel_path) + 2 if rel_path else 1
+    rest = func.substr(FolderStats.path, offset)
+    child_name = func.substr(rest, 1, func.instr(rest.op("||")("/"), "/") - 1).label("child_name")
+
+    if rel_path:
+        where = and_(FolderStats.path >= f"{rel_path}/", FolderStats.path < f"{rel_path}{_PATH_SEP_NEXT}")
+    else:
+        where = FolderStats.path != ""
+
+    rows = session.exec(
+        select(
+            child_name,
+            func.sum(FolderStats.file_count),
+            func.sum(FolderStats.folder_count),
+            func.sum(FolderStats.total_size),
+            func.max(FolderStats.last_modified),
+        ).where(where).group_by(child_name)
+    ).all()
+
+    return {name: _totals(*values) for name, *values in rows}
+
+def attach_folder_totals(session, rel_dir: str, infos: list[dict]):
+    """
+        Adds total_size/file_count/folder_count/last_modified to the folder dicts of a listing of rel_dir.
+    """
+    if not any(info["is_directory"] for info in infos):
+        return
+
+    totals = child_totals(session, rel_dir)
+    empty = _totals(0, 0, 0, None)
+    for info in infos:
+        if info["is_directory"]:
+            info.update(totals.get(info["name"], empty))
+
+def top_files(session, rel_path: str, limit: int) -> list:
+    return session.exec(
+        select(FileEntry)
+        .where(FileEntry.parent_path == rel_path, FileEntry.type == "file")
+        .order_by(FileEntry.size.desc())
+        .limit(limit)
+    ).all()
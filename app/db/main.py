@@ -1,14 +1,77 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
 from app.logger import logger
 from contextlib import contextmanager
+from app.db.search_index import init_search_index
+from app.db.migrations import run_migrations
+from app.db.folder_stats import init_folder_stats
+from app.db.write_queue import WriteQueue
+from app.config import DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE
 
 DATABASE_URL = "sqlite:////app/db/data/main.db"
 
-engine = create_engine(url=DATABASE_URL, connect_args={"check_same_thread": False})
+def create_db_engine(url: str = DATABASE_URL, pool_size: int = DB_POOL_SIZE):
+    """
+        SQLite engine tuned for a Pi on an SD card/USB disk:
+
+        journal_mode=WAL - readers don't block the writer and a commit is one append to the WAL
+        synchronous=NORMAL - fsync at checkpoints only, still safe against corruption in WAL mode
+        busy_timeout - wait for the write lock instead of failing with "database is locked"
+        cache_size/mmap_size - keep the hot part of the index in memory
+    """
+    engine = create_engine(
+        url=url,
+        connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000},
+        pool_size=pool_size,
+        max_overflow=pool_size * 2,
+        pool_timeout=30,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+            cursor.execute(f"PRAGMA cache_size={-int(DB_CACHE_SIZE_KB)}")
+            cursor.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+    return engine
+
+engine = create_db_engine()
+
+# small writes (task status, single entries ...) go through here, see WriteQueue
+db_writer = WriteQueue(engine)
+
+# blocking db calls from async code run here, not on the event loop and not on the shared threadpool
+# that also streams files, so a slow query or an fsync never stalls uploads/downloads
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="storagepod-db")
+
+async def run_db(fn, *args, **kwargs):
+    """
+        Runs fn(*args, **kwargs) on the db executor and waits for it without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
 
 def init_db():
     logger.info(f"Creating the db at - {DATABASE_URL}")
     SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    init_folder_stats(engine)
+    init_search_index(engine)
+
+def close_db():
+    db_writer.stop()
+    db_executor.shutdown(wait=True, cancel_futures=True)
+    engine.dispose()
 
 @contextmanager
 def get_session():
@@ -17,8 +80,3 @@ def get_session():
         yield session
     finally:
         session.close()
-
-
-
-
-
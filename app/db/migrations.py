@@ -0,0 +1,48 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from app.logger import logger
+
+# rtrim(path, <every char of path except '/'>) strips the last path component, the outer rtrim drops the '/'
+_PARENT_PATH_SQL = "rtrim(rtrim(path, replace(path, '/', '')), '/')"
+
+def _columns(conn, table_name: str) -> set[str]:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table_name})"))}
+
+def add_file_entry_parent_path(conn):
+    """
+        FileEntry.parent_path (the folder a row lives in, "" for the storage root) and the
+        (parent_path, type, name) index that serves folder listings and child lookups from the db.
+        Existing rows are backfilled in one UPDATE.
+    """
+    if "parent_path" not in _columns(conn, "fileentry"):
+        logger.info("Migrating fileentry - adding parent_path")
+        conn.execute(text("ALTER TABLE fileentry ADD COLUMN parent_path VARCHAR NOT NULL DEFAULT ''"))
+        result = conn.execute(text(f"UPDATE fileentry SET parent_path = {_PARENT_PATH_SQL}"))
+        logger.info(f"Backfilled parent_path for {result.rowcount} file entries")
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_fileentry_parent_type_name "
+        "ON fileentry (parent_path, type, name COLLATE NOCASE)"
+    ))
+
+def add_file_entry_checksum(conn):
+    """
+        FileEntry.checksum, the digest computed while a file was uploaded. Existing rows have none.
+    """
+    if "checksum" not in _columns(conn, "fileentry"):
+        logger.info("Migrating fileentry - adding checksum")
+        conn.execute(text("ALTER TABLE fileentry ADD COLUMN checksum VARCHAR"))
+
+MIGRATIONS = [
+    add_file_entry_parent_path,
+    add_file_entry_checksum,
+]
+
+def run_migrations(engine: Engine):
+    """
+        Brings an existing db up to the current models. create_all only creates missing tables, so columns and
+        indexes added to existing tables are applied here. Every migration is idempotent and runs on each startup.
+    """
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
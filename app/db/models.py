@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional, Literal
 from datetime import datetime
 from enum import Enum
@@ -29,14 +30,69 @@ class UploadTask(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
+class JobProgress(SQLModel, table=True):
+    # progress of background work (compress, uploads being moved into place, the index build), in the db so any
+    # worker process can answer a poll. see app.core.utils.progress_store
+    key: str = Field(primary_key=True)   # "<kind>:<id>"
+    kind: str = Field(index=True)
+    status: str = Field(default="running")   # running, done, failed
+    done: int = Field(default=0)
+    total: Optional[int] = None
+    data: Optional[str] = None   # json object with the kind specific fields
+    error: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.now)
+    # rows are dropped after this, refreshed by every update so only finished or abandoned jobs expire
+    expires_at: datetime = Field(index=True)
+
+class Job(SQLModel, table=True):
+    # long file operations (copy, move, delete, compress, reindex) run by app.core.utils.job_engine, kept across
+    # restarts. the queue is read through (status, priority, created_at)
+    __table_args__ = (Index("ix_job_queue", "status", "priority", "created_at"),)
+
+    id: str = Field(primary_key=True)
+    kind: str = Field(index=True)
+    status: str = Field(default="queued")   # queued, running, done, failed, cancelled
+    priority: int = Field(default=0)   # higher runs first
+    params: str   # json
+    result: Optional[str] = None   # json
+    error: Optional[str] = None
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=1)
+    cancel_requested: bool = Field(default=False)
+    # a job retried after a failure waits until then
+    not_before: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 class FileEntry(SQLModel, table=True):
     file_id: str = Field(primary_key=True)
     name: str = Field(index=True)
     path: str = Field(index=True, unique=True)
+    # folder the entry lives in, "" for the storage root. indexed with (type, name), see app.db.migrations
+    parent_path: str = Field(default="")
     type: FileType = Field(index=True)
     size: int
     modified_at: datetime
     created_at: datetime = Field(default_factory=datetime.now)
+    # "<algorithm>:<hex digest>" computed while the file was uploaded, cleared when the file changes on disk
+    checksum: Optional[str] = None
+
+class FolderStats(SQLModel, table=True):
+    # aggregates of the files/folders directly inside one folder, kept by triggers on fileentry,
+    # recursive totals are sums over a path range, see app.db.folder_stats
+    path: str = Field(primary_key=True)
+    file_count: int = Field(default=0)
+    folder_count: int = Field(default=0)
+    total_size: int = Field(default=0)
+    last_modified: Optional[datetime] = None
+
+class ActivityEvent(SQLModel, table=True):
+    # one row per path holding its latest event, see app.core.utils.activity_store
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True, unique=True) # Full file path
+    event: str # created, modified
+    timestamp: datetime = Field(default_factory=datetime.now, index=True)
 
 # ffprobe -v error -select_streams v:0 -show_entries stream=width,height,codec_name,bit_rate,r_frame_rate,duration -of json input.mp4
 
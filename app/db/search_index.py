@@ -0,0 +1,86 @@
+from sqlalchemy import text, table, column, literal_column
+from sqlalchemy.engine import Engine
+from app.logger import logger
+
+FTS_TABLE = "file_entry_fts"
+
+# trigram tokenizer needs at least 3 characters to match anything, shorter queries use the LIKE fallback.
+FTS_MIN_QUERY_LENGTH = 3
+
+fts_table = table(FTS_TABLE, column("rowid"), column("name"))
+
+_fts_enabled = False
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fileentry_fts_ai AFTER INSERT ON fileentry BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.rowid, new.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fileentry_fts_ad AFTER DELETE ON fileentry BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.rowid, old.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fileentry_fts_au AFTER UPDATE OF name ON fileentry BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.rowid, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.rowid, new.name);
+    END
+    """,
+]
+
+def init_search_index(engine: Engine) -> bool:
+    """
+        Creates the FTS5 (trigram) index over FileEntry.name and the triggers that keep it in sync.
+        The index is an external content table, so it only stores the trigram postings and not a copy of the rows.
+        On the first run the index is backfilled from the existing rows.
+
+        returns - bool - True if the index is usable, False if this SQLite build has no FTS5/trigram support.
+    """
+    global _fts_enabled
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE}
+            ).first() is not None
+
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, content='fileentry', content_rowid='rowid', tokenize='trigram')"
+            ))
+
+            for trigger in _TRIGGERS:
+                conn.execute(text(trigger))
+
+            if not exists:
+                logger.info("Building the search index from existing file entries")
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+        _fts_enabled = True
+        logger.info("Search index (FTS5 trigram) is enabled")
+    except Exception as e:
+        _fts_enabled = False
+        logger.warning(f"FTS5 trigram search index unavailable, falling back to LIKE search - {e}")
+
+    return _fts_enabled
+
+def is_enabled() -> bool:
+    return _fts_enabled
+
+def can_use_index(q: str) -> bool:
+    return _fts_enabled and len(q) >= FTS_MIN_QUERY_LENGTH
+
+def match_clause(q: str):
+    """
+        Returns the WHERE clause for a substring match on the index.
+        The query is quoted as a single FTS5 string so user input can't inject FTS operators.
+    """
+    phrase = '"' + q.replace('"', '""') + '"'
+    return text(f"{FTS_TABLE} MATCH :match").bindparams(match=phrase)
+
+def rank_column():
+    # bm25 is lower for better matches.
+    return literal_column(f"bm25({FTS_TABLE})")
@@ -0,0 +1,127 @@
+import queue
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from sqlmodel import Session
+from app.logger import logger
+
+WRITE_BATCH_SIZE = 64
+# how long the writer waits for more writes to join a batch after the first one arrived
+WRITE_BATCH_DELAY = 0.005
+
+_STOP = object()
+
+class WriteQueue:
+    """
+        Funnels small writes through one thread so they never fight over the SQLite write lock.
+
+        Each write is a callable fn(session) that only touches the session. Writes that arrive together are run in
+        one transaction and committed once (one WAL fsync for the whole batch). If the batch fails, it's rolled back
+        and every write is retried in its own transaction, so one bad write only fails its own caller.
+    """
+
+    def __init__(self, engine, batch_size: int = WRITE_BATCH_SIZE, batch_delay: float = WRITE_BATCH_DELAY):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.batches = 0
+        self.writes = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="storagepod-db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn) -> Future:
+        """
+            Queues fn(session), returns a Future with its return value. Returned rows are not expired.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn, timeout: float | None = None):
+        """
+            Queues fn(session) and waits for it to be committed.
+        """
+        return self.submit(fn).result(timeout)
+
+    async def run_async(self, fn):
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _take_batch(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    def _apply(self, batch: list):
+        with Session(self.engine, expire_on_commit=False) as session:
+            try:
+                results = [fn(session) for fn, _ in batch]
+                session.commit()
+            except Exception:
+                session.rollback()
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+                return
+
+        # something in the batch failed, find out which by running them one by one
+        for fn, future in batch:
+            with Session(self.engine, expire_on_commit=False) as session:
+                try:
+                    result = fn(session)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch(self._queue.get())
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+
+            if batch:
+                batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+                try:
+                    self._apply(batch)
+                except Exception as e:
+                    logger.error(f"DB writer failed to apply a batch - {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                self.batches += 1
+                self.writes += len(batch)
+
+            if stop:
+                return
+
+    def stop(self, timeout: float | None = 5):
+        """
+            Applies what's queued and stops the writer thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
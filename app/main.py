@@ -1,14 +1,19 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import files, auth, system, media, tus_server
+from app.api.routes import files, auth, system, media, tus_server, jobs
 from contextlib import asynccontextmanager
-from app.db.main import init_db, get_session
+from app.db.main import init_db, close_db, get_session
 from app.core.auth import Auth
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from app.logger import logger
-from app.utils import is_first_boot, scan_and_insert, mark_first_boot_done, create_tmp_uploads_folder
-from app.config import STORAGE_DIR, settings
+from app.utils import is_first_boot, mark_first_boot_done, create_tmp_uploads_folder
+from app.core.utils.indexer import index_job
+from app.core.utils.reconciler import reconcile_job
+from app.core.utils.job_engine import job_engine
+from app.core.utils.fs_watcher import FileSystemWatcher
+from app.config import STORAGE_DIR, TEMP_UPLOADS_DIR, RECONCILE_INTERVAL_SECONDS, WATCHER_ENABLED, WATCHER_DEBOUNCE_SECONDS, settings
 from app.core.utils.auth_utils import verify_token
+from app.core.utils import worker_lock
 from fastapi import Depends
 import os
 from sqlalchemy import text
@@ -18,8 +23,11 @@ async def lifespan(app: FastAPI):
     print("Starting up: initializing database...")
     logger.info("Starting up the SQL DB")
     
-    init_db()
-    success = Auth.create_initial_user()
+    # with several workers (uvicorn --workers / WEB_CONCURRENCY) they start one at a time, so the schema,
+    # migrations and the initial user are only set up once
+    with worker_lock.hold("startup"):
+        init_db()
+        success = Auth.create_initial_user()
 
     if not success:
         raise RuntimeError("Failed to create initial user. Aborting startup.")
@@ -30,14 +38,46 @@ async def lifespan(app: FastAPI):
             "Set STORAGE_DIR or ensure /srv/dev-disk-*/Folder1 exists."
         )
     
-    if is_first_boot():
-        create_tmp_uploads_folder()
-        scan_and_insert(root_path=STORAGE_DIR)
-        mark_first_boot_done()
+    create_tmp_uploads_folder()
+
+    # the indexer, the scheduled reconciliation, the watcher and the job engine run in one worker only, the one that
+    # holds this lock. the others serve requests, queue jobs and read the job state from the db
+    background = worker_lock.try_lock("background")
+    watcher = None
+
+    if background is None:
+        logger.info("Background jobs run in another worker")
+    else:
+        if is_first_boot():
+            # the API is served while the index is built, search returns partial results until it's done.
+            index_job.start(root_path=STORAGE_DIR, on_done=mark_first_boot_done)
+
+        # copy/move/delete/compress/reindex jobs, including the ones a restart interrupted
+        job_engine.start()
+
+        # picks up files added/changed/deleted outside the API
+        reconcile_job.schedule(STORAGE_DIR, RECONCILE_INTERVAL_SECONDS, should_run=lambda: not is_first_boot())
+
+        # keeps the db live between reconciliations, tus chunks in the temp dir are not indexed
+        if WATCHER_ENABLED:
+            watcher = FileSystemWatcher(STORAGE_DIR, debounce_seconds=WATCHER_DEBOUNCE_SECONDS, ignore_paths=[TEMP_UPLOADS_DIR])
+            if not watcher.start():
+                watcher = None
     
     yield
 
-    print("Shutting down: closing database engine...")  # SQLite doesn’t need manual close
+    if watcher is not None:
+        watcher.stop()
+    reconcile_job.stop()
+    index_job.cancel(timeout=5)
+    # running jobs are queued again for the next start
+    job_engine.stop()
+    if background is not None:
+        background.release()
+
+    print("Shutting down: closing database engine...")
+    # applies queued writes and checkpoints the WAL
+    close_db()
 
 # Create the FastAPI app
 app = FastAPI(title="Files Explorer API", lifespan=lifespan)
@@ -58,17 +98,24 @@ app.add_middleware(
         "Tus-Version",
         "Tus-Extension",
         "Tus-Max-Size",
+        "Tus-Checksum-Algorithm",
+        "Repr-Digest",
         "Upload-Offset",
         "Upload-Length",
         "Upload-Expires",
+        "X-Index-Status",
+        "X-Next-Cursor",
+        "Retry-After",
+        "X-Upload-Queue-Position",
     ],
 )
 
 app.include_router(files.router, prefix="/api/v1/files", tags=["files"])
-app.include_router(tus_server.router, tags=["tus"], dependencies=[Depends(verify_token)])
+app.include_router(tus_server.router, tags=["tus"], dependencies=[Depends(verify_token), Depends(tus_server.upload_admission), Depends(tus_server.upload_checksum)])
 app.include_router(system.router, prefix="/api/v1/system", tags=["system"])
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(media.router, prefix="/api/v1/media", tags=["media"])
+app.include_router(jobs.router, prefix="/api/v1/jobs", tags=["jobs"])
 
 @app.get("/api/v1/server-status")
 def server_status():
@@ -91,4 +138,8 @@ def readyz():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database not ready: {e}")
 
+    # Serving requests, but the file index (search) is still being built
+    if index_job.is_building():
+        return {"status": "indexing", "index": index_job.status()}
+
     return {"status": "ready"}
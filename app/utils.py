@@ -1,11 +1,11 @@
 import os
 import mimetypes
-from app.db.main import get_session
+from app.db.main import get_session, db_writer
 from app.logger import logger
-from app.db.models import FileEntry, MediaEntry, AppState
+from app.db.models import AppState
 from datetime import datetime, timezone
-from app.config import STORAGE_DIR, TEMP_UPLOADS_DIR
-from sqlmodel import select
+from app.config import TEMP_UPLOADS_DIR
+from app.core.utils.indexer import build_index
 
 # sudo adduser --system --no-create-home --group --uid 1111 jellyfin
 
@@ -30,54 +30,16 @@ def is_first_boot():
         return not (state and state.value == "1")
 
 def mark_first_boot_done():
-    with get_session() as session:
-        state = AppState(key="first_boot_done", value="1", updated_at=datetime.now(timezone.utc))
-        session.merge(state)
-        session.commit()
+    state = AppState(key="first_boot_done", value="1", updated_at=datetime.now(timezone.utc))
+    db_writer.run(lambda session: session.merge(state))
 
 def scan_and_insert(root_path: str):
     """
         NOTE - Make sure that this function isn't executed unnecessarily as this may consume lot of resources and time to iterate everything and add to the db. 
+        The tree is streamed into the db in batches, see app.core.utils.indexer.build_index
     """
-    with get_session() as session:
-        try:
-            for dirpath, dirnames, filenames in os.walk(root_path):
-                for dirname in dirnames:
-                    full_path = os.path.join(dirpath, dirname)
-                    rel_path = os.path.relpath(full_path, root_path)
-
-                    stat = os.stat(full_path)
-
-                    entry = FileEntry(
-                        file_id=f"{stat.st_dev}-{stat.st_ino}",
-                        path=rel_path,
-                        name=dirname,
-                        type="folder",
-                        size=stat.st_size,
-                        modified_at=datetime.fromtimestamp(stat.st_mtime)
-                    )
-
-                    session.merge(entry)
-
-                for name in filenames:
-                    full_path = os.path.join(dirpath, name)
-                    rel_path = os.path.relpath(full_path, root_path)
-
-                    stat = os.stat(full_path)
-
-                    entry = FileEntry(
-                        file_id=f"{stat.st_dev}-{stat.st_ino}",
-                        path=rel_path,
-                        name=name,
-                        type="file",
-                        size=stat.st_size,
-                        modified_at=datetime.fromtimestamp(stat.st_mtime)
-                    )
-
-                    session.merge(entry)
-
-            # once all the changes are added, then we will commit this. 
-            session.commit()
-            logger.info("Successfully scanned the drive and inserted the data into db")
-        except Exception as e:
-            logger.error(f"Error while scanning the folder to insert into db - {e}")
+    try:
+        build_index(root_path)
+        logger.info("Successfully scanned the drive and inserted the data into db")
+    except Exception as e:
+        logger.error(f"Error while scanning the folder to insert into db - {e}")
@@ -0,0 +1,104 @@
+"""
+    Folder copy throughput, shutil.copytree + a second walk to index the copy vs file_copy.copy_tree.
+
+    A tree of --files small files (--small-kb each) in --dirs folders plus --large files of --large-mb is generated
+    under a temp dir (use --dir to put it on the real disk, on the Pi that's the only run that means anything).
+
+    before - shutil.copytree (copy2 per file, one at a time) then os.walk over the copy building a FileEntry row
+             per entry (what copy_item used to do, minus the session.merge per row)
+    after  - copy_tree with --workers threads (reflink, then copy_file_range), rows built as the entries land,
+             one syncfs at the end
+
+    Both copies are fsynced (the before run with one sync at the end too) so the disk cost is comparable. The rows
+    aren't written to a db. The page cache is dropped between runs only if you run it as root with --drop-caches.
+
+    usage - SECRET_KEY=x PYTHONPATH=. python scripts/benchmarks/copy_tree.py [--files 5000] [--small-kb 16] [--large 2] [--large-mb 256] [--workers 4]
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+from app.core.utils.file_copy import copy_tree, sync_filesystem
+from app.core.utils.indexer import path_row
+
+def make_tree(root: str, files: int, dirs: int, small_kb: int, large: int, large_mb: int) -> int:
+    total = 0
+    for d in range(dirs):
+        os.makedirs(os.path.join(root, f"d{d}"))
+    for i in range(files):
+        data = os.urandom(small_kb * 1024)
+        with open(os.path.join(root, f"d{i % dirs}", f"f{i}.bin"), "wb") as f:
+            f.write(data)
+        total += len(data)
+    block = os.urandom(1024 * 1024)
+    for i in range(large):
+        with open(os.path.join(root, f"large{i}.bin"), "wb") as f:
+            for _ in range(large_mb):
+                f.write(block)
+        total += large_mb * 1024 * 1024
+    return total
+
+def drop_caches():
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+    except OSError:
+        pass
+
+def before(src: str, dst: str) -> int:
+    shutil.copytree(src, dst)
+    sync_filesystem(dst)
+    now = datetime.now()
+    path_row(dst, "", now)
+    rows = 1
+    for dirpath, dirnames, filenames in os.walk(dst):
+        for name in dirnames + filenames:
+            path_row(os.path.join(dirpath, name), "", now)
+            rows += 1
+    return rows
+
+def after(src: str, dst: str, workers: int) -> int:
+    now = datetime.now()
+    rows = 0
+
+    def on_copied(path: str):
+        nonlocal rows
+        path_row(path, os.path.relpath(path, dst), now)
+        rows += 1
+
+    copy_tree(src, dst, on_copied=on_copied, workers=workers)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--dirs", type=int, default=50)
+    parser.add_argument("--small-kb", type=int, default=16)
+    parser.add_argument("--large", type=int, default=2)
+    parser.add_argument("--large-mb", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--dir", default=None, help="where to put the trees (use the real disk on the Pi)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        src = os.path.join(tmp, "src")
+        os.mkdir(src)
+        total = make_tree(src, args.files, args.dirs, args.small_kb, args.large, args.large_mb)
+        print(f"{args.files} x {args.small_kb} KiB + {args.large} x {args.large_mb} MiB, {total / 2**20:.0f} MiB")
+
+        for name, run in (("before", lambda dst: before(src, dst)), ("after", lambda dst: after(src, dst, args.workers))):
+            if args.drop_caches:
+                drop_caches()
+            dst = os.path.join(tmp, name)
+            started = time.perf_counter()
+            rows = run(dst)
+            seconds = time.perf_counter() - started
+            print(f"{name:7} {seconds:7.2f} s   {total / 2**20 / seconds:8.1f} MiB/s   {args.files / seconds:9.0f} files/s   {rows} rows")
+            shutil.rmtree(dst)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+    Mixed read/write load on the SQLite db, like concurrent uploads + renames + searches hitting the API.
+
+    before - bare create_engine (rollback journal, default pool), every write opens its own session and commits
+    after  - app.db.main.create_db_engine (WAL, pragmas, sized pool), writes go through the batching WriteQueue
+
+    Reader threads run name lookups and LIKE searches on FileEntry, writer threads update UploadTask rows and
+    upsert FileEntry rows, for a fixed duration each. Reports ops/s, latency and "database is locked" errors.
+
+    usage - PYTHONPATH=. python scripts/benchmarks/db_mixed_load.py [--seconds 10] [--readers 8] [--writers 4] [--rows 50000]
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Session, select
+from app.db.models import FileEntry, UploadTask
+from app.db.main import create_db_engine
+from app.db.write_queue import WriteQueue
+
+def seed(engine, rows: int):
+    SQLModel.metadata.create_all(engine)
+    now = datetime.now()
+    with Session(engine) as session:
+        session.execute(FileEntry.__table__.insert(), [
+            {"file_id": f"1-{i}", "name": f"file_{i}.mkv", "path": f"dir_{i % 100}/file_{i}.mkv", "type": "file",
+             "size": i, "modified_at": now, "created_at": now}
+            for i in range(rows)
+        ])
+        session.execute(UploadTask.__table__.insert(), [
+            {"task_id": f"task-{i}", "filename": f"file_{i}", "status": "uploading", "written": 0, "total": 0,
+             "created_at": now, "updated_at": now}
+            for i in range(100)
+        ])
+        session.commit()
+
+def update_task(session, task_id: str):
+    task = session.get(UploadTask, task_id)
+    task.written += 1
+    task.updated_at = datetime.now()
+    session.add(task)
+
+def upsert_entry(session, i: int):
+    session.merge(FileEntry(file_id=f"2-{i}", name=f"new_{i}", path=f"new/new_{i}", type="file", size=i, modified_at=datetime.now()))
+
+def run_load(engine, writer: WriteQueue | None, seconds: float, readers: int, writers: int, rows: int) -> dict:
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {"read": [], "write": [], "locked": 0, "errors": 0}
+
+    def record(kind: str, started: float):
+        with lock:
+            results[kind].append(time.perf_counter() - started)
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with Session(engine) as session:
+                    if random.random() < 0.5:
+                        session.exec(select(FileEntry).where(FileEntry.path == f"dir_1/file_{random.randrange(rows)}.mkv")).first()
+                    else:
+                        session.exec(select(FileEntry).where(FileEntry.name.like(f"%_{random.randrange(1000)}%")).limit(50)).all()
+                record("read", started)
+            except OperationalError as e:
+                with lock:
+                    results["locked" if "locked" in str(e) else "errors"] += 1
+
+    def write_worker(n: int):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            if i % 2:
+                fn = lambda session, t=f"task-{random.randrange(100)}": update_task(session, t)
+            else:
+                fn = lambda session, k=n * 10_000_000 + i: upsert_entry(session, k)
+            started = time.perf_counter()
+            try:
+                if writer is not None:
+                    writer.run(fn)
+                else:
+                    with Session(engine) as session:
+                        fn(session)
+                        session.commit()
+                record("write", started)
+            except OperationalError as e:
+                with lock:
+                    results["locked" if "locked" in str(e) else "errors"] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=write_worker, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def report(name: str, results: dict, seconds: float):
+    print(f"--- {name}")
+    for kind in ("read", "write"):
+        samples = sorted(results[kind])
+        if not samples:
+            print(f"{kind:<6} 0 ops")
+            continue
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{kind:<6} {len(samples) / seconds:8.0f} ops/s   median {statistics.median(samples) * 1000:7.2f} ms   p95 {p95 * 1000:8.2f} ms")
+    print(f"database is locked: {results['locked']}   other errors: {results['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dir", default=None, help="where to put the test dbs (use the real disk on the Pi)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        before = create_engine(f"sqlite:///{os.path.join(tmp, 'before.db')}", connect_args={"check_same_thread": False})
+        seed(before, args.rows)
+        report("before (default engine, direct commits)", run_load(before, None, args.seconds, args.readers, args.writers, args.rows), args.seconds)
+        before.dispose()
+
+        after = create_db_engine(f"sqlite:///{os.path.join(tmp, 'after.db')}")
+        seed(after, args.rows)
+        writer = WriteQueue(after)
+        results = run_load(after, writer, args.seconds, args.readers, args.writers, args.rows)
+        writer.stop()
+        report("after (WAL engine, write queue)", results, args.seconds)
+        print(f"write queue: {writer.writes} writes in {writer.batches} commits")
+        with after.connect() as conn:
+            print("journal_mode:", conn.execute(text("PRAGMA journal_mode")).scalar())
+        after.dispose()
+
+if __name__ == "__main__":
+    main()
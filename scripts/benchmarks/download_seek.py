@@ -0,0 +1,126 @@
+"""
+    Seek latency of FileManager.download on a large MKV.
+
+    A video player seeks by aborting the current request and asking for `Range: bytes=<offset>-`, then it reads
+    a few MB before it can show a frame. This measures that pattern straight on the ASGI response (no network),
+    for the old response and for RangeFileResponse.
+
+    before - the whole file from offset 0, what the player gets when Range is ignored (starlette < 0.39, which
+             the fastapi>=0.100 pin allows), read until the same amount of data arrived
+    after  - RangeFileResponse with the Range header
+
+    Also times a revalidation (If-None-Match) against a full re-download.
+
+    usage - PYTHONPATH=. python scripts/benchmarks/download_seek.py [--size-gb 4] [--seeks 20] [--read-mb 4]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from app.core.utils.http_files import RangeFileResponse
+
+async def run(response, headers: dict, read_bytes: int) -> tuple[int, int, float]:
+    """
+        returns - (status, bytes received, seconds) reading until read_bytes arrived, then disconnecting
+    """
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        "extensions": {},
+    }
+    received = 0
+    status = 0
+    done = asyncio.Event()
+
+    async def receive():
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+            if received >= read_bytes or not message.get("more_body", False):
+                done.set()
+                # a real server raises once the client is gone, stop producing
+                if received >= read_bytes:
+                    raise ConnectionResetError()
+
+    start = time.perf_counter()
+    try:
+        await response(scope, receive, send)
+    except* ConnectionResetError:
+        pass
+    return status, received, time.perf_counter() - start
+
+def summary(name: str, samples: list[float]) -> str:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"{name:<34} median {statistics.median(samples) * 1000:9.1f} ms   p95 {p95 * 1000:9.1f} ms"
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-gb", type=float, default=4)
+    parser.add_argument("--seeks", type=int, default=20)
+    parser.add_argument("--read-mb", type=float, default=4)
+    parser.add_argument("--file", help="use an existing file instead of a generated one")
+    args = parser.parse_args()
+
+    read_bytes = int(args.read_mb * 1024 * 1024)
+
+    if args.file:
+        path = args.file
+        cleanup = False
+    else:
+        # random data, not a sparse file, so reads actually hit the disk/page cache
+        fd, path = tempfile.mkstemp(suffix=".mkv")
+        size = int(args.size_gb * 1024 ** 3)
+        block = os.urandom(8 * 1024 * 1024)
+        with os.fdopen(fd, "wb") as f:
+            written = 0
+            while written < size:
+                f.write(block[:size - written])
+                written += min(len(block), size - written)
+        cleanup = True
+
+    size = os.path.getsize(path)
+    offsets = [random.randrange(0, max(1, size - read_bytes)) for _ in range(args.seeks)]
+
+    before, after = [], []
+    for offset in offsets:
+        # before: no range support, the bytes at `offset` only arrive after everything in front of them
+        _, _, seconds = await run(RangeFileResponse(path), {}, offset + read_bytes)
+        before.append(seconds)
+
+        status, received, seconds = await run(RangeFileResponse(path), {"Range": f"bytes={offset}-"}, read_bytes)
+        assert status == 206 and received >= read_bytes, (status, received)
+        after.append(seconds)
+
+    etag = RangeFileResponse(path).etag
+    full, revalidate = [], []
+    for _ in range(5):
+        full.append((await run(RangeFileResponse(path), {}, size))[2])
+        status, _, seconds = await run(RangeFileResponse(path), {"If-None-Match": etag}, 1)
+        assert status == 304, status
+        revalidate.append(seconds)
+
+    print(f"file {path} ({size / 1024 ** 3:.2f} GiB), {args.seeks} seeks reading {args.read_mb} MiB each")
+    print(summary("seek, before (no Range)", before))
+    print(summary("seek, after (Range 206)", after))
+    print(summary("re-download, full 200", full))
+    print(summary("re-download, If-None-Match 304", revalidate))
+
+    if cleanup:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    if sys.version_info < (3, 11):
+        sys.exit("needs python 3.11+")
+    asyncio.run(main())
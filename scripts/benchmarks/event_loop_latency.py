@@ -0,0 +1,98 @@
+"""
+    Shows that the event loop keeps streaming while db writes commit.
+
+    A fake upload stream ticks every 1 ms on the event loop (like receiving chunks of an upload) while upload task
+    status writes commit in the background.
+
+    before - the write runs a synchronous session inside the coroutine (what init_task/complete_task used to do)
+    after  - the write goes through db_writer.run_async / run_db and the loop only awaits the result
+
+    Reports how late the stream ticks were. With the old path every commit (and its fsync) shows up as a stall.
+
+    usage - SECRET_KEY=x PYTHONPATH=. python scripts/benchmarks/event_loop_latency.py [--writes 300] [--dir /path/on/the/disk]
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+from sqlmodel import SQLModel, Session
+from app.db.models import UploadTask
+from app.db.main import create_db_engine
+from app.db.write_queue import WriteQueue
+
+TICK = 0.001
+
+async def stream(stop: asyncio.Event, lags: list):
+    """
+        Stands in for an upload stream, records how late each 1 ms tick was.
+    """
+    expected = time.perf_counter() + TICK
+    while not stop.is_set():
+        await asyncio.sleep(TICK)
+        now = time.perf_counter()
+        lags.append(max(0.0, now - expected))
+        expected = now + TICK
+
+def write(session: Session, i: int):
+    task = session.get(UploadTask, f"task-{i % 100}")
+    task.written = i
+    task.updated_at = datetime.now()
+    session.add(task)
+
+async def run(engine, writer: WriteQueue | None, writes: int) -> list:
+    stop = asyncio.Event()
+    lags = []
+    streamer = asyncio.create_task(stream(stop, lags))
+
+    async def one(i: int):
+        if writer is None:
+            # blocking session inside the coroutine
+            with Session(engine) as session:
+                write(session, i)
+                session.commit()
+        else:
+            await writer.run_async(lambda session: write(session, i))
+
+    # a few concurrent writers, like several uploads reporting progress
+    for start in range(0, writes, 4):
+        await asyncio.gather(*[one(i) for i in range(start, min(start + 4, writes))])
+        await asyncio.sleep(0.002)
+
+    stop.set()
+    await streamer
+    return lags
+
+def report(name: str, lags: list):
+    lags = sorted(lags)
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(f"{name:<28} ticks {len(lags):6}   median {statistics.median(lags) * 1000:6.2f} ms   p99 {p99 * 1000:7.2f} ms   max {lags[-1] * 1000:7.2f} ms")
+
+def seed(engine):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i in range(100):
+            session.add(UploadTask(task_id=f"task-{i}", filename=f"file_{i}"))
+        session.commit()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=300)
+    parser.add_argument("--dir", default=None, help="where to put the test db (use the real disk on the Pi)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'loop.db')}")
+        seed(engine)
+
+        report("before (sync session in loop)", await run(engine, None, args.writes))
+
+        writer = WriteQueue(engine)
+        report("after (db writer thread)", await run(engine, writer, args.writes))
+        writer.stop()
+        engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
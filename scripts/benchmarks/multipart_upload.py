@@ -0,0 +1,155 @@
+"""
+    Multipart upload throughput over loopback, and how late the event loop runs while the body is written.
+
+    A uvicorn server runs in a child process on 127.0.0.1 with STORAGE_DIR pointing at a temp dir (use --dir to put
+    it on the real disk). It has two upload routes
+
+    before - StreamingFormDataParser + FileTarget fed on the event loop, every chunk Starlette produces is a
+             blocking write() on the loop (what new_start_upload used to do)
+    after  - SingleFileStreamingParser, writes coalesced into UPLOAD_WRITE_BUFFER blocks on the threadpool, temp
+             file + fsync + rename
+
+    and a 1 ms ticker on its event loop (stands in for the other requests the Pi is serving). The same random file
+    is uploaded --runs times to each route. Reports MiB/s and the p99/max lateness of the ticker, and checks the
+    uploaded file matches. The FileEntry upsert and UploadTask progress writes are skipped so the real db isn't
+    touched. The "after" run pays for an fsync the "before" run doesn't do, on the Pi's HDD that's the honest cost
+    of the file being durable when the response goes out.
+
+    usage - SECRET_KEY=x PYTHONPATH=. python scripts/benchmarks/multipart_upload.py [--size-mb 512] [--runs 3] [--buffer-mb 8]
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+import httpx
+
+HOST = "127.0.0.1"
+TICK = 0.001
+
+def serve(storage_dir: str, port: int, buffer_size: int):
+    os.environ["STORAGE_DIR"] = storage_dir
+    import asyncio
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from streaming_form_data import StreamingFormDataParser
+    from streaming_form_data.targets import FileTarget
+    from app.core.utils import file_utils
+
+    async def no_progress(task_id, written, total):
+        pass
+
+    file_utils.update_progress = no_progress
+    app = FastAPI()
+    lags = []
+
+    async def ticker():
+        expected = time.perf_counter() + TICK
+        while True:
+            await asyncio.sleep(TICK)
+            now = time.perf_counter()
+            lags.append(max(0.0, now - expected))
+            expected = now + TICK
+
+    @app.on_event("startup")
+    async def start_ticker():
+        asyncio.get_running_loop().create_task(ticker())
+
+    @app.post("/before")
+    async def before(request: Request):
+        target = FileTarget(os.path.join(storage_dir, "before.bin"))
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register("file", target)
+        async for chunk in request.stream():
+            parser.data_received(chunk)
+        return {}
+
+    @app.post("/after")
+    async def after(request: Request):
+        parser = file_utils.SingleFileStreamingParser(request.headers, os.path.join(storage_dir, "after.bin"), "bench", buffer_size)
+        await parser.parse_and_save(request)
+        return {}
+
+    @app.post("/lags")
+    async def take_lags():
+        taken = list(lags)
+        lags.clear()
+        return taken
+
+    uvicorn.run(app, host=HOST, port=port, log_level="warning")
+
+def digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(1024 * 1024):
+            h.update(data)
+    return h.hexdigest()
+
+def run(client: httpx.Client, route: str, source: str) -> tuple[float, list]:
+    client.post("/lags")
+    started = time.perf_counter()
+    with open(source, "rb") as f:
+        r = client.post(f"/{route}", files={"file": ("bench.bin", f, "application/octet-stream")})
+    r.raise_for_status()
+    seconds = time.perf_counter() - started
+    return seconds, client.post("/lags").json()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--buffer-mb", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--dir", default=None, help="where to put the storage dir (use the real disk on the Pi)")
+    args = parser.parse_args()
+
+    base = f"http://{HOST}:{args.port}"
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as storage:
+        source = os.path.join(storage, "source.bin")
+        with open(source, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = digest(source)
+
+        server = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(storage, args.port, args.buffer_mb * 1024 * 1024), daemon=True
+        )
+        server.start()
+        for _ in range(100):
+            try:
+                httpx.post(f"{base}/lags")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        results = {}
+        try:
+            with httpx.Client(base_url=base, timeout=None) as client:
+                for route in ("before", "after"):
+                    seconds, lags = [], []
+                    for _ in range(args.runs):
+                        s, l = run(client, route, source)
+                        seconds.append(s)
+                        lags.extend(l)
+                    results[route] = (statistics.median(seconds), lags)
+        finally:
+            server.terminate()
+            server.join()
+
+        for route in ("before", "after"):
+            if digest(os.path.join(storage, f"{route}.bin")) != expected:
+                sys.exit(f"{route}.bin doesn't match the source")
+
+    print(f"{args.size_mb} MiB x {args.runs} runs, {args.buffer_mb} MiB write buffer")
+    for route, (seconds, lags) in results.items():
+        lags.sort()
+        p99 = lags[int(len(lags) * 0.99)] * 1000 if lags else 0
+        worst = lags[-1] * 1000 if lags else 0
+        print(f"{route:7} {seconds:7.2f} s   {args.size_mb / seconds:8.1f} MiB/s   loop lag p99 {p99:6.2f} ms   max {worst:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+    TUS upload throughput over loopback, one stream vs N parallel partial uploads (concatenation extension).
+
+    A uvicorn server with only the tus router runs in a child process on 127.0.0.1, with STORAGE_DIR pointing at a
+    temp dir (use --dir to put it on the real disk). The client uploads the same random file
+
+    single   - one upload, PATCHes of --chunk-mb one after the other
+    parallel - the file split into --streams partial uploads PATCHed at the same time on their own connections,
+               then the final upload, timed until HEAD on it reports the stitched file in place
+
+    and checks that the file that lands in the storage dir matches. The server uses a db in the temp dir, with the
+    job engine running so it stitches the final upload, and the FileEntry upsert is skipped.
+
+    usage - SECRET_KEY=x PYTHONPATH=. python scripts/benchmarks/tus_parallel_upload.py [--size-mb 1024] [--streams 4] [--chunk-mb 64]
+"""
+import os
+import sys
+import time
+import base64
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+import httpx
+
+HOST = "127.0.0.1"
+PREFIX = "/api/v1/uploads"
+TUS = {"Tus-Resumable": "1.0.0"}
+READ_SIZE = 1024 * 1024
+
+def serve(storage_dir: str, port: int):
+    os.environ["STORAGE_DIR"] = storage_dir
+    import uvicorn
+    from fastapi import FastAPI
+    from app.utils import create_tmp_uploads_folder
+    from app.api.routes import tus_server
+    from app.core.file_manager import FileManager
+    from app.core.utils.job_engine import job_engine
+    from app.db import main as db
+    from sqlmodel import SQLModel
+
+    # a running server on the same db would claim the finalize job
+    db.engine = db.db_writer.engine = db.create_db_engine(f"sqlite:///{os.path.join(storage_dir, 'bench.db')}")
+    SQLModel.metadata.create_all(db.engine)
+    FileManager.index_file = staticmethod(lambda full_path, checksum=None: None)
+    create_tmp_uploads_folder()
+    app = FastAPI()
+    app.include_router(tus_server.router)
+    job_engine.start()
+    uvicorn.run(app, host=HOST, port=port, log_level="warning")
+
+def b64(value: str) -> str:
+    return base64.b64encode(value.encode()).decode()
+
+def file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while start < end:
+            data = f.read(min(READ_SIZE, end - start))
+            if not data:
+                return
+            start += len(data)
+            yield data
+
+def upload(client: httpx.Client, path: str, start: int, end: int, chunk: int, headers: dict) -> str:
+    r = client.post(f"{PREFIX}/", headers={**TUS, "Upload-Length": str(end - start), **headers})
+    r.raise_for_status()
+    location = r.headers["location"]
+    offset = 0
+    while start + offset < end:
+        size = min(chunk, end - start - offset)
+        r = client.patch(location, content=file_range(path, start + offset, start + offset + size), headers={
+            **TUS, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream", "Content-Length": str(size),
+        })
+        r.raise_for_status()
+        offset = int(r.headers["upload-offset"])
+    return location
+
+def single(base: str, path: str, size: int, chunk: int, name: str):
+    with httpx.Client(base_url=base, timeout=None) as client:
+        upload(client, path, 0, size, chunk, {"Upload-Metadata": f"filename {b64(name)},path {b64('/')}"})
+
+def parallel(base: str, path: str, size: int, chunk: int, name: str, streams: int) -> float:
+    step = -(-size // streams)
+    locations = [None] * streams
+
+    def part(i: int):
+        with httpx.Client(base_url=base, timeout=None) as client:
+            locations[i] = upload(client, path, i * step, min(size, (i + 1) * step), chunk, {"Upload-Concat": "partial"})
+
+    threads = [threading.Thread(target=part, args=(i,)) for i in range(streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if None in locations:
+        raise RuntimeError("a partial upload failed")
+
+    started = time.perf_counter()
+    with httpx.Client(base_url=base, timeout=None) as client:
+        r = client.post(f"{PREFIX}/", headers={
+            **TUS, "Upload-Concat": "final;" + " ".join(locations),
+            "Upload-Metadata": f"filename {b64(name)},path {b64('/')}",
+        })
+        r.raise_for_status()
+        # the partials are stitched by a job, the file is in place once HEAD has the offset
+        while "upload-offset" not in (head := client.head(r.headers["location"], headers=TUS)).headers:
+            head.raise_for_status()
+            time.sleep(0.05)
+    return time.perf_counter() - started
+
+def digest(path: str) -> str:
+    h = hashlib.sha256()
+    for data in file_range(path, 0, os.path.getsize(path)):
+        h.update(data)
+    return h.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dir", default=None, help="where to put the storage dir (use the real disk on the Pi)")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    chunk = args.chunk_mb * 1024 * 1024
+    base = f"http://{HOST}:{args.port}"
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as storage:
+        source = os.path.join(storage, "source.bin")
+        with open(source, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = digest(source)
+
+        server = multiprocessing.get_context("spawn").Process(target=serve, args=(storage, args.port), daemon=True)
+        server.start()
+        for _ in range(100):
+            try:
+                httpx.options(f"{base}{PREFIX}/", headers=TUS)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        try:
+            started = time.perf_counter()
+            single(base, source, size, chunk, "single.bin")
+            single_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            concat_seconds = parallel(base, source, size, chunk, "parallel.bin", args.streams)
+            parallel_seconds = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.join()
+
+        for name in ("single.bin", "parallel.bin"):
+            if digest(os.path.join(storage, name)) != expected:
+                sys.exit(f"{name} doesn't match the source")
+
+    mb = args.size_mb
+    print(f"{mb} MiB, {args.chunk_mb} MiB chunks")
+    print(f"single stream        {single_seconds:7.2f} s   {mb / single_seconds:8.1f} MiB/s")
+    print(f"{args.streams} streams            {parallel_seconds:7.2f} s   {mb / parallel_seconds:8.1f} MiB/s   (final concat {concat_seconds * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
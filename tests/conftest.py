@@ -0,0 +1,4 @@
+import os
+
+# app.config reads these on import
+os.environ.setdefault("SECRET_KEY", "test")
@@ -0,0 +1,106 @@
+import os
+import pytest
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session, select
+from watchdog.events import DirMovedEvent, FileMovedEvent, DirCreatedEvent, FileCreatedEvent
+from app.db.main import create_db_engine
+from app.db.models import FileEntry
+from app.core.utils import fs_watcher
+from app.core.utils.db_utils import move_subtree_statement
+from app.core.utils.indexer import iter_tree, upsert_rows
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", pool_size=1)
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(fs_watcher, "get_session", lambda: Session(engine))
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def root(tmp_path, engine):
+    root = tmp_path / "storage"
+    for d in range(5):
+        (root / "a" / f"d{d}").mkdir(parents=True)
+        for f in range(20):
+            (root / "a" / f"d{d}" / f"f{f}.txt").write_text("x")
+    with Session(engine) as session:
+        upsert_rows(session, list(iter_tree(str(root))))
+        session.commit()
+    return root
+
+def paths(engine) -> list[str]:
+    with Session(engine) as session:
+        return sorted(session.exec(select(FileEntry.path)).all())
+
+def count_statements(engine, fn) -> int:
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return len(statements)
+
+def moved_events(root, src: str, dst: str) -> list:
+    # what the inotify emitter sends: the folder, then a synthetic event per entry below it
+    events = [DirMovedEvent(str(root / src), str(root / dst))]
+    for dirpath, dirnames, filenames in os.walk(root / dst):
+        for name in dirnames + filenames:
+            new = os.path.join(dirpath, name)
+            old = str(root / src) + new[len(str(root / dst)):]
+            kind = DirMovedEvent if name in dirnames else FileMovedEvent
+            events.append(kind(old, new, is_synthetic=True))
+    return events
+
+def test_moved_tree_is_reindexed_with_one_update(root, engine):
+    before = paths(engine)
+    watcher = fs_watcher.FileSystemWatcher(str(root))
+    handler = fs_watcher._EventHandler(watcher)
+
+    os.rename(root / "a", root / "b")
+    for moved in moved_events(root, "a", "b"):
+        handler.dispatch(moved)
+
+    statements = count_statements(engine, watcher.flush)
+
+    assert paths(engine) == sorted("b" + path[1:] for path in before)
+    # not one statement per entry of the 106 moved
+    assert statements <= 8
+
+def test_move_already_applied_by_the_api_keeps_the_rows(root, engine):
+    before = paths(engine)
+    watcher = fs_watcher.FileSystemWatcher(str(root))
+    handler = fs_watcher._EventHandler(watcher)
+
+    with Session(engine) as session:
+        session.execute(move_subtree_statement("a", "b"))
+        os.rename(root / "a", root / "b")
+        session.commit()
+    for moved in moved_events(root, "a", "b"):
+        handler.dispatch(moved)
+    watcher.flush()
+
+    assert paths(engine) == sorted("b" + path[1:] for path in before)
+
+def test_created_tree_is_walked_once(root, engine, monkeypatch):
+    watcher = fs_watcher.FileSystemWatcher(str(root))
+    handler = fs_watcher._EventHandler(watcher)
+
+    (root / "c" / "d" / "e").mkdir(parents=True)
+    (root / "c" / "d" / "e" / "f.txt").write_text("x")
+    for created in (
+        DirCreatedEvent(str(root / "c")),
+        DirCreatedEvent(str(root / "c" / "d")),
+        DirCreatedEvent(str(root / "c" / "d" / "e")),
+        FileCreatedEvent(str(root / "c" / "d" / "e" / "f.txt")),
+    ):
+        handler.dispatch(created)
+
+    walked = []
+    monkeypatch.setattr(fs_watcher, "iter_tree", lambda abs_path, **kwargs: walked.append(abs_path) or iter_tree(abs_path, **kwargs))
+    watcher.flush()
+
+    assert walked == [str(root / "c")]
+    assert {"c", "c/d", "c/d/e", "c/d/e/f.txt"} <= set(paths(engine))
@@ -0,0 +1,28 @@
+from datetime import datetime
+from sqlmodel import SQLModel, Session, select
+from app.db.main import create_db_engine
+from app.db.models import FileEntry
+from app.core.utils.indexer import upsert_rows
+
+def row(file_id: str, path: str, size: int = 1) -> dict:
+    now = datetime.now()
+    return {
+        "file_id": file_id, "path": path, "parent_path": "", "name": path, "type": "file",
+        "size": size, "modified_at": now, "created_at": now,
+    }
+
+def test_upsert_replaces_row_of_old_inode(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", pool_size=1)
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        upsert_rows(session, [row("1-10", "a.txt"), row("1-11", "b.txt")])
+        session.commit()
+        # a.txt replaced by an atomic save, the path now belongs to a new inode
+        upsert_rows(session, [row("1-12", "a.txt", size=2)])
+        session.commit()
+
+        entries = session.exec(select(FileEntry.file_id, FileEntry.path, FileEntry.size).order_by(FileEntry.path)).all()
+
+    engine.dispose()
+    assert [tuple(entry) for entry in entries] == [("1-12", "a.txt", 2), ("1-11", "b.txt", 1)]
@@ -0,0 +1,58 @@
+import os
+import pytest
+from fastapi import HTTPException
+from sqlmodel import SQLModel, Session
+from app.db.main import create_db_engine
+from app.db.migrations import add_file_entry_parent_path
+from app.core.utils.indexer import iter_tree, upsert_rows
+from app.core.utils.listing_utils import list_page, list_page_from_index
+
+def test_cursor_only_pages_the_listing_it_was_made_for(tmp_path):
+    for i in range(5):
+        (tmp_path / f"f{i}.txt").write_text("x" * i)
+
+    first = list_page(str(tmp_path), "", sort="name", limit=2)
+    second = list_page(str(tmp_path), "", sort="name", limit=2, cursor=first["next_cursor"])
+    assert [info["name"] for info in second["files"]] == ["f2.txt", "f3.txt"]
+
+    with pytest.raises(HTTPException) as error:
+        list_page(str(tmp_path), "", sort="size", limit=2, cursor=first["next_cursor"])
+    assert error.value.status_code == 400
+
+def test_index_pages_match_disk_pages(tmp_path):
+    root = tmp_path / "storage"
+    root.mkdir()
+    for i, name in enumerate(["b", "A", "c", "D"]):
+        (root / name).mkdir()
+    for i, name in enumerate(["e.txt", "B.txt", "a.txt", "Z.bin", "y.bin", "c.txt"]):
+        (root / name).write_text("x" * (i * 7 % 5))
+        os.utime(root / name, (1_700_000_000 + i * 13 % 7, 1_700_000_000 + i * 13 % 7))
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", pool_size=1)
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        add_file_entry_parent_path(conn)
+    with Session(engine) as session:
+        upsert_rows(session, [row for row in iter_tree(str(root))])
+        session.commit()
+
+        for sort in ("name", "size", "modified_at"):
+            for order in ("asc", "desc"):
+                for dirs_first in (True, False):
+                    params = {"sort": sort, "order": order, "dirs_first": dirs_first, "limit": 3}
+                    expected = [info["name"] for info in list_page(str(root), "", **{**params, "limit": 100})["files"]]
+
+                    by_cursor, cursor = [], None
+                    while True:
+                        page = list_page_from_index(session, "", cursor=cursor, **params)
+                        by_cursor += [info["name"] for info in page["files"]]
+                        if not (cursor := page["next_cursor"]):
+                            break
+                    by_offset = [
+                        info["name"]
+                        for offset in range(0, len(expected), 3)
+                        for info in list_page_from_index(session, "", offset=offset, **params)["files"]
+                    ]
+                    assert by_cursor == by_offset == expected, params
+
+    engine.dispose()
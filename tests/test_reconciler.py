@@ -0,0 +1,57 @@
+import os
+import errno
+import pytest
+from datetime import datetime
+from sqlmodel import SQLModel, Session, select
+from app.db.main import create_db_engine
+from app.db.models import FileEntry
+from app.core.utils import reconciler
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", pool_size=1)
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(reconciler, "get_session", lambda: Session(engine))
+    yield engine
+    engine.dispose()
+
+def test_nested_change_converges(tmp_path, engine):
+    root = tmp_path / "storage"
+    (root / "a" / "b" / "c").mkdir(parents=True)
+    (root / "a" / "b" / "c" / "old.txt").write_text("old")
+    reconciler.reconcile(str(root))
+
+    (root / "a" / "b" / "c" / "new.txt").write_text("new")
+    first = reconciler.reconcile(str(root))
+    second = reconciler.reconcile(str(root))
+
+    assert first.inserted == 1
+    # the storage root has no row and is always diffed, nothing else is left to scan
+    assert second.dirs_scanned == 1
+    assert second.inserted == second.updated == second.deleted == 0
+
+    with Session(engine) as session:
+        modified_at = session.exec(select(FileEntry.modified_at).where(FileEntry.path == "a/b/c")).one()
+    assert modified_at == datetime.fromtimestamp(os.stat(root / "a" / "b" / "c").st_mtime)
+
+def test_folder_is_rescanned_after_a_failed_diff(tmp_path, engine, monkeypatch):
+    root = tmp_path / "storage"
+    (root / "a" / "b").mkdir(parents=True)
+    reconciler.reconcile(str(root))
+
+    (root / "a" / "b" / "new.txt").write_text("new")
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if os.fspath(path) == str(root / "a" / "b"):
+            raise OSError(errno.EIO, "Input/output error", path)
+        return scandir(path)
+
+    monkeypatch.setattr(reconciler.os, "scandir", failing_scandir)
+    assert reconciler.reconcile(str(root)).errors == 1
+    monkeypatch.setattr(reconciler.os, "scandir", scandir)
+    reconciler.reconcile(str(root))
+
+    with Session(engine) as session:
+        paths = session.exec(select(FileEntry.path).order_by(FileEntry.path)).all()
+    assert paths == ["a", "a/b", "a/b/new.txt"]